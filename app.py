@@ -6,9 +6,17 @@ AI-CARE Lung Pro - 病人端
 """
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 from datetime import datetime, timedelta
+import functools
+import hashlib
+import html
+import importlib.util
 import json
+import os
 import re
+import threading
+import time
 import uuid
 
 # 載入設定和資料管理
@@ -20,20 +28,78 @@ except:
     SYSTEM_NAME = "AI-CARE Lung"
     HOSPITAL_NAME = "三軍總醫院"
 
+try:
+    from config import OPENAI_BASE_URL
+except:
+    OPENAI_BASE_URL = ""
+
+# 環境變數優先（部署平台的 secrets、本機壓力測試）
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") or OPENAI_API_KEY
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or OPENAI_BASE_URL
+
+try:
+    from config import ROUTER_ENABLED, ROUTER_CONFIDENCE_THRESHOLD
+except:
+    ROUTER_ENABLED = True
+    ROUTER_CONFIDENCE_THRESHOLD = 0.8
+
+try:
+    from config import STRUCTURED_EXTRACTION
+except:
+    STRUCTURED_EXTRACTION = False
+
+try:
+    from config import SESSION_HISTORY_LIMIT, SESSION_MAX_MESSAGES, SESSION_IDLE_TIMEOUT_MINUTES
+except:
+    SESSION_HISTORY_LIMIT = 16
+    SESSION_MAX_MESSAGES = 30
+    SESSION_IDLE_TIMEOUT_MINUTES = 30
+
+try:
+    from config import REPORT_WRITE_POLL_SECONDS
+except:
+    REPORT_WRITE_POLL_SECONDS = 2
+
+try:
+    from config import SESSION_STORE_ENABLED, SESSION_STORE_PATH, SESSION_CHECKPOINT_INTERVAL
+except:
+    SESSION_STORE_ENABLED = False
+    SESSION_STORE_PATH = "data/sessions.db"
+    SESSION_CHECKPOINT_INTERVAL = 2.0
+
+try:
+    from config import SESSION_TOKEN_TTL_MINUTES
+except:
+    SESSION_TOKEN_TTL_MINUTES = 60
+
+try:
+    from config import (
+        LLM_RATE_LIMIT_PER_MINUTE, LLM_RATE_LIMIT_BURST, LLM_MAX_CONCURRENT, USAGE_LEDGER_FILE
+    )
+except:
+    LLM_RATE_LIMIT_PER_MINUTE = 6
+    LLM_RATE_LIMIT_BURST = 6
+    LLM_MAX_CONCURRENT = 8
+    USAGE_LEDGER_FILE = "data/llm_usage.jsonl"
+
 try:
     from data_manager import (
-        get_or_create_patient, save_report, get_patient_reports
+        get_or_create_patient, submit_report, get_write_status, get_patient_reports,
+        get_score_series, get_patient_report_version, is_report_saved
     )
     DATA_MANAGER_AVAILABLE = True
 except:
     DATA_MANAGER_AVAILABLE = False
 
-# OpenAI
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except:
-    OPENAI_AVAILABLE = False
+from symptom_lexicon import SYMPTOM_LEXICON, extract_symptoms
+from session_memory import session_registry, SizeTracker
+from session_store import get_session_store
+from llm_usage import get_llm_guard, get_usage_ledger
+from id_generator import new_id
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# OpenAI（第一次需要 GPT 回應時才載入，加快啟動）
+OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None
 
 # ============================================
 # 頁面設定
@@ -98,6 +164,68 @@ SYSTEM_PROMPT = """你是三軍總醫院「AI-CARE Lung」智慧肺癌術後照
 - 用換行分段
 - 列點用「•」"""
 
+# ============================================
+# 結構化症狀擷取（function calling）
+# ============================================
+# 強制模型呼叫此工具：回覆內容與各症狀分數在同一次請求中取得
+SYMPTOM_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "record_symptom_report",
+        "description": "回覆病人，並記錄這一輪對話中病人回報的症狀",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "reply": {
+                    "type": "string",
+                    "description": "給病人的回覆，遵守對話原則與格式"
+                },
+                "symptoms": {
+                    "type": "array",
+                    "description": "病人本輪提到的症狀；沒有提到則為空陣列",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string", "enum": list(SYMPTOM_LEXICON)},
+                            "score": {
+                                "type": ["integer", "null"],
+                                "minimum": 0,
+                                "maximum": 10,
+                                "description": "0-10 分；病人未給分數則為 null"
+                            },
+                            "location": {
+                                "type": ["string", "null"],
+                                "description": "部位（例如傷口、胸口）；未提及則為 null"
+                            }
+                        },
+                        "required": ["name", "score", "location"],
+                        "additionalProperties": False
+                    }
+                },
+                "completed": {
+                    "type": "boolean",
+                    "description": "病人表示今天沒有其他要回報的"
+                }
+            },
+            "required": ["reply", "symptoms", "completed"],
+            "additionalProperties": False
+        },
+        "strict": True
+    }
+}
+
+# ============================================
+# 快速回覆
+# ============================================
+QUICK_REPLIES = [
+    ("😊 還不錯", "今天感覺還不錯"),
+    ("😓 有點累", "今天覺得有點累"),
+    ("😮‍💨 有點喘", "呼吸有點喘"),
+    ("😣 有點痛", "有點痛"),
+    ("✅ 都沒事", "都沒有不舒服，今天狀況很好"),
+    ("🏁 完成回報", "沒有其他要回報的了")
+]
+
 # ============================================
 # CSS 樣式
 # ============================================
@@ -194,9 +322,17 @@ if 'patient_id' not in st.session_state:
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 
+# 已渲染的對話 HTML（只附加新訊息）
+if 'chat_html' not in st.session_state:
+    st.session_state.chat_html = {"count": 0, "last_id": None, "html": ""}
+
 if 'conversation_history' not in st.session_state:
     st.session_state.conversation_history = []
 
+# 對話內容的估計大小（逐筆累計）
+if 'memory_tracker' not in st.session_state:
+    st.session_state.memory_tracker = SizeTracker()
+
 if 'current_score' not in st.session_state:
     st.session_state.current_score = 0
 
@@ -206,6 +342,20 @@ if 'symptoms_reported' not in st.session_state:
 if 'report_completed' not in st.session_state:
     st.session_state.report_completed = False
 
+if 'symptom_scores' not in st.session_state:
+    st.session_state.symptom_scores = {}
+
+if 'report_ticket' not in st.session_state:
+    st.session_state.report_ticket = None
+
+# 回報已確認存檔（隨對話進度一起保存，換副本後不必再查票號）
+if 'report_saved' not in st.session_state:
+    st.session_state.report_saved = False
+
+# 每次對話一個送出編號，重複儲存時更新同一筆回報
+if 'submission_id' not in st.session_state:
+    st.session_state.submission_id = str(uuid.uuid4())
+
 # ============================================
 # 病人註冊/登入頁面
 # ============================================
@@ -287,7 +437,7 @@ def render_registration():
                         st.error("此手機號碼已註冊，請直接登入")
                     else:
                         # 產生病人 ID
-                        patient_id = f"P{phone[-4:]}{datetime.now().strftime('%m%d')}"
+                        patient_id = new_id("P")
                         
                         # 儲存病人資料（手術資訊待個管師設定）
                         st.session_state.patient_info = {
@@ -306,6 +456,7 @@ def render_registration():
                         }
                         st.session_state.patient_id = patient_id
                         st.session_state.patient_registered = True
+                        start_persistent_session()
                         
                         # 儲存到資料管理
                         if DATA_MANAGER_AVAILABLE:
@@ -379,6 +530,7 @@ def render_registration():
                             pass
                     
                     if found == True:
+                        start_persistent_session()
                         st.success("✅ 登入成功！")
                         st.rerun()
                     elif found != "wrong_password":
@@ -402,60 +554,240 @@ def initialize_chat():
 
 您可以直接告訴我，或點選下方的快速回覆按鈕。"""
         
-        st.session_state.messages = [{
-            "role": "assistant",
-            "content": greeting,
-            "time": datetime.now().strftime("%H:%M")
-        }]
+        add_message("assistant", greeting, datetime.now().strftime("%H:%M"), source="greeting")
+
+# ============================================
+# 對話訊息
+# ============================================
+def add_message(role: str, content: str, time_str: str, source: str = None) -> dict:
+    """
+    新增一則訊息（HTML 在下次顯示對話時才渲染並附加到 chat_html）
+    助手訊息記下來源：greeting（開場）、rules（本地規則）、gpt
+    """
+    message = {
+        "id": uuid.uuid4().hex[:12],
+        "role": role,
+        "content": content,
+        "time": time_str
+    }
+    if source:
+        message["source"] = source
+    st.session_state.messages.append(message)
+    st.session_state.memory_tracker.add("messages", st.session_state.messages, [message])
+    return message
+
+def render_message_html(role: str, content: str, time_str: str) -> str:
+    """單則訊息的 HTML（每則只在第一次顯示時渲染一次，結果累積在 session 的 chat_html）"""
+    body = html.escape(content).replace(chr(10), '<br>')
+    
+    if role == "assistant":
+        return (
+            '<div style="display: flex; gap: 10px; margin-bottom: 12px;">'
+            '<div style="width: 36px; height: 36px; border-radius: 50%; background: linear-gradient(135deg, #10b981, #059669); display: flex; align-items: center; justify-content: center; flex-shrink: 0; font-size: 18px; box-shadow: 0 4px 12px rgba(16,185,129,0.3);">🤖</div>'
+            '<div style="flex: 1;">'
+            f'<div style="font-size: 11px; color: #64748b; margin-bottom: 4px;">健康小助手 · {html.escape(time_str)}</div>'
+            f'<div class="chat-ai">{body}</div>'
+            '</div></div>'
+        )
+    
+    return (
+        '<div style="display: flex; justify-content: flex-end; margin-bottom: 12px;">'
+        '<div style="max-width: 85%;">'
+        f'<div style="font-size: 11px; color: #64748b; margin-bottom: 4px; text-align: right;">{html.escape(time_str)}</div>'
+        f'<div class="chat-user">{body}</div>'
+        '</div></div>'
+    )
+
+def get_chat_history_html() -> str:
+    """整段對話的 HTML；只渲染上次之後新增的訊息"""
+    messages = st.session_state.messages
+    cache = st.session_state.chat_html
+    count = cache.get("count", 0)
+    
+    # 對話被清空或截斷時重建
+    if count > len(messages) or (count and messages[count - 1].get("id") != cache.get("last_id")):
+        cache = {"count": 0, "last_id": None, "html": ""}
+        count = 0
+    
+    if count < len(messages):
+        new_parts = [
+            render_message_html(m["role"], m["content"], m.get("time", ""))
+            for m in messages[count:]
+        ]
+        cache = {
+            "count": len(messages),
+            "last_id": messages[-1].get("id"),
+            "html": cache.get("html", "") + "".join(new_parts)
+        }
+    
+    st.session_state.chat_html = cache
+    return cache.get("html", "")
 
 # ============================================
 # GPT 回應
 # ============================================
-def get_gpt_response(user_message: str) -> str:
-    """取得 GPT 回應"""
+def get_gpt_response(user_message: str) -> tuple:
+    """取得 GPT 回應，回傳 (回應, 來源)；無法使用 GPT 時改用本地規則，來源為 rules"""
     
     if not OPENAI_AVAILABLE or not OPENAI_API_KEY:
-        return get_fallback_response(user_message)
+        return get_fallback_response(user_message), "rules"
+    
+    # 頻率限制與同時呼叫上限
+    patient_id = st.session_state.patient_id
+    guard = get_llm_guard(LLM_RATE_LIMIT_PER_MINUTE, LLM_RATE_LIMIT_BURST, LLM_MAX_CONCURRENT)
+    ledger = get_usage_ledger(USAGE_LEDGER_FILE)
     
+    status = guard.acquire(patient_id)
+    if status != "ok":
+        ledger.record(patient_id, DEFAULT_MODEL, status)
+        return get_fallback_response(user_message), "rules"
+    
+    start = time.perf_counter()
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        client = get_openai_client(OPENAI_API_KEY, OPENAI_BASE_URL)
         
-        for msg in st.session_state.conversation_history[-16:]:
-            messages.append(msg)
+        messages = build_prompt_messages(user_message)
         
-        messages.append({"role": "user", "content": user_message})
+        if STRUCTURED_EXTRACTION:
+            response = client.chat.completions.create(
+                model=DEFAULT_MODEL,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=700,
+                tools=[SYMPTOM_TOOL],
+                tool_choice={"type": "function", "function": {"name": "record_symptom_report"}}
+            )
+            assistant_message = apply_symptom_tool_call(response.choices[0].message)
+        else:
+            response = client.chat.completions.create(
+                model=DEFAULT_MODEL,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=500
+            )
+            assistant_message = response.choices[0].message.content
         
-        response = client.chat.completions.create(
-            model=DEFAULT_MODEL,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
+        usage = response.usage
+        details = getattr(usage, "prompt_tokens_details", None)
+        ledger.record(
+            patient_id, DEFAULT_MODEL, "ok",
+            latency_ms=(time.perf_counter() - start) * 1000,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+            prefix_hash=get_prompt_prefix_hash(STRUCTURED_EXTRACTION)
         )
         
-        assistant_message = response.choices[0].message.content
+        if not assistant_message:
+            return get_fallback_response(user_message), "rules"
         
-        st.session_state.conversation_history.append({"role": "user", "content": user_message})
-        st.session_state.conversation_history.append({"role": "assistant", "content": assistant_message})
+        append_history(user_message, assistant_message)
         
-        return assistant_message
+        return assistant_message, "gpt"
         
     except Exception as e:
-        return get_fallback_response(user_message)
+        ledger.record(
+            patient_id, DEFAULT_MODEL, "error",
+            latency_ms=(time.perf_counter() - start) * 1000,
+            error=type(e).__name__
+        )
+        return get_fallback_response(user_message), "rules"
+    
+    finally:
+        guard.release()
+
+# ============================================
+# Prompt 組裝
+# ============================================
+# 固定前綴（SYSTEM_PROMPT 與工具定義）每次請求都逐位元組相同，
+# 供應商端的 prompt 快取才能命中；會變動的病人資料一律放在前綴之後
+PATIENT_CONTEXT_TEMPLATE = "【病人資料】姓名：{name}｜術後第 {post_op_day} 天｜手術：{surgery_type}"
+
+def build_prompt_messages(user_message: str) -> list:
+    """固定前綴 → 病人資料 → 最近對話 → 本輪訊息"""
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": build_patient_context(st.session_state.patient_info)}
+    ]
+    messages.extend(st.session_state.conversation_history[-SESSION_HISTORY_LIMIT:])
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+def build_patient_context(patient_info: dict) -> str:
+    """固定格式的病人資料區塊"""
+    return PATIENT_CONTEXT_TEMPLATE.format(
+        name=patient_info.get("name") or "未提供",
+        post_op_day=patient_info.get("post_op_day", 0),
+        surgery_type=patient_info.get("surgery_type") or "未提供"
+    )
+
+@st.cache_data(show_spinner=False)
+def get_prompt_prefix_hash(structured: bool) -> str:
+    """固定前綴的雜湊，記入用量紀錄以對照快取命中（cached_tokens）"""
+    prefix = {"system": SYSTEM_PROMPT, "tools": [SYMPTOM_TOOL] if structured else []}
+    payload = json.dumps(prefix, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:12]
+
+def append_history(user_message: str, assistant_message: str):
+    """加入 GPT 對話歷史，只保留最近幾輪"""
+    history = st.session_state.conversation_history
+    tracker = st.session_state.memory_tracker
+    turn = [{"role": "user", "content": user_message}, {"role": "assistant", "content": assistant_message}]
+    history.extend(turn)
+    tracker.add("conversation_history", history, turn)
+    
+    removed = history[:-SESSION_HISTORY_LIMIT]
+    del history[:-SESSION_HISTORY_LIMIT]
+    tracker.remove("conversation_history", history, removed)
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key: str, base_url: str = ""):
+    """建立共用的 OpenAI client（延遲載入 openai 套件）"""
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, base_url=base_url or None)
+
+def apply_symptom_tool_call(message) -> str:
+    """套用模型回傳的症狀紀錄，回傳給病人的回覆"""
+    if not message.tool_calls:
+        return message.content
+    
+    args = json.loads(message.tool_calls[0].function.arguments)
+    
+    for item in args.get("symptoms", []):
+        name = item.get("name")
+        if name not in SYMPTOM_LEXICON:
+            continue
+        if name not in st.session_state.symptoms_reported:
+            st.session_state.symptoms_reported.append(name)
+        
+        score = item.get("score")
+        if score is not None:
+            score = max(0, min(int(score), 10))
+            entry = st.session_state.symptom_scores.get(name, {"score": 0, "location": None})
+            entry["score"] = max(entry["score"], score)
+            if item.get("location"):
+                entry["location"] = item["location"]
+            st.session_state.symptom_scores[name] = entry
+            st.session_state.current_score = max(st.session_state.current_score, score)
+    
+    if args.get("completed"):
+        st.session_state.report_completed = True
+    
+    return args.get("reply") or message.content
 
 def get_fallback_response(user_message: str) -> str:
     """備用回應邏輯"""
-    msg = user_message.lower() if user_message else ""
+    hits = extract_symptoms(user_message)
+    symptoms = hits["symptoms"]
     
     # 呼吸相關
-    if any(word in msg for word in ['喘', '呼吸', '悶', '吸不到氣']):
+    if "呼吸困難" in symptoms:
         return """了解，呼吸有些不順的感覺。
 
 請問用 0 到 10 分來評估，0 分是完全不喘，10 分是非常喘，您覺得大概幾分呢？"""
 
     # 疼痛相關
-    elif any(word in msg for word in ['痛', '疼', '刺']):
+    elif "疼痛" in symptoms:
         return """了解您有疼痛的感覺。
 
 請問：
@@ -463,7 +795,7 @@ def get_fallback_response(user_message: str) -> str:
 • 用 0-10 分評估，大概幾分？"""
 
     # 咳嗽相關
-    elif any(word in msg for word in ['咳', '痰']):
+    elif "咳嗽" in symptoms:
         return """好的，關於咳嗽的問題。
 
 請問：
@@ -471,13 +803,13 @@ def get_fallback_response(user_message: str) -> str:
 • 咳嗽嚴重程度 0-10 分大概幾分？"""
 
     # 疲勞相關
-    elif any(word in msg for word in ['累', '疲', '沒力', '虛弱']):
+    elif "疲勞" in symptoms:
         return """謝謝您告訴我。疲勞是術後常見的症狀。
 
 請問這個疲勞感用 0-10 分評估，大概幾分呢？"""
 
     # 正向回應
-    elif any(word in msg for word in ['不錯', '還好', '好', '正常', '沒事', '很好']):
+    elif "positive" in hits["intents"]:
         return """太好了，很高興您今天感覺不錯！😊
 
 簡單確認一下：
@@ -488,14 +820,12 @@ def get_fallback_response(user_message: str) -> str:
 如果都沒問題，今天的回報就完成囉！"""
 
     # 處理分數
-    elif re.search(r'\d+', msg):
-        numbers = re.findall(r'\d+', msg)
-        if numbers:
-            score = min(int(numbers[0]), 10)
-            st.session_state.current_score = max(st.session_state.current_score, score)
-            
-            if score >= 7:
-                return f"""收到，{score} 分是比較嚴重的狀況。
+    elif hits["scores"]:
+        score = hits["scores"][0]
+        st.session_state.current_score = max(st.session_state.current_score, score)
+        
+        if score >= 7:
+            return f"""收到，{score} 分是比較嚴重的狀況。
 
 ⚠️ 我已經通知個案管理師，她會盡快與您聯繫。
 
@@ -505,9 +835,9 @@ def get_fallback_response(user_message: str) -> str:
 • 若有加重，請撥打緊急電話
 
 請問還有其他不舒服嗎？"""
-            
-            elif score >= 4:
-                return f"""收到，{score} 分屬於中度不適。
+        
+        elif score >= 4:
+            return f"""收到，{score} 分屬於中度不適。
 
 💡 建議您：
 • 噘嘴式呼吸：鼻吸 2 秒，噘嘴吐 4 秒
@@ -515,9 +845,9 @@ def get_fallback_response(user_message: str) -> str:
 • 適度活動
 
 個管師會關心您的狀況。還有其他不舒服嗎？"""
-            
-            else:
-                return f"""收到，{score} 分是輕微的程度！
+        
+        else:
+            return f"""收到，{score} 分是輕微的程度！
 
 ✅ 已記錄
 
@@ -529,7 +859,7 @@ def get_fallback_response(user_message: str) -> str:
 還有其他想回報的嗎？"""
 
     # 完成/結束
-    elif any(word in msg for word in ['沒有', '沒了', '就這樣', '結束', '完成', '都沒']):
+    elif "complete" in hits["intents"]:
         st.session_state.report_completed = True
         return """✅ 今日症狀回報完成！
 
@@ -537,6 +867,12 @@ def get_fallback_response(user_message: str) -> str:
 
 明天見！祝您有美好的一天 🌟"""
 
+    # 只有否定的症狀（例如「不喘了」）
+    elif hits["negated"]:
+        return """太好了，很高興聽到有改善！😊
+
+還有其他想回報的嗎？如果都沒問題，今天的回報就完成囉！"""
+
     # 預設
     else:
         return """謝謝您的回覆。
@@ -548,61 +884,235 @@ def get_fallback_response(user_message: str) -> str:
 
 或直接點選上方的快速回覆按鈕。"""
 
+# ============================================
+# 本地意圖路由
+# ============================================
+# 規則已能處理的簡單回覆（快速回覆、單純分數、結束語）直接在本地回應，
+# 只有開放式的自由文字才送給 GPT。
+# 備用回應有專門處理的症狀
+SYMPTOM_ROUTES = {
+    "呼吸困難": "breathing",
+    "疼痛": "pain",
+    "咳嗽": "cough",
+    "疲勞": "fatigue",
+}
+
+QUICK_REPLY_ROUTES = {
+    "今天感覺還不錯": "positive",
+    "今天覺得有點累": "fatigue",
+    "呼吸有點喘": "breathing",
+    "有點痛": "pain",
+    "都沒有不舒服，今天狀況很好": "positive",
+    "沒有其他要回報的了": "complete",
+}
+
+# 明確的結束語；單獨的「沒有」、「好」可能是在回答 GPT 的是非題，不列在這裡
+COMPLETION_PHRASES = {"沒有了", "沒了", "都沒有了", "都沒了", "就這樣", "就這樣了", "結束", "完成回報"}
+
+SCORE_ONLY_PATTERN = re.compile(r'^\s*(?:我的整體不適程度是\s*)?(10|[0-9])\s*分?\s*[。.!！]?\s*$')
+
+# 短句（≤ 此長度）只命中一類關鍵字時視為簡單回覆
+SHORT_MESSAGE_LENGTH = 8
+
+# 對話中附上衛教單張的最低相關分數（BM25）
+MATERIAL_SUGGEST_MIN_SCORE = 5.0
+
+def record_route(route: str):
+    """本地回應記入用量紀錄，與 GPT 呼叫一起依日彙總（python llm_usage.py）"""
+    get_usage_ledger(USAGE_LEDGER_FILE).record(st.session_state.patient_id, "router", "local", route=route)
+
+def last_reply_is_local() -> bool:
+    """最近一則助手訊息是否為開場白或本地規則的回應（舊紀錄沒有來源時視為 GPT）"""
+    for message in reversed(st.session_state.messages):
+        if message["role"] == "assistant":
+            return message.get("source", "gpt") != "gpt"
+    return True
+
+def classify_intent(user_message: str, local_context: bool = True) -> tuple:
+    """
+    判斷訊息意圖，回傳 (路由, 信心值)
+    local_context 為 False（上一句是 GPT 問的）時，單純的是非回覆（「沒有」、「好」）交給 GPT
+    """
+    msg = user_message.strip().lower() if user_message else ""
+    
+    if not msg:
+        return "empty", 1.0
+    
+    # 快速回覆按鈕的固定字串
+    if msg in QUICK_REPLY_ROUTES:
+        return QUICK_REPLY_ROUTES[msg], 1.0
+    
+    # 單純分數（例如「5」、「7分」或評分滑桿送出的句子）
+    if SCORE_ONLY_PATTERN.match(msg):
+        return "score", 1.0
+    
+    # 結束語
+    if msg.rstrip("。.!！~ ") in COMPLETION_PHRASES:
+        return "complete", 0.95
+    
+    # 短句、無否定詞且只命中一類關鍵字
+    if len(msg) <= SHORT_MESSAGE_LENGTH:
+        hits = extract_symptoms(msg)
+        if hits["scores"] or hits["negated"]:
+            return "open", 0.0
+        if any(s not in SYMPTOM_ROUTES for s in hits["symptoms"]):
+            return "open", 0.0
+        if not hits["symptoms"] and not local_context:
+            return "open", 0.0
+        matched = [SYMPTOM_ROUTES[s] for s in hits["symptoms"]] + hits["intents"]
+        if len(matched) == 1:
+            return matched[0], 0.85
+        if matched:
+            return matched[0], 0.5
+    
+    return "open", 0.0
+
+def route_message(user_message: str):
+    """簡單回覆在本地處理；需要 GPT 時回傳 None"""
+    if not ROUTER_ENABLED:
+        return None
+    
+    route, confidence = classify_intent(user_message, last_reply_is_local())
+    if confidence < ROUTER_CONFIDENCE_THRESHOLD:
+        return None
+    
+    record_route(route)
+    response = get_fallback_response(user_message)
+    
+    # 寫入對話歷史，讓後續 GPT 回合仍有完整脈絡
+    append_history(user_message, response)
+    
+    return response
+
 def process_input(user_input: str):
     """處理使用者輸入"""
     now = datetime.now().strftime("%H:%M")
+    was_completed = st.session_state.report_completed
     
-    st.session_state.messages.append({
-        "role": "user",
-        "content": user_input,
-        "time": now
-    })
+    add_message("user", user_input, now)
     
     # 記錄症狀關鍵字
-    keywords = {
-        "呼吸困難": ['喘', '呼吸', '悶'],
-        "疼痛": ['痛', '疼'],
-        "咳嗽": ['咳', '痰'],
-        "疲勞": ['累', '疲', '沒力'],
-        "睡眠問題": ['睡', '失眠'],
-        "食慾不振": ['吃', '食', '胃口']
-    }
-    
-    for symptom, words in keywords.items():
-        if any(w in user_input for w in words):
-            if symptom not in st.session_state.symptoms_reported:
-                st.session_state.symptoms_reported.append(symptom)
+    symptoms = extract_symptoms(user_input)["symptoms"]
+    for symptom in symptoms:
+        if symptom not in st.session_state.symptoms_reported:
+            st.session_state.symptoms_reported.append(symptom)
     
     # 取得回應
-    with st.spinner(""):
-        response = get_gpt_response(user_input)
+    response = route_message(user_input)
+    source = "rules"
+    if response is None:
+        with st.spinner(""):
+            response, source = get_gpt_response(user_input)
     
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": response,
-        "time": now
-    })
+    if symptoms and not st.session_state.report_completed:
+        response += suggest_material(user_input, symptoms)
     
-    # 儲存回報（如果資料管理可用）
-    if DATA_MANAGER_AVAILABLE and st.session_state.report_completed:
-        try:
-            save_report(st.session_state.patient_id, {
-                "symptoms": st.session_state.symptoms_reported,
-                "overall_score": st.session_state.current_score,
-                "conversation": st.session_state.messages
-            })
-        except:
-            pass
+    add_message("assistant", response, now, source=source)
+    
+    # 儲存回報（如果資料管理可用），交給背景寫入，不阻塞畫面
+    if st.session_state.report_completed:
+        submit_current_report()
+    
+    checkpoint_session()
     
-    st.rerun()
+    # 回報狀態改變時標題卡也要更新，才重跑整頁
+    if st.session_state.report_completed != was_completed:
+        st.rerun()
+    rerun_fragment()
+
+def submit_current_report():
+    """把目前的對話排入背景寫入（相同 submission_id 重複送出會合併成同一筆回報）"""
+    if not DATA_MANAGER_AVAILABLE:
+        return
+    try:
+        st.session_state.report_ticket = submit_report(st.session_state.patient_id, {
+            "submission_id": st.session_state.submission_id,
+            "symptoms": list(st.session_state.symptoms_reported),
+            "scores": dict(st.session_state.symptom_scores),
+            "overall_score": st.session_state.current_score,
+            "conversation": list(st.session_state.messages)
+        })
+        st.session_state.report_saved = False
+        from education_system import invalidate_recommendations
+        invalidate_recommendations(st.session_state.patient_id)
+    except:
+        pass
+
+def suggest_material(user_input: str, symptoms: list) -> str:
+    """病人提到症狀時附上最相關的衛教單張（同一份只推薦一次）"""
+    try:
+        from education_system import search_materials
+    except ImportError:
+        return ""
+    
+    query = " ".join([user_input] + [k for name in symptoms for k in SYMPTOM_LEXICON.get(name, [])])
+    suggested = st.session_state.setdefault("suggested_materials", [])
+    for result in search_materials(query, limit=3, min_score=MATERIAL_SUGGEST_MIN_SCORE):
+        if result["key"] not in suggested:
+            suggested.append(result["key"])
+            return f"\n\n📚 相關衛教：{result['icon']} {result['title']}（可到「衛教專區」搜尋閱讀）"
+    return ""
+
+def rerun_fragment():
+    """在 fragment 內只重跑該區塊，否則重跑整頁"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+# ============================================
+# 效能量測
+# ============================================
+@st.cache_resource
+def get_render_stats() -> dict:
+    """每個區塊（整頁 / 各 fragment）累計的伺服器 CPU 時間"""
+    return {"lock": threading.Lock(), "scopes": {}}
+
+def measure_cpu(scope: str):
+    """記錄函式執行時本執行緒使用的 CPU 時間"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.thread_time() - start
+                stats = get_render_stats()
+                with stats["lock"]:
+                    entry = stats["scopes"].setdefault(scope, {"runs": 0, "cpu_seconds": 0.0})
+                    entry["runs"] += 1
+                    entry["cpu_seconds"] += elapsed
+        return wrapper
+    return decorator
+
+def get_render_summary() -> dict:
+    """各區塊每次執行的平均 CPU 毫秒數"""
+    stats = get_render_stats()
+    with stats["lock"]:
+        return {
+            scope: {
+                "runs": entry["runs"],
+                "avg_cpu_ms": round(entry["cpu_seconds"] * 1000 / entry["runs"], 2)
+            }
+            for scope, entry in stats["scopes"].items() if entry["runs"]
+        }
 
 # ============================================
 # 主介面
 # ============================================
+@measure_cpu("app")
 def main():
+    release_expired_session()
+    
+    # 新連線（重啟或換到其他副本）時用 token 找回病人與對話進度
+    if not st.session_state.patient_registered:
+        resume_from_token()
+    
     # 如果尚未註冊，顯示註冊頁面
     if not st.session_state.patient_registered:
         render_registration()
+        prewarm_education()
         return
     
     # 已註冊，顯示主介面
@@ -647,7 +1157,17 @@ def main():
     """, unsafe_allow_html=True)
     
     # 頁籤：對話 / 衛教 / 紀錄
-    tab1, tab2, tab3 = st.tabs(["💬 每日回報", "📚 衛教專區", "📊 我的紀錄"])
+    # 衛教分頁標示未讀推送數（計數隨推送 / 已讀維護，不需掃描紀錄）
+    education_label = "📚 衛教專區"
+    try:
+        from education_system import education_manager
+        unread = education_manager.get_unread_count(st.session_state.patient_id)
+        if unread:
+            education_label += f" 🔴{unread}"
+    except ImportError:
+        pass
+    
+    tab1, tab2, tab3 = st.tabs(["💬 每日回報", education_label, "📊 我的紀錄"])
     
     with tab1:
         render_chat_interface()
@@ -661,31 +1181,182 @@ def main():
     # 緊急按鈕和登出
     render_footer()
 
+# ============================================
+# Session 記憶體管理
+# ============================================
+session_registry.idle_timeout = SESSION_IDLE_TIMEOUT_MINUTES * 60
+
+def report_persisted() -> bool:
+    """本次回報是否已寫入儲存"""
+    if st.session_state.report_saved:
+        return True
+    ticket = st.session_state.report_ticket
+    if not (DATA_MANAGER_AVAILABLE and ticket and get_write_status(ticket).get("state") == "saved"):
+        return False
+    st.session_state.report_saved = True
+    checkpoint_session()
+    return True
+
+def enforce_session_budget():
+    """回報儲存後，畫面上只保留最近的訊息、不再保留給 GPT 的對話歷史（完整對話已在回報中）"""
+    if not report_persisted():
+        return
+    messages = st.session_state.messages
+    if len(messages) > SESSION_MAX_MESSAGES:
+        removed = messages[:-SESSION_MAX_MESSAGES]
+        del messages[:-SESSION_MAX_MESSAGES]
+        st.session_state.memory_tracker.remove("messages", messages, removed)
+    if st.session_state.report_completed and st.session_state.conversation_history:
+        st.session_state.conversation_history = []
+
+@st.fragment(run_every=REPORT_WRITE_POLL_SECONDS)
+def watch_report_write():
+    """
+    回報儲存中時定期檢查；存檔（或失敗）後立刻釋放對話並重繪整頁，
+    病人送出後就放著分頁不動，也不必等到下次操作才釋放記憶體
+    """
+    if get_write_status(st.session_state.report_ticket).get("state") == "queued":
+        st.caption("📨 已收到您的回報，儲存中…")
+        return
+    enforce_session_budget()
+    track_session()
+    st.rerun(scope="app")
+
+def track_session():
+    """登記本 session 的記憶體用量，供閒置回收使用"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    
+    # 大小逐筆累計，不必每次重新序列化；已渲染的 HTML 以字元數估計
+    tracker = st.session_state.memory_tracker
+    size = (
+        tracker.size("messages", st.session_state.messages)
+        + tracker.size("conversation_history", st.session_state.conversation_history)
+        + len(st.session_state.chat_html.get("html", ""))
+    )
+    session_registry.touch(ctx.session_id, size, session_evictable())
+
+def session_evictable() -> bool:
+    """回報已儲存或尚未開始對話時，閒置後可以清空"""
+    return report_persisted() or len(st.session_state.messages) <= 1
+
+def release_expired_session():
+    """閒置過久被標記的 session：在自己的畫面執行中清空對話內容"""
+    ctx = get_script_run_ctx()
+    if ctx is None or not session_registry.pop_expired(ctx.session_id):
+        return
+    if not session_evictable():
+        return
+    st.session_state.messages = []
+    st.session_state.conversation_history = []
+    st.session_state.chat_html = {"count": 0, "last_id": None, "html": ""}
+
+# ============================================
+# Session 狀態外部儲存
+# ============================================
+# 需要跨重啟 / 跨副本保留的對話進度
+CHAT_STATE_KEYS = [
+    "messages", "conversation_history", "current_score", "symptoms_reported",
+    "symptom_scores", "report_completed", "submission_id", "report_ticket", "report_saved"
+]
+
+def get_store():
+    """外部儲存（未啟用時為 None）"""
+    if not SESSION_STORE_ENABLED:
+        return None
+    return get_session_store(SESSION_STORE_PATH, SESSION_CHECKPOINT_INTERVAL, SESSION_TOKEN_TTL_MINUTES * 60)
+
+def checkpoint_session():
+    """存下目前的對話進度（背景延遲寫入）"""
+    store = get_store()
+    if not store or not st.session_state.patient_id:
+        return
+    
+    state = {key: st.session_state[key] for key in CHAT_STATE_KEYS}
+    state["date"] = datetime.now().strftime("%Y-%m-%d")
+    store.checkpoint(st.session_state.patient_id, state)
+
+def restore_session():
+    """載入今天尚未結束的對話進度"""
+    store = get_store()
+    if not store:
+        return
+    
+    state = store.load(st.session_state.patient_id)
+    if not state or state.get("date") != datetime.now().strftime("%Y-%m-%d"):
+        return
+    
+    for key in CHAT_STATE_KEYS:
+        if key in state:
+            st.session_state[key] = state[key]
+    recover_report_ticket()
+
+def recover_report_ticket():
+    """
+    還原的寫入票號是其他副本（或重啟前的程序）發的，這裡查不到寫入狀態：
+    資料檔已有這次對話的回報就記為已存檔，否則重新送出（原程序若晚點寫入也會合併成同一筆）
+    """
+    ticket = st.session_state.report_ticket
+    if not (DATA_MANAGER_AVAILABLE and ticket and st.session_state.report_completed):
+        return
+    if st.session_state.report_saved or get_write_status(ticket).get("state") != "unknown":
+        return
+    if is_report_saved(st.session_state.patient_id, st.session_state.submission_id):
+        st.session_state.report_saved = True
+    else:
+        submit_current_report()
+
+def start_persistent_session():
+    """登入後發 token 並接續今天的對話"""
+    store = get_store()
+    if not store:
+        return
+    
+    st.query_params["session"] = store.create_token(st.session_state.patient_id, st.session_state.patient_info)
+    restore_session()
+
+def resume_from_token():
+    """新連線時用網址上的 token 找回病人身分，並換發新 token（網址上的舊 token 隨即失效）"""
+    store = get_store()
+    token = st.query_params.get("session")
+    if not store or not token:
+        return
+    
+    session = store.rotate_token(token)
+    if not session:
+        del st.query_params["session"]
+        return
+    
+    st.query_params["session"] = session["token"]
+    st.session_state.patient_id = session["patient_id"]
+    st.session_state.patient_info = session["patient_info"]
+    st.session_state.patient_registered = True
+    restore_session()
+
+def end_persistent_session():
+    """登出時作廢 token 並清除存檔"""
+    store = get_store()
+    if not store:
+        return
+    
+    token = st.query_params.get("session")
+    if token:
+        store.revoke_token(token)
+        del st.query_params["session"]
+    if st.session_state.patient_id:
+        store.delete(st.session_state.patient_id)
+
+@st.fragment
+@measure_cpu("chat")
 def render_chat_interface():
     """對話介面"""
+    enforce_session_budget()
+    
     st.markdown("### 💬 與健康小助手對話")
     
-    # 顯示訊息
-    for msg in st.session_state.messages:
-        if msg["role"] == "assistant":
-            st.markdown(f"""
-            <div style="display: flex; gap: 10px; margin-bottom: 12px;">
-                <div style="width: 36px; height: 36px; border-radius: 50%; background: linear-gradient(135deg, #10b981, #059669); display: flex; align-items: center; justify-content: center; flex-shrink: 0; font-size: 18px; box-shadow: 0 4px 12px rgba(16,185,129,0.3);">🤖</div>
-                <div style="flex: 1;">
-                    <div style="font-size: 11px; color: #64748b; margin-bottom: 4px;">健康小助手 · {msg.get('time', '')}</div>
-                    <div class="chat-ai">{msg['content'].replace(chr(10), '<br>')}</div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.markdown(f"""
-            <div style="display: flex; justify-content: flex-end; margin-bottom: 12px;">
-                <div style="max-width: 85%;">
-                    <div style="font-size: 11px; color: #64748b; margin-bottom: 4px; text-align: right;">{msg.get('time', '')}</div>
-                    <div class="chat-user">{msg['content']}</div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+    # 顯示訊息（整段對話一次輸出）
+    st.markdown(get_chat_history_html(), unsafe_allow_html=True)
     
     # 快速回覆
     if not st.session_state.report_completed:
@@ -693,16 +1364,8 @@ def render_chat_interface():
         st.markdown("**快速回覆**")
         
         cols = st.columns(2)
-        quick_replies = [
-            ("😊 還不錯", "今天感覺還不錯"),
-            ("😓 有點累", "今天覺得有點累"),
-            ("😮‍💨 有點喘", "呼吸有點喘"),
-            ("😣 有點痛", "有點痛"),
-            ("✅ 都沒事", "都沒有不舒服，今天狀況很好"),
-            ("🏁 完成回報", "沒有其他要回報的了")
-        ]
         
-        for i, (label, content) in enumerate(quick_replies):
+        for i, (label, content) in enumerate(QUICK_REPLIES):
             if cols[i % 2].button(label, key=f"quick_{i}", use_container_width=True):
                 process_input(content)
         
@@ -745,17 +1408,128 @@ def render_chat_interface():
         st.markdown("---")
         st.success("✅ 今日回報已完成！明天見 🌟")
         
+        if DATA_MANAGER_AVAILABLE and st.session_state.report_ticket:
+            write_state = "saved" if report_persisted() else get_write_status(st.session_state.report_ticket).get("state")
+            if write_state == "saved":
+                st.caption("💾 回報已安全儲存")
+            elif write_state == "failed":
+                st.caption("⚠️ 回報儲存失敗，系統會請個管師與您確認")
+            elif write_state == "queued":
+                watch_report_write()
+        
         if st.button("🔄 重新開始", use_container_width=True):
             st.session_state.messages = []
             st.session_state.conversation_history = []
             st.session_state.current_score = 0
             st.session_state.symptoms_reported = []
+            st.session_state.symptom_scores = {}
+            st.session_state.report_ticket = None
+            st.session_state.report_saved = False
+            st.session_state.submission_id = str(uuid.uuid4())
             st.session_state.report_completed = False
+            checkpoint_session()
             st.rerun()
+    
+    track_session()
 
 # ============================================
 # 衛教專區
 # ============================================
+@st.cache_resource(show_spinner=False)
+def prewarm_education():
+    """登入頁送出後，在背景先載入衛教內容（每個程序只做一次）"""
+    def load():
+        try:
+            import education_system
+            # 只讀取單張索引，內容等病人打開時才載入
+            len(education_system.EDUCATION_MATERIALS)
+        except:
+            pass
+    
+    thread = threading.Thread(target=load, name="education-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_data(show_spinner=False)
+def load_material_categories(version: int) -> dict:
+    """依類別分組的單張清單（不含內容）；version 改變時重新分組"""
+    from education_system import get_materials_by_category
+    return get_materials_by_category()
+
+@st.cache_data(max_entries=200, show_spinner=False)
+def render_material_body(key: str, version: int) -> str:
+    """單張的完整內容（說明 + 內文），每個版本只組一次"""
+    try:
+        from education_system import EDUCATION_MATERIALS
+        material = EDUCATION_MATERIALS.get(key)
+    except ImportError:
+        material = None
+    if not material:
+        return "衛教內容載入中..."
+    return f"**{material.get('description', '')}**\n\n---\n\n{material['content']}"
+
+def format_push_time(pushed_at: str) -> str:
+    """推送時間：今天 / 昨天 / 月/日"""
+    try:
+        pushed = datetime.fromisoformat(pushed_at)
+    except (TypeError, ValueError):
+        return ""
+    days = (datetime.now().date() - pushed.date()).days
+    prefix = "今天" if days == 0 else "昨天" if days == 1 else pushed.strftime("%m/%d")
+    return f"{prefix} {pushed.strftime('%H:%M')}"
+
+def toggle_material(scope: str, key: str):
+    """展開 / 收合單張（同一時間只展開一張）"""
+    opened = st.session_state.get("edu_open")
+    st.session_state.edu_open = None if opened == (scope, key) else (scope, key)
+    if st.session_state.edu_open:
+        log_material_event("opened", key)
+
+def log_material_event(event: str, key: str):
+    """記錄衛教互動事件（打開 / 提問），供閱讀率分析"""
+    try:
+        from education_system import record_engagement
+        record_engagement(event, st.session_state.patient_id, key,
+                          st.session_state.patient_info.get("post_op_day"))
+    except ImportError:
+        pass
+
+def render_material_list(materials: list, scope: str, version: int):
+    """單張清單：收合的只顯示標題，只有展開的那一張輸出內容"""
+    opened = st.session_state.get("edu_open")
+    for material in materials:
+        key = material.get("key")
+        is_open = opened == (scope, key)
+        label = f"{'▾' if is_open else '▸'} {material.get('icon', '📄')} {material.get('title', '')}"
+        st.button(label, key=f"edu_{scope}_{key}", use_container_width=True,
+                  on_click=toggle_material, args=(scope, key))
+        if is_open:
+            render_material_detail(scope, key, version)
+
+def render_material_detail(scope: str, key: str, version: int):
+    """展開的單張：內容與操作按鈕"""
+    with st.container(border=True):
+        st.markdown(render_material_body(key, version))
+        
+        # 標記已讀（有推送紀錄時寫入已讀回條）
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("✅ 我已閱讀", key=f"read_{scope}_{key}", use_container_width=True):
+                try:
+                    from education_system import education_manager
+                    education_manager.mark_material_read(
+                        st.session_state.patient_id, key, st.session_state.patient_info.get("post_op_day")
+                    )
+                except ImportError:
+                    pass
+                st.success("感謝您的閱讀！")
+        with col2:
+            if st.button("❓ 有問題想問", key=f"ask_{scope}_{key}", use_container_width=True):
+                log_material_event("asked", key)
+                st.info("您可以在「每日回報」中詢問健康小助手")
+
+@st.fragment
+@measure_cpu("education")
 def render_education_materials():
     """衛教專區"""
     st.markdown("### 📚 衛教專區")
@@ -772,46 +1546,52 @@ def render_education_materials():
     post_op_day = st.session_state.patient_info.get('post_op_day', 0)
     patient_id = st.session_state.patient_id
     
-    # 推薦衛教（根據術後天數）
-    st.markdown("#### 🎯 為您推薦")
+    version = EDUCATION_MATERIALS.get_version() if education_available else 0
     
-    # 定義推薦邏輯
-    if post_op_day <= 3:
-        recommended_keys = ["BREATHING_EXERCISE", "PAIN_MANAGEMENT", "EARLY_AMBULATION"]
-    elif post_op_day <= 7:
-        recommended_keys = ["WOUND_CARE", "HOME_CARE", "WARNING_SIGNS"]
-    elif post_op_day <= 14:
-        recommended_keys = ["PHYSICAL_ACTIVITY", "NUTRITION", "FOLLOW_UP"]
-    else:
-        recommended_keys = ["EMOTIONAL_SUPPORT", "SMOKING_CESSATION", "PHYSICAL_ACTIVITY"]
+    # 推薦衛教（術後天數、近期症狀、治療計畫、閱讀紀錄）
+    st.markdown("#### 🎯 為您推薦")
     
-    if education_available and EDUCATION_MATERIALS:
+    if education_available:
+        from education_system import recommend_materials
+        recommended = recommend_materials(
+            patient_id, post_op_day, st.session_state.patient_info.get("treatment")
+        )
         cols = st.columns(3)
-        for i, key in enumerate(recommended_keys[:3]):
-            material = EDUCATION_MATERIALS.get(key, {})
-            if material:
-                with cols[i]:
-                    st.markdown(f"""
-                    <div style="background: linear-gradient(135deg, #f0fdf4, #dcfce7); border-radius: 12px; padding: 16px; text-align: center; height: 140px;">
-                        <div style="font-size: 32px;">{material.get('icon', '📄')}</div>
-                        <div style="font-size: 13px; font-weight: 600; margin-top: 8px; color: #166534;">{material.get('title', '')[:10]}...</div>
-                        <div style="font-size: 11px; color: #64748b; margin-top: 4px;">點擊查看</div>
-                    </div>
-                    """, unsafe_allow_html=True)
+        for i, material in enumerate(recommended[:3]):
+            with cols[i]:
+                st.markdown(f"""
+                <div style="background: linear-gradient(135deg, #f0fdf4, #dcfce7); border-radius: 12px; padding: 16px; text-align: center; height: 140px;">
+                    <div style="font-size: 32px;">{material['icon']}</div>
+                    <div style="font-size: 13px; font-weight: 600; margin-top: 8px; color: #166534;">{html.escape(material['title'][:10])}...</div>
+                    <div style="font-size: 11px; color: #64748b; margin-top: 4px;">{html.escape(material['reason'])}</div>
+                </div>
+                """, unsafe_allow_html=True)
+                st.button("查看", key=f"edu_rec_{material['key']}", use_container_width=True,
+                          on_click=toggle_material, args=("rec", material["key"]))
+        
+        opened = st.session_state.get("edu_open")
+        if opened and opened[0] == "rec":
+            render_material_detail("rec", opened[1], version)
     
     st.markdown("---")
     
+    
+    # 搜尋
+    query = st.text_input("🔍 搜尋衛教單張", placeholder="例如：傷口、咳嗽、化療", key="edu_search")
+    if query and education_available:
+        from education_system import search_materials
+        results = search_materials(query, limit=5)
+        if not results:
+            st.caption("找不到相關的衛教單張，請換個關鍵字試試")
+        render_material_list(results, "search", version)
+        st.markdown("---")
+    
     # 全部衛教單張
     st.markdown("#### 📖 全部衛教單張")
     
     # 分類
-    categories = {}
     if education_available:
-        for key, material in EDUCATION_MATERIALS.items():
-            cat = material.get("category", "其他")
-            if cat not in categories:
-                categories[cat] = []
-            categories[cat].append({"key": key, **material})
+        categories = load_material_categories(version)
     else:
         # 簡化版
         categories = {
@@ -825,50 +1605,54 @@ def render_education_materials():
     
     # 顯示該類別的衛教單張
     if selected_cat in categories:
-        for material in categories[selected_cat]:
-            with st.expander(f"{material.get('icon', '📄')} {material.get('title', '')}"):
-                if education_available:
-                    full_material = EDUCATION_MATERIALS.get(material.get('key'), {})
-                    st.markdown(f"**{full_material.get('description', '')}**")
-                    st.markdown("---")
-                    st.markdown(full_material.get('content', '內容載入中...'))
-                else:
-                    st.info("衛教內容載入中...")
-                
-                # 標記已讀
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("✅ 我已閱讀", key=f"read_{material.get('key')}", use_container_width=True):
-                        st.success("感謝您的閱讀！")
-                with col2:
-                    if st.button("❓ 有問題想問", key=f"ask_{material.get('key')}", use_container_width=True):
-                        st.info("您可以在「每日回報」中詢問健康小助手")
-    
-    # 新收到的衛教
+        render_material_list(categories[selected_cat], "cat", version)
+    
+    # 個管師推送的衛教
     st.markdown("---")
     st.markdown("#### 📬 個管師推送給您的")
     
-    # 模擬推送紀錄
-    pushed_materials = [
-        {"title": "呼吸運動訓練指南", "time": "今天 10:30", "from": "護理師", "read": False},
-        {"title": "居家照護指南", "time": "昨天 14:20", "from": "護理師", "read": True},
-    ]
+    inbox = education_manager.get_inbox(patient_id) if education_available else []
+    if not inbox:
+        st.caption("目前沒有新的推送")
+    else:
+        unread = education_manager.get_unread_count(patient_id)
+        if unread:
+            st.caption(f"🆕 {unread} 份未讀")
     
-    for item in pushed_materials:
-        status_icon = "📖" if item["read"] else "🆕"
+    opened = st.session_state.get("edu_open")
+    for item in inbox:
+        is_read = item["status"] == "read"
+        status_icon = "📖" if is_read else "🆕"
+        sender = "系統自動推送" if item["pushed_by"] == "system" else item["pushed_by"]
         st.markdown(f"""
-        <div style="background: {'#f8fafc' if item['read'] else '#fef3c7'}; border-radius: 10px; padding: 12px; margin-bottom: 8px; border-left: 3px solid {'#94a3b8' if item['read'] else '#f59e0b'};">
+        <div style="background: {'#f8fafc' if is_read else '#fef3c7'}; border-radius: 10px; padding: 12px; margin-bottom: 8px; border-left: 3px solid {'#94a3b8' if is_read else '#f59e0b'};">
             <div style="display: flex; justify-content: space-between;">
-                <span style="font-weight: 600;">{status_icon} {item['title']}</span>
-                <span style="font-size: 12px; color: #64748b;">{item['time']}</span>
+                <span style="font-weight: 600;">{status_icon} {html.escape(item['material_title'])}</span>
+                <span style="font-size: 12px; color: #64748b;">{format_push_time(item['pushed_at'])}</span>
             </div>
-            <div style="font-size: 12px; color: #64748b; margin-top: 4px;">來自：{item['from']}</div>
+            <div style="font-size: 12px; color: #64748b; margin-top: 4px;">來自：{html.escape(sender)}</div>
         </div>
         """, unsafe_allow_html=True)
+        
+        is_open = opened == ("inbox", item["material_id"])
+        st.button("收合" if is_open else "📖 閱讀", key=f"edu_inbox_{item['id']}",
+                  on_click=toggle_material, args=("inbox", item["material_id"]))
+        if is_open:
+            render_material_detail("inbox", item["material_id"], version)
+            opened = None  # 同一張單張推送多次時只展開一次
+    
+    track_session()
 
 # ============================================
 # 我的紀錄
 # ============================================
+@st.cache_data(max_entries=1000, show_spinner=False)
+def load_score_series(patient_id: str, since: str, version: str) -> list:
+    """趨勢資料；version 為這位病人最新回報的時間，病人有新回報時才重新計算"""
+    return get_score_series(patient_id, since)
+
+@st.fragment
+@measure_cpu("records")
 def render_my_records():
     """我的紀錄"""
     st.markdown("### 📊 我的紀錄")
@@ -905,14 +1689,27 @@ def render_my_records():
     # 症狀趨勢
     st.markdown("#### 📈 症狀趨勢")
     
-    # 簡單的趨勢圖
-    import random
-    days = [f"D+{i}" for i in range(1, 8)]
-    scores = [random.randint(2, 6) for _ in range(7)]
-    scores[-1] = st.session_state.current_score if st.session_state.current_score > 0 else 2
+    # 術後至今的每日分數（伺服器端降採樣）
+    series = []
+    if DATA_MANAGER_AVAILABLE:
+        try:
+            series = load_score_series(
+                st.session_state.patient_id,
+                st.session_state.patient_info.get('surgery_date'),
+                get_patient_report_version(st.session_state.patient_id)
+            )
+        except:
+            series = []
     
-    chart_data = {"日期": days, "不適程度": scores}
-    st.line_chart(chart_data, x="日期", y="不適程度")
+    if series:
+        chart_data = {
+            "日期": [item["date"] for item in series],
+            "每日最高": [item["max"] for item in series],
+            "每日平均": [item["mean"] for item in series]
+        }
+        st.line_chart(chart_data, x="日期", y=["每日最高", "每日平均"])
+    else:
+        st.info("完成第一次回報後，這裡會顯示您的症狀趨勢")
     
     st.markdown("---")
     
@@ -961,11 +1758,14 @@ def render_footer():
         st.caption(f"👤 {st.session_state.patient_info.get('name', '')} ({st.session_state.patient_id})")
     with col2:
         if st.button("🚪 登出", use_container_width=True):
+            end_persistent_session()
             st.session_state.patient_registered = False
             st.session_state.patient_info = {}
             st.session_state.patient_id = ""
             st.session_state.messages = []
             st.session_state.conversation_history = []
+            st.session_state.symptom_scores = {}
+            st.session_state.submission_id = str(uuid.uuid4())
             st.session_state.report_completed = False
             st.rerun()
     
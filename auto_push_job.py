@@ -0,0 +1,91 @@
+"""
+AI-CARE Lung - 全體病人自動推送排程
+====================================
+
+一次掃過所有病人與其最新回報，算出所有該推送的衛教單張，
+與推送紀錄比對去重後一次寫入。建議每天排程執行（例如 cron）。
+
+使用方式：
+    python auto_push_job.py                    # 執行推送
+    python auto_push_job.py --dry-run          # 只列出會推送的內容
+    python auto_push_job.py --lookback-days 3  # 補推前幾天漏掉的術後天數規則
+"""
+
+import argparse
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from data_manager import get_all_patients
+from education_system import education_manager, rule_engine
+
+def post_op_day_of(patient: Dict, today: datetime) -> Optional[int]:
+    """依手術日期計算術後天數"""
+    try:
+        surgery_date = datetime.strptime(patient.get("surgery_date") or "", "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+    return (today.date() - surgery_date.date()).days
+
+def run_auto_push(dry_run: bool = False, lookback_days: int = 1, today: datetime = None) -> Dict:
+    """
+    計算並推送全體病人到期的衛教單張
+    lookback_days: 術後天數規則往前看幾天（排程停擺後補推）
+    """
+    today = today or datetime.now()
+    timings = {}
+
+    start = time.perf_counter()
+    patients = get_all_patients()
+    pushed_keys = education_manager.get_pushed_keys("auto")
+    timings["load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    due = []
+    for patient in patients:
+        day = post_op_day_of(patient, today)
+        materials = []
+        if day is not None:
+            for d in range(max(0, day - lookback_days + 1), day + 1):
+                materials.extend(rule_engine.match_materials(post_op_day=d))
+        materials.extend(rule_engine.match_materials(
+            symptoms=patient.get("last_symptoms"), treatment=patient.get("treatment")
+        ))
+
+        for material_id in materials:
+            key = (patient["id"], material_id)
+            if key in pushed_keys:
+                continue
+            pushed_keys.add(key)
+            due.append((patient["id"], patient.get("name", ""), material_id, day))
+    timings["evaluate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records = [] if dry_run else education_manager.push_materials(due, push_type="auto", pushed_by="system")
+    timings["commit"] = time.perf_counter() - start
+
+    return {
+        "patients": len(patients),
+        "due": due,
+        "pushed": len(records),
+        "dry_run": dry_run,
+        "timings_ms": {k: round(v * 1000, 1) for k, v in timings.items()}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="AI-CARE Lung 全體病人自動推送")
+    parser.add_argument("--dry-run", action="store_true", help="只列出會推送的內容，不寫入")
+    parser.add_argument("--lookback-days", type=int, default=1, help="術後天數規則往前看幾天")
+    args = parser.parse_args()
+
+    result = run_auto_push(dry_run=args.dry_run, lookback_days=args.lookback_days)
+
+    for patient_id, name, material_id, _ in result["due"]:
+        print(f"{patient_id}\t{name}\t{material_id}")
+    timings = result["timings_ms"]
+    action = "預計推送" if result["dry_run"] else "已推送"
+    print(f"病人 {result['patients']} 位，{action} {len(result['due'])} 筆")
+    print(f"讀取 {timings['load']} ms｜比對 {timings['evaluate']} ms｜寫入 {timings['commit']} ms")
+
+if __name__ == "__main__":
+    main()
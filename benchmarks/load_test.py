@@ -0,0 +1,196 @@
+"""
+AI-CARE Lung - 對話流程壓力測試
+================================
+
+以 streamlit.testing 同時模擬多位病人的對話（快速回覆、評分、自由文字），
+GPT 改接本機模擬伺服器，不消耗 API 額度。
+
+AppTest 不能在同一個程序中平行執行，因此以多個工作程序平行；
+每個程序同時開著分配到的所有 session，輪流推進每位病人的下一輪。
+每個程序使用自己的暫存資料目錄。
+
+輸出：每輪延遲 p50 / p95 / p99、吞吐量、GPT 呼叫數、prompt 快取命中率、資料檔寫入次數
+
+使用方式（在專案根目錄執行）：
+    python benchmarks/load_test.py --sessions 200 --workers 8
+    python benchmarks/load_test.py --replay data/patient_records.json   # 重播已儲存的對話
+    python benchmarks/load_test.py --base-url http://127.0.0.1:8765/v1  # 使用外部模擬伺服器
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 合成對話的素材
+QUICK_REPLY_LABELS = ["😊 還不錯", "😓 有點累", "😮‍💨 有點喘", "😣 有點痛", "✅ 都沒事"]
+FREE_TEXTS = [
+    "昨天晚上咳嗽到睡不太著，痰有一點黃",
+    "傷口今天比較癢，走路的時候會有點刺痛",
+    "爬樓梯的時候會喘，休息一下就好",
+    "胃口不太好，吃不太下東西",
+    "有點擔心回診的檢查結果",
+    "今天有出去散步二十分鐘，感覺還可以",
+]
+
+def synthetic_conversation(rng: random.Random) -> list:
+    """隨機產生一段對話：數輪快速回覆 / 評分 / 自由文字，最後完成回報"""
+    turns = []
+    for _ in range(rng.randint(2, 6)):
+        kind = rng.choice(["button", "score", "text"])
+        if kind == "button":
+            turns.append(("button", rng.choice(QUICK_REPLY_LABELS)))
+        elif kind == "score":
+            turns.append(("score", rng.randint(0, 10)))
+        else:
+            turns.append(("text", rng.choice(FREE_TEXTS)))
+    turns.append(("button", "🏁 完成回報"))
+    return turns
+
+def recorded_conversations(path: str) -> list:
+    """從資料檔取出病人說過的話，重播成自由文字輸入"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    conversations = []
+    for report in data.get("reports", []):
+        turns = [("text", m["content"]) for m in report.get("conversation", []) if m.get("role") == "user"]
+        if turns:
+            conversations.append(turns)
+    return conversations
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def start_session(index: int, timeout: float):
+    """建立一位已登入的模擬病人"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=timeout)
+    patient_id = f"LT{index:05d}"
+    at.session_state.patient_registered = True
+    at.session_state.patient_id = patient_id
+    at.session_state.patient_info = {
+        "id": patient_id, "name": f"測試{index}", "post_op_day": index % 30, "surgery_type": "肺葉切除術"
+    }
+    at.run()
+    return at
+
+def send_turn(at, kind: str, value) -> float:
+    """送出一輪輸入，回傳這一輪的延遲（秒）"""
+    if kind == "button":
+        next(b for b in at.button if b.label == value).click()
+    elif kind == "score":
+        at.slider(key="score_input").set_value(value)
+        next(b for b in at.button if b.label.startswith("📤 提交評分")).click()
+    else:
+        at.text_input(key="text_input").input(value)
+        next(b for b in at.button if b.label == "📤 送出").click()
+
+    start = time.perf_counter()
+    at.run()
+    return time.perf_counter() - start
+
+def run_worker(batch: list, timeout: float, base_url: str) -> dict:
+    """工作程序：開啟所有分配到的 session，輪流推進每位病人的下一輪"""
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+
+    # 在暫存目錄執行，避免寫入正式資料檔
+    os.chdir(tempfile.mkdtemp(prefix="aicare-load-"))
+    import data_manager
+
+    sessions = [(start_session(index, timeout), list(turns)) for index, turns in batch]
+    latencies = []
+    errors = 0
+
+    while any(turns for _, turns in sessions):
+        for at, turns in sessions:
+            if not turns:
+                continue
+            kind, value = turns.pop(0)
+            try:
+                latencies.append(send_turn(at, kind, value))
+                if at.exception:
+                    errors += 1
+            except (StopIteration, KeyError, RuntimeError):
+                errors += 1
+            if at.session_state.report_completed:
+                turns.clear()
+
+    data_manager.report_writer.flush(60)
+    return {
+        "latencies": latencies,
+        "errors": errors,
+        "completed": sum(1 for at, _ in sessions if at.session_state.report_completed),
+        "writes": data_manager.get_write_stats()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="AI-CARE Lung 對話流程壓力測試")
+    parser.add_argument("--sessions", type=int, default=100, help="模擬的病人數")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="平行的工作程序數")
+    parser.add_argument("--latency-ms", type=float, default=300, help="模擬 GPT 的回應延遲")
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--timeout", type=float, default=30, help="單輪執行逾時（秒）")
+    parser.add_argument("--replay", help="重播資料檔中的病人對話")
+    parser.add_argument("--base-url", help="使用外部的 OpenAI 相容伺服器")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.replay:
+        recorded = recorded_conversations(args.replay)
+        if not recorded:
+            sys.exit(f"{args.replay} 中沒有可重播的對話")
+        conversations = [recorded[i % len(recorded)] for i in range(args.sessions)]
+    else:
+        conversations = [synthetic_conversation(rng) for _ in range(args.sessions)]
+
+    mock_state = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        from mock_openai_server import start_server
+        _, mock_state, base_url = start_server(0, args.latency_ms, args.jitter_ms)
+
+    workers = max(1, min(args.workers, args.sessions))
+    batches = [list(enumerate(conversations))[i::workers] for i in range(workers)]
+
+    print(f"模擬 {args.sessions} 位病人，{workers} 個工作程序，GPT：{base_url}")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_worker, batches, [args.timeout] * workers, [base_url] * workers))
+    elapsed = time.perf_counter() - start
+
+    latencies = [lat for r in results for lat in r["latencies"]]
+    turns = len(latencies)
+    writes = sum(r["writes"]["writes"] for r in results)
+    written_bytes = sum(r["writes"]["bytes"] for r in results)
+
+    print(f"總輪數        {turns}")
+    print(f"完成回報      {sum(r['completed'] for r in results)} / {args.sessions}")
+    print(f"錯誤          {sum(r['errors'] for r in results)}")
+    print(f"每輪延遲 p50  {percentile(latencies, 50) * 1000:8.1f} ms")
+    print(f"每輪延遲 p95  {percentile(latencies, 95) * 1000:8.1f} ms")
+    print(f"每輪延遲 p99  {percentile(latencies, 99) * 1000:8.1f} ms")
+    print(f"吞吐量        {turns / elapsed:8.1f} 輪/秒（{elapsed:.1f} 秒）")
+    if mock_state:
+        print(f"GPT 呼叫      {mock_state.requests}")
+        hit_rate = mock_state.cached_prompt_tokens / mock_state.prompt_tokens if mock_state.prompt_tokens else 0
+        print(f"Prompt 快取   {hit_rate:.0%}（{mock_state.cached_prompt_tokens} / {mock_state.prompt_tokens} tokens）")
+    print(f"資料檔寫入    {writes} 次，{written_bytes / 1024:.0f} KB")
+
+if __name__ == "__main__":
+    main()
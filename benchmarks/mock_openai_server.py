@@ -0,0 +1,234 @@
+"""
+AI-CARE Lung - 模擬 OpenAI 伺服器
+==================================
+
+本機的 OpenAI 相容 /v1/chat/completions，用於壓力測試與離線測試，不消耗 API 額度。
+- 可設定固定延遲與隨機抖動
+- 支援強制工具呼叫（record_symptom_report）
+- 支援 JSON schema 結構化輸出（依 schema 名稱找對應的回應函式，如 report_analysis）
+- 回傳 usage，並模擬相同前綴的 prompt 快取（cached_tokens）
+
+使用方式：
+    python benchmarks/mock_openai_server.py --port 8765 --latency-ms 300
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock streamlit run app.py
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from symptom_lexicon import extract_symptoms
+
+# 約略的 token 估算：平均每 1.5 個字元一個 token
+CHARS_PER_TOKEN = 1.5
+
+# 供應商只快取 1024 tokens 以上、以 128 為單位的前綴
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+
+def estimate_tokens(text: str) -> int:
+    return max(1, int(len(text) / CHARS_PER_TOKEN))
+
+class MockState:
+    """伺服器統計與 prompt 快取"""
+
+    def __init__(self, latency_ms: float, jitter_ms: float):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.seen_blocks = set()
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+    def cached_tokens(self, prompt: str) -> int:
+        """以 128 tokens 為單位比對曾出現過的前綴，回傳最長命中的長度"""
+        block_chars = int(CACHE_BLOCK_TOKENS * CHARS_PER_TOKEN)
+        blocks = estimate_tokens(prompt) // CACHE_BLOCK_TOKENS
+        cached = 0
+        digest = hashlib.sha256()
+        with self.lock:
+            for i in range(blocks):
+                digest.update(prompt[i * block_chars:(i + 1) * block_chars].encode("utf-8"))
+                key = digest.copy().hexdigest()
+                if key in self.seen_blocks and cached == i * CACHE_BLOCK_TOKENS:
+                    cached = (i + 1) * CACHE_BLOCK_TOKENS
+                self.seen_blocks.add(key)
+        cached = cached if cached >= CACHE_MIN_TOKENS else 0
+        with self.lock:
+            self.prompt_tokens += estimate_tokens(prompt)
+            self.cached_prompt_tokens += cached
+        return cached
+
+def build_reply(user_message: str) -> dict:
+    """依最後一則病人訊息產生回覆與結構化症狀"""
+    hits = extract_symptoms(user_message)
+    score = hits["scores"][0] if hits["scores"] else None
+    completed = "complete" in hits["intents"]
+
+    if completed:
+        reply = "✅ 今日症狀回報完成！感謝您的回報。"
+    elif score is not None:
+        reply = f"收到，{score} 分。還有其他不舒服嗎？"
+    elif hits["symptoms"]:
+        reply = f"了解您有{hits['symptoms'][0]}的狀況，用 0-10 分評估大概幾分呢？"
+    else:
+        reply = "謝謝您的回覆，今天還有哪裡不舒服嗎？"
+
+    symptoms = [
+        {"name": name, "score": score, "location": None}
+        for name in hits["symptoms"]
+    ]
+    return {"reply": reply, "symptoms": symptoms, "completed": completed}
+
+# 夜間批次分析用的簡易關鍵字判斷
+ANALYSIS_FLAG_KEYWORDS = {
+    "fever": ["發燒", "發熱"],
+    "wound_concern": ["紅腫", "滲液", "流膿", "裂開"],
+    "breathing_at_rest": ["休息也喘", "躺著也喘", "坐著也喘"],
+    "emotional_distress": ["很焦慮", "睡不著", "想哭", "心情不好"],
+    "medication_issue": ["忘記吃藥", "沒吃藥", "副作用", "停藥"],
+    "wants_callback": ["打給我", "聯絡我", "回電"],
+}
+
+def build_report_analysis(body: dict) -> dict:
+    """report_analysis：逐筆以詞庫比對病人說的話，分數套用到前一個提到的症狀"""
+    user_message = next((m.get("content") or "" for m in reversed(body.get("messages", [])) if m.get("role") == "user"), "{}")
+    results = []
+    for item in json.loads(user_message).get("reports", []):
+        scores, negated, flags = {}, set(), []
+        last_symptoms = []
+        for line in item.get("conversation", []):
+            if not line.startswith("病人："):
+                continue
+            text = line[len("病人："):]
+            hits = extract_symptoms(text)
+            negated.update(hits["negated"])
+            if hits["symptoms"]:
+                last_symptoms = hits["symptoms"]
+            score = hits["scores"][0] if hits["scores"] else None
+            for name in last_symptoms:
+                if score is not None or name not in scores:
+                    scores[name] = score if score is not None else scores.get(name)
+            flags.extend(f for f, words in ANALYSIS_FLAG_KEYWORDS.items() if any(w in text for w in words))
+
+        symptoms = [{"name": n, "score": s, "negated": False} for n, s in scores.items()]
+        symptoms += [{"name": n, "score": None, "negated": True} for n in negated if n not in scores]
+        results.append({"report_id": item["report_id"], "symptoms": symptoms, "flags": sorted(set(flags))})
+    return {"results": results}
+
+# JSON schema 名稱 → 產生結構化輸出的函式
+SCHEMA_RESPONDERS = {
+    "report_analysis": build_report_analysis,
+}
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            state.count()
+
+            delay = state.latency_ms + random.uniform(-state.jitter_ms, state.jitter_ms)
+            time.sleep(max(0.0, delay) / 1000)
+
+            messages = body.get("messages", [])
+            # 與供應商相同：工具定義與訊息依序組成 prompt，快取以前綴比對
+            prompt_text = json.dumps(body.get("tools", []), ensure_ascii=False) + "".join(
+                f"{m.get('role')}:{m.get('content') or ''}" for m in messages
+            )
+            user_message = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+
+            message = {"role": "assistant", "content": None}
+            result = build_reply(user_message)
+            response_format = body.get("response_format") or {}
+            responder = SCHEMA_RESPONDERS.get((response_format.get("json_schema") or {}).get("name"))
+            if responder:
+                message["content"] = json.dumps(responder(body), ensure_ascii=False)
+                completion_text = message["content"]
+            elif body.get("tools"):
+                arguments = json.dumps(result, ensure_ascii=False)
+                message["tool_calls"] = [{
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": "record_symptom_report", "arguments": arguments}
+                }]
+                completion_text = arguments
+            else:
+                message["content"] = result["reply"]
+                completion_text = result["reply"]
+
+            prompt_tokens = estimate_tokens(prompt_text)
+            completion_tokens = estimate_tokens(completion_text)
+            payload = {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": state.cached_tokens(prompt_text)}
+                }
+            }
+
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+def start_server(port: int = 0, latency_ms: float = 300, jitter_ms: float = 50):
+    """在背景執行緒啟動，回傳 (server, state, base_url)"""
+    state = MockState(latency_ms, jitter_ms)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    return server, state, base_url
+
+def main():
+    parser = argparse.ArgumentParser(description="模擬 OpenAI 伺服器")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    server, _, base_url = start_server(args.port, args.latency_ms, args.jitter_ms)
+    print(f"模擬伺服器：{base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+AI-CARE Lung - 啟動時間量測
+============================
+
+量測各模組載入時間與第一次畫面渲染時間，超過預算時回傳非 0。
+
+使用方式（在專案根目錄執行）：
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --check      # 超過預算時失敗
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 每個模組在全新直譯器中的載入時間預算（秒）
+IMPORT_BUDGETS = {
+    "symptom_lexicon": 0.05,
+    "data_manager": 0.05,
+    "education_system": 0.1,
+    "openai": 1.5,
+    "streamlit": 2.0,
+}
+
+# 第一次渲染的預算（秒，不含 streamlit 本身的載入）
+RENDER_BUDGETS = {
+    "registration": 1.0,
+    "main": 2.0,
+}
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+RENDER_SNIPPET = """
+import json, sys, tempfile, time, os
+sys.path.insert(0, {root!r})
+os.chdir(tempfile.mkdtemp())
+from streamlit.testing.v1 import AppTest
+
+results = {{}}
+
+at = AppTest.from_file(os.path.join({root!r}, "app.py"), default_timeout=60)
+start = time.perf_counter()
+at.run()
+results["registration"] = time.perf_counter() - start
+
+at = AppTest.from_file(os.path.join({root!r}, "app.py"), default_timeout=60)
+at.session_state.patient_registered = True
+at.session_state.patient_info = {{"id": "P00000101", "name": "測試", "post_op_day": 3, "surgery_type": "肺葉切除術"}}
+at.session_state.patient_id = "P00000101"
+start = time.perf_counter()
+at.run()
+results["main"] = time.perf_counter() - start
+
+# 登入頁不應載入 openai
+results["openai_loaded_at_start"] = "openai" in sys.modules
+print(json.dumps(results))
+"""
+
+def run_python(code: str) -> str:
+    """在全新的直譯器中執行，避免模組快取影響結果"""
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return completed.stdout.strip().splitlines()[-1]
+
+def measure_imports(repeat: int) -> dict:
+    """各模組載入時間（取最小值）"""
+    results = {}
+    for module in IMPORT_BUDGETS:
+        try:
+            samples = [float(run_python(IMPORT_SNIPPET.format(module=module))) for _ in range(repeat)]
+            results[module] = min(samples)
+        except subprocess.CalledProcessError:
+            results[module] = None
+    return results
+
+def measure_render() -> dict:
+    """登入頁與主畫面第一次渲染時間"""
+    return json.loads(run_python(RENDER_SNIPPET.format(root=ROOT)))
+
+def main():
+    parser = argparse.ArgumentParser(description="啟動時間量測")
+    parser.add_argument("--repeat", type=int, default=3, help="每個模組量測次數")
+    parser.add_argument("--check", action="store_true", help="超過預算時回傳非 0")
+    args = parser.parse_args()
+
+    failures = []
+
+    print("模組載入時間")
+    for module, seconds in measure_imports(args.repeat).items():
+        budget = IMPORT_BUDGETS[module]
+        if seconds is None:
+            print(f"  {module:<20} 無法載入")
+            continue
+        flag = "OK" if seconds <= budget else "超過"
+        print(f"  {module:<20} {seconds * 1000:8.1f} ms  (預算 {budget * 1000:.0f} ms) {flag}")
+        if seconds > budget:
+            failures.append(module)
+
+    print("第一次渲染時間")
+    render = measure_render()
+    for page, budget in RENDER_BUDGETS.items():
+        seconds = render[page]
+        flag = "OK" if seconds <= budget else "超過"
+        print(f"  {page:<20} {seconds * 1000:8.1f} ms  (預算 {budget * 1000:.0f} ms) {flag}")
+        if seconds > budget:
+            failures.append(page)
+
+    if render["openai_loaded_at_start"]:
+        print("  ⚠️ 登入頁已載入 openai")
+        failures.append("openai_loaded_at_start")
+
+    if args.check and failures:
+        print(f"超過預算：{', '.join(failures)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,9 @@ AI-CARE Lung Pro - 設定檔
 # ============================================
 OPENAI_API_KEY = ""  # ← 填入您的 OpenAI API Key，例如 "sk-proj-xxxxx"
 DEFAULT_MODEL = "gpt-4o-mini"  # 可選：gpt-4o-mini, gpt-4o, gpt-3.5-turbo
+OPENAI_BASE_URL = ""  # 留空使用 OpenAI 官方；壓力測試時指向本機模擬伺服器
+
+STRUCTURED_EXTRACTION = False  # True：GPT 同時回傳各症狀分數（function calling）
 
 # ============================================
 # 管理後台登入帳號（可設定多組）
@@ -32,5 +35,42 @@ DEPARTMENT_NAME = "數位醫學中心"
 ALERT_THRESHOLD_RED = 7      # 紅色警示（≥7分）
 ALERT_THRESHOLD_YELLOW = 4   # 黃色警示（≥4分）
 
+# 本地意圖路由（簡單回覆不呼叫 GPT）
+ROUTER_ENABLED = True
+ROUTER_CONFIDENCE_THRESHOLD = 0.8   # 信心值 ≥ 此值才在本地回應
+
+# Session 記憶體上限
+SESSION_HISTORY_LIMIT = 16          # 保留給 GPT 的對話輪數（訊息數）
+SESSION_MAX_MESSAGES = 30           # 回報儲存後畫面上保留的訊息數
+SESSION_IDLE_TIMEOUT_MINUTES = 30   # 閒置多久後釋放已儲存的對話
+SESSION_MEMORY_STATS_FILE = "data/session_memory.json"  # 各 session 記憶體用量（python session_memory.py 查看）
+REPORT_WRITE_POLL_SECONDS = 2       # 回報儲存中時檢查是否已存檔的間隔
+
+# Session 狀態外部儲存（多副本部署、重啟後接續對話）
+SESSION_STORE_ENABLED = False
+SESSION_STORE_PATH = "data/sessions.db"
+SESSION_CHECKPOINT_INTERVAL = 2.0   # 延遲寫入間隔（秒）
+SESSION_TOKEN_TTL_MINUTES = 60      # 網址上 session token 的效期，每次找回時換發
+
+# GPT 用量控管
+LLM_RATE_LIMIT_PER_MINUTE = 6       # 每位病人每分鐘最多呼叫次數
+LLM_RATE_LIMIT_BURST = 6            # 可連續呼叫的次數
+LLM_MAX_CONCURRENT = 8              # 全系統同時進行中的呼叫上限
+USAGE_LEDGER_FILE = "data/llm_usage.jsonl"
+
+# 夜間批次分析（report_analysis.py）
+ANALYSIS_BATCH_SIZE = 20            # 每次請求合併的回報數
+ANALYSIS_WORKERS = 4                # 同時進行的請求數
+ANALYSIS_CHECKPOINT_FILE = "data/analysis_checkpoint.jsonl"
+
+# 衛教單張內容目錄（index.json + 每張一個 Markdown 檔）；留空使用程式旁的 education_content/
+EDUCATION_CONTENT_DIR = ""
+
+# 衛教互動紀錄（推送 / 打開 / 已讀 / 提問），匯出：python engagement.py export
+ENGAGEMENT_LOG_FILE = "data/engagement_events.jsonl"
+
+# 多副本部署時每個副本設定不同的編號（0-1023），讓產生的 ID 不重複；留空自動產生
+NODE_ID = ""
+
 # 資料檔案路徑
 DATA_FILE = "data/patient_records.json"
@@ -5,14 +5,60 @@ AI-CARE Lung Pro - 資料管理模組
 處理病人回報資料的讀取與儲存
 """
 
+import atexit
 import json
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict, List, Optional
-import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows：只有程序內的鎖
+
+from id_generator import new_id
 
 DATA_FILE = "data/patient_records.json"
 
+# 衛教推送紀錄另存一個只附加的檔案：推送、已讀都只寫一行，不必重寫整個資料檔，
+# 也不會因回報寫入而讓推送索引失效
+PUSH_FILE = "data/push_records.jsonl"
+
+# 讀取-修改-寫入 需在同一把鎖內完成，避免背景寫入與前景寫入互相覆蓋
+_data_lock = threading.RLock()
+
+# 跨程序的寫入鎖（夜間分析、去重等排程與線上的應用程式同時寫同一個資料檔）
+_file_lock = {"depth": 0, "file": None}
+
+@contextmanager
+def _data_write_lock():
+    """
+    讀取-修改-寫入 用的鎖：程序內的 _data_lock 加上資料檔旁的 .lock 檔（flock）
+    同一執行緒可重入；其他程序要等這次寫完才能讀到最新內容再改
+    """
+    with _data_lock:
+        if _file_lock["depth"] == 0 and fcntl is not None:
+            os.makedirs(os.path.dirname(DATA_FILE) or ".", exist_ok=True)
+            lock_file = open(f"{DATA_FILE}.lock", "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _file_lock["file"] = lock_file
+        _file_lock["depth"] += 1
+        try:
+            yield
+        finally:
+            _file_lock["depth"] -= 1
+            if _file_lock["depth"] == 0 and _file_lock["file"] is not None:
+                _file_lock["file"].close()  # 關檔即釋放 flock
+                _file_lock["file"] = None
+
+# 寫檔次數與位元組數（壓力測試、監控用）
+_write_stats = {"writes": 0, "bytes": 0}
+
 def ensure_data_file():
     """確保資料檔案存在"""
     os.makedirs("data", exist_ok=True)
@@ -36,78 +82,177 @@ def load_data() -> Dict:
         return {"patients": {}, "reports": [], "alerts": [], "interventions": []}
 
 def save_data(data: Dict):
-    """儲存資料"""
+    """儲存資料（先寫暫存檔再取代，避免寫到一半損毀）"""
     ensure_data_file()
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
+    tmp_file = f"{DATA_FILE}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_file, DATA_FILE)
+    
+    with _data_lock:
+        _write_stats["writes"] += 1
+        _write_stats["bytes"] += size
+
+def get_write_stats() -> Dict:
+    """累計寫檔次數與位元組數"""
+    with _data_lock:
+        return dict(_write_stats)
 
 def get_or_create_patient(patient_id: str, patient_info: Dict = None) -> Dict:
     """取得或建立病人資料"""
-    data = load_data()
-    
-    if patient_id not in data["patients"]:
-        # 建立新病人
-        data["patients"][patient_id] = {
-            "id": patient_id,
-            "name": patient_info.get("name", f"病人{patient_id[-4:]}") if patient_info else f"病人{patient_id[-4:]}",
-            "age": patient_info.get("age", 65) if patient_info else 65,
-            "surgery": patient_info.get("surgery", "肺葉切除術") if patient_info else "肺葉切除術",
-            "surgery_date": patient_info.get("surgery_date", datetime.now().strftime("%Y-%m-%d")) if patient_info else datetime.now().strftime("%Y-%m-%d"),
-            "diagnosis": patient_info.get("diagnosis", "肺癌") if patient_info else "肺癌",
-            "phone": patient_info.get("phone", "") if patient_info else "",
-            "created_at": datetime.now().isoformat(),
-            "last_report": None,
-            "total_reports": 0,
-            "compliance_rate": 0
-        }
-        save_data(data)
-    
-    return data["patients"][patient_id]
+    with _data_write_lock():
+        data = load_data()
+        
+        if patient_id not in data["patients"]:
+            # 建立新病人
+            data["patients"][patient_id] = {
+                "id": patient_id,
+                "name": patient_info.get("name", f"病人{patient_id[-4:]}") if patient_info else f"病人{patient_id[-4:]}",
+                "age": patient_info.get("age", 65) if patient_info else 65,
+                "surgery": patient_info.get("surgery", "肺葉切除術") if patient_info else "肺葉切除術",
+                "surgery_date": patient_info.get("surgery_date", datetime.now().strftime("%Y-%m-%d")) if patient_info else datetime.now().strftime("%Y-%m-%d"),
+                "diagnosis": patient_info.get("diagnosis", "肺癌") if patient_info else "肺癌",
+                "phone": patient_info.get("phone", "") if patient_info else "",
+                "created_at": datetime.now().isoformat(),
+                "last_report": None,
+                "total_reports": 0,
+                "compliance_rate": 0
+            }
+            save_data(data)
+        
+        return data["patients"][patient_id]
 
 def save_report(patient_id: str, report: Dict):
     """儲存症狀回報"""
-    data = load_data()
-    
-    # 建立回報記錄
-    report_record = {
-        "id": str(uuid.uuid4())[:8],
-        "patient_id": patient_id,
-        "timestamp": datetime.now().isoformat(),
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "time": datetime.now().strftime("%H:%M"),
-        "symptoms": report.get("symptoms", []),
-        "scores": report.get("scores", {}),
-        "overall_score": report.get("overall_score", 0),
-        "conversation": report.get("conversation", []),
-        "status": "completed"
-    }
+    with _data_write_lock():
+        data = load_data()
+        report_record = apply_report(data, patient_id, report)
+        save_data(data)
+    return report_record
+
+def save_reports(items: List[tuple]) -> List[Dict]:
+    """一次寫入多筆回報 [(patient_id, report), ...]"""
+    with _data_write_lock():
+        data = load_data()
+        records = [apply_report(data, patient_id, report) for patient_id, report in items]
+        save_data(data)
+    return records
+
+def apply_report(data: Dict, patient_id: str, report: Dict) -> Dict:
+    """
+    把一筆回報加入 data（不寫檔）
+    同一次對話（相同 submission_id）重複送出時更新原紀錄，不另建新回報
+    """
+    submission_id = report.get("submission_id")
+    report_record = find_report_by_submission(data, patient_id, submission_id)
     
-    data["reports"].append(report_record)
+    if report_record:
+        merge_report(report_record, report)
+    else:
+        # 建立回報記錄
+        report_record = {
+            "id": new_id("R"),
+            "patient_id": patient_id,
+            "submission_id": submission_id,
+            "timestamp": datetime.now().isoformat(),
+            "date": datetime.now().strftime("%Y-%m-%d"),
+            "time": datetime.now().strftime("%H:%M"),
+            "symptoms": list(report.get("symptoms", [])),
+            "scores": dict(report.get("scores", {})),
+            "overall_score": report.get("overall_score", 0),
+            "conversation": list(report.get("conversation", [])),
+            "status": "completed",
+            "revision": 1
+        }
+        data["reports"].append(report_record)
     
     # 更新病人資料
     if patient_id in data["patients"]:
         data["patients"][patient_id]["last_report"] = datetime.now().isoformat()
         data["patients"][patient_id]["total_reports"] = len([r for r in data["reports"] if r["patient_id"] == patient_id])
     
-    # 檢查是否需要產生警示
-    overall_score = report.get("overall_score", 0)
-    if overall_score >= 7:
-        alert = create_alert(patient_id, "red", report)
-        data["alerts"].append(alert)
-    elif overall_score >= 4:
-        alert = create_alert(patient_id, "yellow", report)
-        data["alerts"].append(alert)
+    # 檢查是否需要產生警示（每次對話最多一筆）
+    apply_episode_alert(data, report_record)
     
-    save_data(data)
     return report_record
 
-def create_alert(patient_id: str, level: str, report: Dict) -> Dict:
+def find_report_by_submission(data: Dict, patient_id: str, submission_id: Optional[str]) -> Optional[Dict]:
+    """找出同一次對話已存在的回報"""
+    if not submission_id:
+        return None
+    for record in reversed(data["reports"]):
+        if record.get("submission_id") == submission_id and record["patient_id"] == patient_id:
+            return record
+    return None
+
+def is_report_saved(patient_id: str, submission_id: Optional[str]) -> bool:
+    """這次對話的回報是否已在資料檔中（寫入票號由其他程序發出、查不到寫入狀態時使用）"""
+    with _data_lock:
+        return find_report_by_submission(load_data(), patient_id, submission_id) is not None
+
+def merge_report(record: Dict, report: Dict):
+    """把同一次對話的新內容合併進既有回報"""
+    for symptom in report.get("symptoms", []):
+        if symptom not in record["symptoms"]:
+            record["symptoms"].append(symptom)
+    
+    record["scores"].update(report.get("scores", {}))
+    record["overall_score"] = max(record.get("overall_score", 0), report.get("overall_score", 0))
+    
+    # 只附加新的對話回合（有訊息 ID 時依 ID 比對，畫面上的對話可能已截短）
+    conversation = report.get("conversation", [])
+    merged_before = len(record["conversation"])
+    if any(m.get("id") for m in conversation):
+        known_ids = {m.get("id") for m in record["conversation"]}
+        record["conversation"].extend(m for m in conversation if m.get("id") not in known_ids)
+    elif len(conversation) > len(record["conversation"]):
+        record["conversation"].extend(conversation[len(record["conversation"]):])
+    
+    # 有新的對話回合時，舊的批次分析已不完整，留待下次重新分析
+    if len(record["conversation"]) > merged_before:
+        record.pop("analysis", None)
+    
+    record["updated_at"] = datetime.now().isoformat()
+    record["revision"] = record.get("revision", 1) + 1
+
+def alert_level(score: int) -> Optional[str]:
+    """分數對應的警示等級"""
+    if score >= 7:
+        return "red"
+    if score >= 4:
+        return "yellow"
+    return None
+
+def apply_episode_alert(data: Dict, report_record: Dict):
+    """建立或升級這次回報的警示"""
+    level = alert_level(report_record.get("overall_score", 0))
+    if not level:
+        return
+    
+    for alert in data["alerts"]:
+        if alert.get("report_id") == report_record["id"]:
+            # 尚未處理且分數升高時升級原警示
+            if alert["status"] == "pending" and report_record["overall_score"] > alert.get("score", 0):
+                alert["level"] = level
+                alert["score"] = report_record["overall_score"]
+                alert["symptoms"] = list(report_record["symptoms"])
+            return
+    
+    alert = create_alert(report_record["patient_id"], level, report_record, data)
+    alert["report_id"] = report_record["id"]
+    data["alerts"].append(alert)
+
+def create_alert(patient_id: str, level: str, report: Dict, data: Dict = None) -> Dict:
     """建立警示"""
-    data = load_data()
+    if data is None:
+        data = load_data()
     patient = data["patients"].get(patient_id, {})
     
     return {
-        "id": str(uuid.uuid4())[:8],
+        "id": new_id("A"),
         "patient_id": patient_id,
         "patient_name": patient.get("name", "未知"),
         "level": level,
@@ -128,16 +273,113 @@ def get_patient_reports(patient_id: str, limit: int = 10) -> List[Dict]:
     reports.sort(key=lambda x: x["timestamp"], reverse=True)
     return reports[:limit]
 
+def get_report_version() -> int:
+    """資料檔最後修改時間，用來判斷快取是否過期"""
+    try:
+        return os.stat(DATA_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+# 每位病人最新回報的更新時間（資料檔修改後重建一次，所有 session 共用）
+_patient_versions = {"file_version": None, "versions": {}}
+
+def get_patient_report_version(patient_id: str) -> str:
+    """
+    病人最新回報的建立 / 更新時間，用來判斷這位病人的快取是否過期
+    其他病人的回報、警示或註冊不會改變這個值
+    """
+    with _data_lock:
+        # 修改時間的精度有限，連續兩次寫入可能相同，另外比對檔案大小與本程序的寫檔次數
+        try:
+            stat = os.stat(DATA_FILE)
+            file_version = (stat.st_mtime_ns, stat.st_size, _write_stats["writes"])
+        except OSError:
+            file_version = None
+        if file_version is None or _patient_versions["file_version"] != file_version:
+            versions = {}
+            for report in load_data()["reports"]:
+                stamp = report.get("updated_at") or report["timestamp"]
+                if stamp > versions.get(report["patient_id"], ""):
+                    versions[report["patient_id"]] = stamp
+            _patient_versions["file_version"] = file_version
+            _patient_versions["versions"] = versions
+        return _patient_versions["versions"].get(patient_id, "")
+
+def get_score_series(patient_id: str, since: str = None, max_points: int = 300) -> List[Dict]:
+    """
+    病人的每日分數趨勢（每日最高、平均）
+    天數超過 max_points 時以 LTTB 降採樣，保留趨勢的高低點
+    """
+    data = load_data()
+    
+    daily = {}
+    for report in data["reports"]:
+        if report["patient_id"] != patient_id:
+            continue
+        if since and report["date"] < since:
+            continue
+        daily.setdefault(report["date"], []).append(report.get("overall_score", 0))
+    
+    series = [
+        {
+            "date": date,
+            "max": max(scores),
+            "mean": round(sum(scores) / len(scores), 1),
+            "count": len(scores)
+        }
+        for date, scores in sorted(daily.items())
+    ]
+    
+    if len(series) > max_points:
+        points = [(datetime.strptime(item["date"], "%Y-%m-%d").toordinal(), item["max"]) for item in series]
+        series = [series[i] for i in lttb_indices(points, max_points)]
+    
+    return series
+
+def lttb_indices(points: List[tuple], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets：回傳保留的點的索引"""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    
+    selected = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    
+    for i in range(threshold - 2):
+        # 下一個桶的平均點
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_points = points[next_start:next_end] or [points[-1]]
+        avg_x = sum(p[0] for p in next_points) / len(next_points)
+        avg_y = sum(p[1] for p in next_points) / len(next_points)
+        
+        # 本桶中與前一個選取點、下一桶平均點構成最大三角形的點
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        
+        selected.append(best)
+        a = best
+    
+    selected.append(n - 1)
+    return selected
+
 def get_all_patients() -> List[Dict]:
     """取得所有病人"""
     data = load_data()
     patients = list(data["patients"].values())
+    latest_reports = latest_report_by_patient(data["reports"])
     
     # 計算每個病人的狀態
     for patient in patients:
-        patient_reports = [r for r in data["reports"] if r["patient_id"] == patient["id"]]
-        if patient_reports:
-            latest = max(patient_reports, key=lambda x: x["timestamp"])
+        latest = latest_reports.get(patient["id"])
+        if latest:
             patient["last_score"] = latest.get("overall_score", 0)
             patient["last_symptoms"] = latest.get("symptoms", [])
             patient["last_report_time"] = latest.get("time", "")
@@ -155,6 +397,15 @@ def get_all_patients() -> List[Dict]:
     
     return patients
 
+def latest_report_by_patient(reports: List[Dict]) -> Dict[str, Dict]:
+    """一次掃描取得每位病人最新的回報"""
+    latest = {}
+    for report in reports:
+        current = latest.get(report["patient_id"])
+        if current is None or report["timestamp"] > current["timestamp"]:
+            latest[report["patient_id"]] = report
+    return latest
+
 def get_pending_alerts() -> List[Dict]:
     """取得待處理的警示"""
     data = load_data()
@@ -171,22 +422,21 @@ def get_all_alerts(limit: int = 50) -> List[Dict]:
 
 def update_alert_status(alert_id: str, status: str, handled_by: str = None, notes: str = ""):
     """更新警示狀態"""
-    data = load_data()
-    for alert in data["alerts"]:
-        if alert["id"] == alert_id:
-            alert["status"] = status
-            alert["handled_by"] = handled_by
-            alert["handled_at"] = datetime.now().isoformat()
-            alert["notes"] = notes
-            break
-    save_data(data)
+    with _data_write_lock():
+        data = load_data()
+        for alert in data["alerts"]:
+            if alert["id"] == alert_id:
+                alert["status"] = status
+                alert["handled_by"] = handled_by
+                alert["handled_at"] = datetime.now().isoformat()
+                alert["notes"] = notes
+                break
+        save_data(data)
 
 def save_intervention(patient_id: str, intervention: Dict):
     """儲存介入紀錄"""
-    data = load_data()
-    
     record = {
-        "id": str(uuid.uuid4())[:8],
+        "id": new_id("I"),
         "patient_id": patient_id,
         "timestamp": datetime.now().isoformat(),
         "date": datetime.now().strftime("%Y-%m-%d"),
@@ -198,8 +448,10 @@ def save_intervention(patient_id: str, intervention: Dict):
         "nurse": intervention.get("nurse", "")
     }
     
-    data["interventions"].append(record)
-    save_data(data)
+    with _data_write_lock():
+        data = load_data()
+        data["interventions"].append(record)
+        save_data(data)
     return record
 
 def get_interventions(patient_id: str = None, limit: int = 20) -> List[Dict]:
@@ -240,3 +492,318 @@ def get_statistics() -> Dict:
         "red_alerts": red_alerts,
         "yellow_alerts": yellow_alerts
     }
+
+# ============================================
+# 衛教推送紀錄
+# ============================================
+_push_lock = threading.Lock()
+
+def ensure_push_file():
+    """確保推送紀錄檔存在；舊版存在資料檔 "pushes" 中的紀錄第一次使用時搬過來"""
+    if os.path.exists(PUSH_FILE):
+        return
+    with _push_lock:
+        if os.path.exists(PUSH_FILE):
+            return
+        os.makedirs(os.path.dirname(PUSH_FILE) or ".", exist_ok=True)
+        legacy = load_data().get("pushes", []) if os.path.exists(DATA_FILE) else []
+        tmp_file = f"{PUSH_FILE}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for record in legacy:
+                f.write(json.dumps({"op": "push", "record": record}, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, PUSH_FILE)
+
+def append_push_entries(entries: List[Dict]):
+    """
+    附加推送紀錄的變動（一次寫入，多程序同時附加也不會交錯）
+    {"op": "push", "record": {...}}：新推送
+    {"op": "update", "id": 推送 ID, "changes": {...}}：更新（例如已讀）
+    {"op": "read", "patient_id", "material_id", "read_at"}：病人讀完某張單張（該單張未讀的推送一起標為已讀）
+    """
+    if not entries:
+        return
+    ensure_push_file()
+    payload = "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in entries)
+    with _push_lock:
+        with open(PUSH_FILE, "a", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+def read_push_entries(offset: int = 0) -> tuple:
+    """
+    從 offset 開始讀取推送紀錄的變動，回傳 (變動清單, 新 offset, 是否需從頭重建)
+    檔案比 offset 小（被清空或取代）時從頭讀起
+    """
+    ensure_push_file()
+    try:
+        size = os.path.getsize(PUSH_FILE)
+    except OSError:
+        return [], 0, offset > 0
+    reset = size < offset
+    if reset:
+        offset = 0
+    if size == offset:
+        return [], offset, reset
+    
+    entries = []
+    with open(PUSH_FILE, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break  # 其他程序還在寫的最後一行，下次再讀
+            offset += len(raw)
+            try:
+                entries.append(json.loads(raw))
+            except ValueError:
+                continue
+    return entries, offset, reset
+
+# ============================================
+# 重複回報整理
+# ============================================
+def _episode_key(report: Dict) -> tuple:
+    """判斷哪些回報屬於同一次對話"""
+    if report.get("submission_id"):
+        return (report["patient_id"], report["submission_id"])
+    
+    # 舊資料沒有 submission_id：以同一天、同一則開場訊息視為同一次對話
+    conversation = report.get("conversation") or [{}]
+    first = conversation[0]
+    return (report["patient_id"], report.get("date"), first.get("time"), first.get("content"))
+
+def dedupe_reports(dry_run: bool = False) -> Dict:
+    """
+    合併同一次對話重複儲存的回報與警示
+    保留最早一筆回報的 ID 與時間，內容取合併後的結果
+    """
+    with _data_write_lock():
+        data = load_data()
+        
+        episodes = OrderedDict()
+        for report in sorted(data["reports"], key=lambda x: x["timestamp"]):
+            episodes.setdefault(_episode_key(report), []).append(report)
+        
+        kept_reports = []
+        removed_report_ids = set()
+        removed_alert_ids = set()
+        
+        for group in episodes.values():
+            keeper = group[0]
+            keeper.setdefault("revision", 1)
+            for duplicate in group[1:]:
+                merge_report(keeper, duplicate)
+                removed_report_ids.add(duplicate["id"])
+            kept_reports.append(keeper)
+            
+            if len(group) == 1:
+                continue
+            
+            # 這次對話期間產生的警示只保留一筆（優先保留較嚴重、已處理的）
+            group_ids = {r["id"] for r in group}
+            start, end = group[0]["timestamp"], group[-1].get("updated_at") or group[-1]["timestamp"]
+            episode_alerts = [
+                a for a in data["alerts"]
+                if a["patient_id"] == keeper["patient_id"] and (
+                    a.get("report_id") in group_ids or
+                    (not a.get("report_id") and start[:19] <= a["timestamp"][:19] <= end[:19])
+                )
+            ]
+            if episode_alerts:
+                kept_alert = max(episode_alerts, key=lambda a: (a["level"] == "red", a["status"] != "pending"))
+                kept_alert["report_id"] = keeper["id"]
+                removed_alert_ids.update(a["id"] for a in episode_alerts if a is not kept_alert)
+        
+        stats = {
+            "reports_before": len(data["reports"]),
+            "reports_after": len(kept_reports),
+            "alerts_before": len(data["alerts"]),
+            "alerts_after": len(data["alerts"]) - len(removed_alert_ids),
+            "dry_run": dry_run
+        }
+        
+        if not dry_run and (removed_report_ids or removed_alert_ids):
+            data["reports"] = kept_reports
+            data["alerts"] = [a for a in data["alerts"] if a["id"] not in removed_alert_ids]
+            for patient_id, patient in data["patients"].items():
+                patient["total_reports"] = len([r for r in kept_reports if r["patient_id"] == patient_id])
+            save_data(data)
+    
+    return stats
+
+# ============================================
+# 批次分析結果
+# ============================================
+def get_unanalyzed_reports(version: int, since: str = None, limit: int = None) -> List[Dict]:
+    """
+    尚未分析（或分析版本較舊、分析後又有新對話）且有對話內容的回報，依時間由舊到新
+    since: 只取此日期（YYYY-MM-DD）之後的回報
+    """
+    data = load_data()
+    reports = [
+        r for r in data["reports"]
+        if r.get("conversation")
+        and _analysis_outdated(r, version)
+        and (not since or r.get("date", "") >= since)
+    ]
+    reports.sort(key=lambda x: x["timestamp"])
+    return reports[:limit] if limit else reports
+
+def _analysis_outdated(report: Dict, version: int) -> bool:
+    analysis = report.get("analysis") or {}
+    return (
+        analysis.get("version", 0) < version
+        or analysis.get("messages", 0) < len(report["conversation"])
+    )
+
+def save_report_analyses(analyses: Dict[str, Dict]) -> int:
+    """
+    一次寫回多筆分析結果 {report_id: analysis}，回傳更新筆數
+    分析期間回報又合併了新對話的（analysis["messages"] 與對話長度不符）不寫回，留待下次
+    """
+    if not analyses:
+        return 0
+    with _data_write_lock():
+        data = load_data()
+        updated = 0
+        for report in data["reports"]:
+            analysis = analyses.get(report["id"])
+            if analysis is not None and analysis.get("messages", 0) >= len(report.get("conversation", [])):
+                report["analysis"] = analysis
+                updated += 1
+        if updated:
+            save_data(data)
+    return updated
+
+# ============================================
+# 背景寫入
+# ============================================
+class ReportWriter:
+    """
+    完成的回報先放進佇列，由背景執行緒寫檔：
+    - 佇列有上限，滿了就改為前景直接寫入
+    - 相鄰的多筆回報合併成一次讀寫
+    - 寫入失敗會重試，程式結束前會清空佇列
+    """
+    
+    def __init__(self, max_queue: int = 500, batch_size: int = 50,
+                 max_retries: int = 3, retry_delay: float = 0.5, max_status: int = 2000):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_status = max_status
+        self.status = OrderedDict()  # ticket -> 狀態
+        self.lock = threading.Lock()
+        self.thread = None
+    
+    def submit(self, patient_id: str, report: Dict) -> str:
+        """送出回報，立即回傳收據編號"""
+        ticket = new_id("T")
+        self._set_status(ticket, {"state": "queued", "submitted_at": datetime.now().isoformat()})
+        self._ensure_thread()
+        
+        try:
+            self.queue.put((ticket, patient_id, report), timeout=1)
+        except queue.Full:
+            # 背景來不及消化時直接寫入，避免遺失
+            self._write_batch([(ticket, patient_id, report)])
+        
+        return ticket
+    
+    def get_status(self, ticket: str) -> Dict:
+        """查詢寫入狀態：queued / saved / failed"""
+        with self.lock:
+            return dict(self.status.get(ticket, {"state": "unknown"}))
+    
+    def flush(self, timeout: float = 10.0) -> bool:
+        """等待佇列清空，回傳是否全部處理完畢"""
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks:
+            if time.time() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+    
+    def shutdown(self, timeout: float = 10.0):
+        """程式結束前寫完剩餘的回報"""
+        if self.thread and self.thread.is_alive():
+            self.flush(timeout)
+        else:
+            self._drain_inline()
+    
+    def _ensure_thread(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="report-writer", daemon=True)
+                self.thread.start()
+    
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+    
+    def _drain_inline(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write_batch(batch)
+            for _ in batch:
+                self.queue.task_done()
+    
+    def _write_batch(self, batch: List[tuple]):
+        last_error = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                records = save_reports([(patient_id, report) for _, patient_id, report in batch])
+                for (ticket, _, _), record in zip(batch, records):
+                    self._set_status(ticket, {
+                        "state": "saved",
+                        "report_id": record["id"],
+                        "saved_at": datetime.now().isoformat(),
+                        "attempts": attempt
+                    })
+                return
+            except Exception as e:
+                last_error = e
+                time.sleep(self.retry_delay * attempt)
+        
+        for ticket, _, _ in batch:
+            self._set_status(ticket, {
+                "state": "failed",
+                "error": str(last_error),
+                "attempts": self.max_retries
+            })
+    
+    def _set_status(self, ticket: str, status: Dict):
+        with self.lock:
+            self.status[ticket] = status
+            self.status.move_to_end(ticket)
+            while len(self.status) > self.max_status:
+                self.status.popitem(last=False)
+
+# 全域實例
+report_writer = ReportWriter()
+atexit.register(report_writer.shutdown)
+
+def submit_report(patient_id: str, report: Dict) -> str:
+    """非同步儲存症狀回報，回傳收據編號"""
+    return report_writer.submit(patient_id, report)
+
+def get_write_status(ticket: str) -> Dict:
+    """查詢回報是否已寫入"""
+    return report_writer.get_status(ticket)
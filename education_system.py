@@ -3,631 +3,183 @@ AI-CARE Lung - 衛教推送系統
 ============================
 
 包含：
-1. 衛教單張庫
+1. 衛教單張庫（內容在 education_content/，可不重啟更新）
 2. 自動推送規則
 3. 手動推送介面
 4. 推送紀錄追蹤
 """
 
+from collections.abc import Mapping
 from datetime import datetime, timedelta
+import heapq
 import json
+import math
+import os
+import re
+import threading
+import time
+
+from engagement import log_event
+from id_generator import new_id
+from symptom_lexicon import SYMPTOM_LEXICON, normalize_symptoms
+
+try:
+    from data_manager import (
+        append_push_entries, read_push_entries, get_patient_reports, get_patient_report_version
+    )
+    DATA_MANAGER_AVAILABLE = True
+except:
+    DATA_MANAGER_AVAILABLE = False
 
 # ============================================
 # 衛教單張庫
 # ============================================
-EDUCATION_MATERIALS = {
-    # === 術後基礎照護 ===
-    "POST_OP_CARE": {
-        "id": "EDU001",
-        "category": "術後照護",
-        "title": "肺癌術後基礎照護指南",
-        "description": "傷口照護、活動注意事項、飲食建議",
-        "content": """
-## 🏥 肺癌術後基礎照護指南
-
-### 傷口照護
-- 保持傷口乾燥清潔
-- 觀察傷口有無紅腫、滲液、異味
-- 依醫囑時間回診拆線
-
-### 活動建議
-- 術後早期下床活動，促進恢復
-- 避免提重物（< 5公斤）至少 4-6 週
-- 循序漸進增加活動量
-
-### 飲食建議
-- 均衡飲食，高蛋白質促進癒合
-- 多攝取蔬果，預防便秘
-- 少量多餐，避免脹氣
-
-### ⚠️ 警示徵象
-如有以下情況，請立即就醫：
-- 發燒 > 38°C
-- 傷口紅腫化膿
-- 呼吸困難加劇
-- 胸痛劇烈
-        """,
-        "icon": "🏥",
-        "priority": 1
-    },
+# 單張放在內容目錄：index.json 為各單張的基本資料（依顯示順序），內容一張一個 Markdown 檔
+# 個管師修改檔案後不需重新啟動，下次讀取時依修改時間自動重新載入
+try:
+    from config import EDUCATION_CONTENT_DIR
+except:
+    EDUCATION_CONTENT_DIR = ""
+
+CONTENT_DIR = EDUCATION_CONTENT_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), "education_content")
+
+# 兩次檢查檔案修改時間的最短間隔（秒）
+RELOAD_CHECK_INTERVAL = 1.0
+
+class Material(Mapping):
+    """一張衛教單張；content 第一次讀取時才載入檔案"""
     
-    "BREATHING_EXERCISE": {
-        "id": "EDU002",
-        "category": "呼吸訓練",
-        "title": "呼吸運動訓練指南",
-        "description": "深呼吸、噘嘴式呼吸、腹式呼吸練習",
-        "content": """
-## 🌬️ 呼吸運動訓練指南
-
-### 為什麼要做呼吸運動？
-- 預防肺部塌陷
-- 促進痰液排出
-- 加速肺功能恢復
-
-### 深呼吸練習
-1. 坐直或半躺姿勢
-2. 用鼻子慢慢吸氣 4 秒
-3. 憋氣 2 秒
-4. 用嘴巴慢慢吐氣 6 秒
-5. 每小時練習 10 次
-
-### 噘嘴式呼吸
-1. 用鼻子吸氣
-2. 嘴唇噘起像吹蠟燭
-3. 慢慢吐氣，時間是吸氣的 2 倍
-4. 感覺呼吸困難時使用
-
-### 誘發性肺量計 (Triflow)
-1. 坐直，正常呼氣
-2. 含住吸嘴，慢慢深吸氣
-3. 盡量讓球升高並維持
-4. 每小時練習 10 次
-
-### 📅 建議頻率
-- 每小時至少練習一次
-- 每次 5-10 分鐘
-        """,
-        "icon": "🌬️",
-        "priority": 1
-    },
+    def __init__(self, library, key, meta):
+        self.library = library
+        self.key = key
+        self.meta = {k: v for k, v in meta.items() if k != "file"}
+        self.file = meta.get("file", f"{key}.md")
     
-    "PAIN_MANAGEMENT": {
-        "id": "EDU003",
-        "category": "疼痛控制",
-        "title": "術後疼痛控制指南",
-        "description": "疼痛評估、用藥指導、非藥物緩解",
-        "content": """
-## 💊 術後疼痛控制指南
-
-### 疼痛評估
-請用 0-10 分評估您的疼痛：
-- 0 分：完全不痛
-- 1-3 分：輕微疼痛
-- 4-6 分：中度疼痛
-- 7-10 分：嚴重疼痛
-
-### 用藥原則
-- 按時服藥，不要等痛了才吃
-- 依醫囑使用止痛藥
-- 記錄用藥時間和效果
-
-### 非藥物緩解
-- 冰敷（術後 48 小時內）
-- 姿勢調整（側躺時用枕頭支撐）
-- 放鬆技巧（深呼吸、冥想）
-- 分散注意力（聽音樂、看書）
-
-### 咳嗽時減痛技巧
-1. 雙手或枕頭輕壓傷口
-2. 先深吸一口氣
-3. 用力咳出
-4. 這樣可以減少咳嗽時的疼痛
-
-### ⚠️ 何時該告知醫護人員
-- 疼痛分數持續 > 6 分
-- 止痛藥效果不佳
-- 出現新的疼痛部位
-        """,
-        "icon": "💊",
-        "priority": 2
-    },
+    def __getitem__(self, name):
+        if name == "content":
+            return self.library.get_content(self.key)
+        return self.meta[name]
     
-    "EARLY_AMBULATION": {
-        "id": "EDU004",
-        "category": "活動指導",
-        "title": "術後早期下床活動指南",
-        "description": "下床步驟、活動量建議、注意事項",
-        "content": """
-## 🚶 術後早期下床活動指南
-
-### 為什麼要早期下床？
-- 預防肺栓塞
-- 促進腸胃蠕動
-- 加速整體恢復
-- 預防肌肉萎縮
-
-### 下床步驟
-1. 先在床上坐起，停留 1-2 分鐘
-2. 雙腳放到床邊，再停留 1-2 分鐘
-3. 確認無頭暈後，扶著站起
-4. 站穩後，慢慢行走
-
-### 活動量建議
-| 術後天數 | 建議活動 |
-|---------|---------|
-| D+1 | 床邊坐起、站立 |
-| D+2 | 病房內行走 |
-| D+3 | 走廊行走 2-3 次 |
-| D+4起 | 逐漸增加距離 |
-
-### ⚠️ 注意事項
-- 有人陪伴
-- 穿防滑鞋
-- 攜帶引流管時小心
-- 感覺頭暈立即坐下
-        """,
-        "icon": "🚶",
-        "priority": 1
-    },
+    def __iter__(self):
+        yield from self.meta
+        yield "content"
     
-    "WOUND_CARE": {
-        "id": "EDU005",
-        "category": "傷口照護",
-        "title": "傷口照護指南",
-        "description": "傷口觀察、換藥、沐浴注意事項",
-        "content": """
-## 🩹 傷口照護指南
-
-### 傷口觀察重點
-每天觀察傷口，注意：
-- ✅ 正常：輕微發紅、輕微腫脹
-- ⚠️ 異常：明顯紅腫、滲液、異味、裂開
-
-### 換藥原則
-- 依醫囑時間換藥
-- 換藥前洗手
-- 使用無菌敷料
-- 由內向外清潔
-
-### 沐浴注意
-- 傷口未癒合前避免泡澡
-- 可使用防水敷料淋浴
-- 沐浴後保持傷口乾燥
-- 拆線後 3 天可正常沐浴
-
-### 胸管傷口
-- 拔管後傷口較小
-- 保持乾燥 3-5 天
-- 觀察有無滲液或氣腫
-
-### ⚠️ 立即就醫情況
-- 傷口裂開
-- 大量滲液或出血
-- 傷口周圍紅腫熱痛擴大
-- 發燒 > 38°C
-        """,
-        "icon": "🩹",
-        "priority": 2
-    },
+    def __len__(self):
+        return len(self.meta) + 1
     
-    "HOME_CARE": {
-        "id": "EDU006",
-        "category": "居家照護",
-        "title": "出院居家照護指南",
-        "description": "居家注意事項、生活調整、回診提醒",
-        "content": """
-## 🏠 出院居家照護指南
-
-### 居家環境準備
-- 床鋪高度適中，方便起身
-- 浴室加裝防滑墊、扶手
-- 常用物品放在容易取得處
-- 保持室內空氣流通
-
-### 日常生活
-| 活動 | 建議 |
-|-----|-----|
-| 睡眠 | 側躺或半坐臥較舒適 |
-| 進食 | 少量多餐、細嚼慢嚥 |
-| 沐浴 | 淋浴為主、避免過熱 |
-| 穿衣 | 選擇前開式衣物 |
-
-### 活動限制（4-6週內）
-- ❌ 提重物 > 5 公斤
-- ❌ 劇烈運動
-- ❌ 開車（視恢復狀況）
-- ✅ 散步、輕度家務
-
-### 營養建議
-- 高蛋白：魚、肉、蛋、豆類
-- 維生素 C：促進傷口癒合
-- 足夠水分：每日 1500-2000ml
-- 高纖維：預防便秘
-
-### 📅 回診時間
-- 術後 1-2 週：拆線、看病理報告
-- 術後 1 個月：恢復評估
-- 術後 3 個月：追蹤 CT
-        """,
-        "icon": "🏠",
-        "priority": 1
-    },
+    def metadata(self):
+        """不含內容的基本資料"""
+        return dict(self.meta)
+
+class MaterialLibrary(Mapping):
+    """
+    衛教單張庫，用法同 dict（key → 單張）
+    - 只在第一次使用時讀取 index.json；內容在讀取 content 時才載入
+    - index.json 或內容檔修改後自動重新載入，version 隨之增加
+    """
     
-    "WARNING_SIGNS": {
-        "id": "EDU007",
-        "category": "警示徵象",
-        "title": "術後警示徵象",
-        "description": "需要立即就醫的危險徵象",
-        "content": """
-## 🚨 術後警示徵象
-
-### 🔴 立即急診（撥打 119）
-- 突然嚴重呼吸困難
-- 胸痛劇烈、冒冷汗
-- 意識改變、昏倒
-- 咳血（鮮紅色、量多）
-- 嘴唇發紫
-
-### 🟡 盡快回診（24小時內）
-- 發燒 > 38°C
-- 傷口紅腫、滲液增加
-- 呼吸困難加重
-- 持續胸痛不緩解
-- 痰液變黃綠色
-
-### 🟢 下次回診時告知
-- 輕微咳嗽
-- 傷口輕微不適
-- 疲倦感
-- 食慾稍差
-
-### 📞 緊急聯繫方式
-- 醫院急診：(02) XXXX-XXXX
-- 個管師專線：(02) XXXX-XXXX
-- 值班時間：週一至週五 08:00-17:00
-        """,
-        "icon": "🚨",
-        "priority": 1
-    },
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.materials = {}
+        self.index_mtime = None
+        self.index_checked = 0.0
+        self.contents = {}  # key → [mtime, 內容, 上次檢查時間]
+        self.content_mtimes = None  # key → 內容檔 mtime（上次檢查時）
+        self.contents_checked = 0.0
+        self.version = 0
     
-    "NUTRITION": {
-        "id": "EDU008",
-        "category": "營養指導",
-        "title": "術後營養指南",
-        "description": "促進恢復的飲食建議",
-        "content": """
-## 🍎 術後營養指南
-
-### 營養目標
-- 促進傷口癒合
-- 維持免疫力
-- 恢復體力
-
-### 蛋白質攝取
-每日需要量：體重 x 1.2-1.5 g
-- 魚類：鮭魚、鱈魚
-- 肉類：雞胸肉、瘦肉
-- 蛋類：每日 1-2 顆
-- 豆類：豆腐、豆漿
-
-### 促進癒合的營養素
-| 營養素 | 食物來源 |
-|-------|---------|
-| 維生素 C | 芭樂、柑橘、奇異果 |
-| 維生素 A | 紅蘿蔔、地瓜、南瓜 |
-| 鋅 | 牡蠣、堅果、全穀 |
-| 鐵 | 紅肉、深綠蔬菜 |
-
-### 飲食原則
-- 少量多餐（每日 5-6 餐）
-- 細嚼慢嚥
-- 避免脹氣食物
-- 足夠水分
-
-### ⚠️ 術後避免
-- 過於油膩食物
-- 辛辣刺激
-- 酒精
-- 未經醫囑的保健食品
-        """,
-        "icon": "🍎",
-        "priority": 2
-    },
+    def _stat(self, filename):
+        try:
+            return os.stat(os.path.join(self.directory, filename)).st_mtime_ns
+        except OSError:
+            return None
     
-    "SMOKING_CESSATION": {
-        "id": "EDU009",
-        "category": "戒菸衛教",
-        "title": "戒菸指南",
-        "description": "戒菸的重要性與方法",
-        "content": """
-## 🚭 戒菸指南
-
-### 為什麼術後要戒菸？
-- 促進傷口癒合
-- 降低併發症風險
-- 改善肺功能恢復
-- 降低癌症復發風險
-
-### 戒菸的好處（時間軸）
-| 時間 | 身體變化 |
-|-----|---------|
-| 20 分鐘 | 心跳血壓恢復正常 |
-| 24 小時 | 血液含氧量增加 |
-| 2 週 | 肺功能開始改善 |
-| 1 個月 | 咳嗽減少、體力改善 |
-| 1 年 | 心臟病風險降低一半 |
-
-### 戒菸方法
-1. **藥物輔助**
-   - 尼古丁替代療法（貼片、口香糖）
-   - 戒菸藥物（需醫師處方）
-
-2. **行為改變**
-   - 找出吸菸誘因並避免
-   - 用其他活動取代吸菸
-   - 告知親友尋求支持
-
-3. **專業協助**
-   - 戒菸門診
-   - 戒菸專線：0800-636363
-
-### 戒斷症狀處理
-- 焦慮：深呼吸、運動
-- 想吸菸：喝水、嚼口香糖
-- 失眠：減少咖啡因、規律作息
-        """,
-        "icon": "🚭",
-        "priority": 2
-    },
+    def _refresh_index(self):
+        now = time.monotonic()
+        if self.index_mtime is not None and now - self.index_checked < RELOAD_CHECK_INTERVAL:
+            return
+        self.index_checked = now
+        mtime = self._stat("index.json")
+        if mtime == self.index_mtime and self.index_mtime is not None:
+            return
+        
+        try:
+            with open(os.path.join(self.directory, "index.json"), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        
+        self.materials = {key: Material(self, key, meta) for key, meta in index.items()}
+        self.contents = {k: v for k, v in self.contents.items() if k in self.materials}
+        self.index_mtime = mtime or 0
+        self.version += 1
     
-    "FOLLOW_UP": {
-        "id": "EDU010",
-        "category": "追蹤檢查",
-        "title": "術後追蹤檢查指南",
-        "description": "追蹤時程與檢查項目說明",
-        "content": """
-## 📋 術後追蹤檢查指南
-
-### 追蹤時程
-| 時間 | 檢查項目 |
-|-----|---------|
-| 術後 1-2 週 | 回診、拆線、病理報告 |
-| 術後 1 個月 | 恢復評估、胸部 X 光 |
-| 術後 3 個月 | 胸部 CT |
-| 術後 6 個月 | 胸部 CT |
-| 術後 1 年 | 胸部 CT、抽血 |
-| 之後每年 | 低劑量 CT |
-
-### 病理報告說明
-術後約 1-2 週可得知：
-- 腫瘤類型
-- 分期（pTNM）
-- 切緣狀態
-- 是否需要輔助治療
-
-### 追蹤檢查的目的
-- 確認恢復狀況
-- 早期發現復發
-- 評估治療效果
-- 處理術後問題
-
-### 📅 回診準備
-- 攜帶健保卡、病歷
-- 記錄要詢問的問題
-- 攜帶用藥清單
-- 有症狀變化請告知
-        """,
-        "icon": "📋",
-        "priority": 2
-    },
+    def _refresh_contents(self):
+        """檢查所有內容檔的修改時間：有變動就增加 version，並丟棄該單張的快取內容"""
+        now = time.monotonic()
+        if self.content_mtimes is not None and now - self.contents_checked < RELOAD_CHECK_INTERVAL:
+            return
+        self.contents_checked = now
+        mtimes = {key: self._stat(material.file) for key, material in self.materials.items()}
+        if mtimes == self.content_mtimes:
+            return
+        if self.content_mtimes is not None:
+            self.version += 1
+        self.content_mtimes = mtimes
+        for key, cached in list(self.contents.items()):
+            if cached[0] != mtimes.get(key):
+                del self.contents[key]
     
-    "ADJUVANT_CHEMO": {
-        "id": "EDU011",
-        "category": "輔助治療",
-        "title": "術後輔助化學治療說明",
-        "description": "化療目的、流程、副作用處理",
-        "content": """
-## 💉 術後輔助化學治療說明
-
-### 什麼情況需要化療？
-- 病理分期 II 期以上
-- 有淋巴結轉移
-- 高風險因子（LVI、VPI等）
-
-### 化療時程
-- 通常術後 4-8 週開始
-- 每 3 週一次
-- 共 4 次療程
-
-### 常見副作用與處理
-| 副作用 | 處理方式 |
-|-------|---------|
-| 噁心嘔吐 | 止吐藥、少量多餐 |
-| 疲倦 | 適度休息、輕度活動 |
-| 白血球下降 | 避免感染、監測體溫 |
-| 掉髮 | 暫時性、會恢復 |
-| 手腳麻 | 告知醫師調整 |
-
-### ⚠️ 化療期間注意
-- 避免生食
-- 勤洗手
-- 避免人多擁擠處
-- 發燒立即就醫
-        """,
-        "icon": "💉",
-        "priority": 3
-    },
+    def get_content(self, key):
+        """單張內容（Markdown）"""
+        with self.lock:
+            self._refresh_index()
+            material = self.materials[key]
+            now = time.monotonic()
+            cached = self.contents.get(key)
+            if cached and now - cached[2] < RELOAD_CHECK_INTERVAL:
+                return cached[1]
+            
+            mtime = self._stat(material.file)
+            if cached and cached[0] == mtime:
+                cached[2] = now
+                return cached[1]
+            
+            try:
+                with open(os.path.join(self.directory, material.file), "r", encoding="utf-8") as f:
+                    content = f.read()
+            except OSError:
+                content = ""
+            if cached:
+                self.version += 1
+            self.contents[key] = [mtime, content, now]
+            return content
     
-    "TARGETED_THERAPY": {
-        "id": "EDU012",
-        "category": "輔助治療",
-        "title": "標靶治療說明",
-        "description": "EGFR-TKI 標靶藥物使用指南",
-        "content": """
-## 🎯 標靶治療說明
-
-### 什麼是標靶治療？
-針對癌細胞特定基因突變的藥物治療
-- EGFR 突變：可用 EGFR-TKI
-- ALK 重組：可用 ALK 抑制劑
-
-### 術後標靶治療
-- 適用於 EGFR 突變陽性
-- 通常服用 3 年
-- 每日口服
-
-### 常見副作用
-| 副作用 | 發生率 | 處理 |
-|-------|-------|-----|
-| 皮疹 | 常見 | 保濕、防曬 |
-| 腹瀉 | 常見 | 止瀉藥、補水 |
-| 肝功能異常 | 需監測 | 定期抽血 |
-| 間質性肺炎 | 少見但嚴重 | 立即就醫 |
-
-### 服藥注意
-- 固定時間服用
-- 不可自行停藥
-- 定期回診追蹤
-- 記錄副作用
-        """,
-        "icon": "🎯",
-        "priority": 3
-    },
+    def __getitem__(self, key):
+        with self.lock:
+            self._refresh_index()
+            return self.materials[key]
     
-    "EMOTIONAL_SUPPORT": {
-        "id": "EDU013",
-        "category": "心理支持",
-        "title": "術後心理調適指南",
-        "description": "情緒處理、心理支持資源",
-        "content": """
-## 💚 術後心理調適指南
-
-### 常見情緒反應
-術後有這些感受是正常的：
-- 焦慮、擔心復發
-- 情緒低落、悲傷
-- 疲倦、缺乏動力
-- 對未來感到不確定
-
-### 調適方法
-1. **接受情緒**
-   - 允許自己有負面情緒
-   - 不要壓抑感受
-
-2. **表達分享**
-   - 與家人朋友傾訴
-   - 加入病友團體
-   - 尋求專業諮商
-
-3. **自我照顧**
-   - 維持規律作息
-   - 適度運動
-   - 做喜歡的事情
-
-4. **正念練習**
-   - 專注當下
-   - 深呼吸放鬆
-   - 冥想
-
-### 🆘 需要幫助的訊號
-- 持續 2 週以上情緒低落
-- 失眠或嗜睡
-- 食慾明顯改變
-- 對事物失去興趣
-- 有自我傷害念頭
-
-### 📞 心理支持資源
-- 社工師諮詢
-- 心理諮商門診
-- 癌症關懷專線：0800-123-456
-        """,
-        "icon": "💚",
-        "priority": 2
-    },
+    def __iter__(self):
+        with self.lock:
+            self._refresh_index()
+            keys = list(self.materials)
+        return iter(keys)
     
-    "PHYSICAL_ACTIVITY": {
-        "id": "EDU014",
-        "category": "復健運動",
-        "title": "術後運動指南",
-        "description": "漸進式運動建議",
-        "content": """
-## 🏃 術後運動指南
-
-### 運動的好處
-- 加速體力恢復
-- 改善肺功能
-- 減少疲倦感
-- 改善心情
-
-### 漸進式運動計畫
-| 階段 | 時間 | 運動類型 |
-|-----|-----|---------|
-| 第 1-2 週 | 住院期 | 床邊活動、走廊行走 |
-| 第 3-4 週 | 出院後 | 室內走動、輕度伸展 |
-| 第 5-8 週 | 恢復期 | 戶外散步 15-30 分鐘 |
-| 第 9-12 週 | 進階期 | 快走、輕度有氧 |
-| 3 個月後 | 維持期 | 規律運動 30 分鐘/天 |
-
-### 上肢運動（預防肩膀僵硬）
-1. 手臂前舉、側舉
-2. 肩膀繞圈
-3. 爬牆運動
-4. 每日 2-3 次，每次 10 分鐘
-
-### ⚠️ 運動注意事項
-- 循序漸進，不要勉強
-- 感覺不適就休息
-- 避免憋氣用力
-- 避免劇烈碰撞運動
-        """,
-        "icon": "🏃",
-        "priority": 2
-    },
+    def __len__(self):
+        with self.lock:
+            self._refresh_index()
+            return len(self.materials)
     
-    "SLEEP_GUIDE": {
-        "id": "EDU015",
-        "category": "生活照護",
-        "title": "術後睡眠指南",
-        "description": "改善睡眠品質的方法",
-        "content": """
-## 😴 術後睡眠指南
-
-### 術後睡眠困難的原因
-- 傷口疼痛
-- 姿勢不適
-- 焦慮擔憂
-- 環境改變
-
-### 舒適睡姿
-- **側躺**：患側朝上，用枕頭支撐
-- **半坐臥**：床頭抬高 30-45 度
-- **仰躺**：膝下墊枕頭
-
-### 改善睡眠的方法
-1. **睡前準備**
-   - 固定就寢時間
-   - 睡前 1 小時避免螢幕
-   - 放鬆活動（閱讀、音樂）
-
-2. **環境調整**
-   - 保持安靜、黑暗
-   - 適宜溫度（24-26°C）
-   - 舒適的床鋪
-
-3. **白天習慣**
-   - 避免午睡過長（< 30分鐘）
-   - 適度活動
-   - 減少咖啡因
-
-### 疼痛影響睡眠時
-- 睡前服用止痛藥
-- 使用冰敷或熱敷
-- 調整睡姿
-        """,
-        "icon": "😴",
-        "priority": 3
-    }
-}
+    def get_version(self):
+        """任何單張或索引修改後都會增加（不需等到該單張被讀取）"""
+        with self.lock:
+            self._refresh_index()
+            self._refresh_contents()
+            return self.version
+
+EDUCATION_MATERIALS = MaterialLibrary(CONTENT_DIR)
 
 # ============================================
 # 自動推送規則
@@ -752,21 +304,221 @@ AUTO_PUSH_RULES = [
     }
 ]
 
+class AutoPushRuleEngine:
+    """
+    把規則編譯成查表：
+    - by_day: 術後天數 → 規則
+    - by_symptom: 標準症狀名稱 → 規則（病人原話先經症狀詞庫的單次比對轉成標準名稱）
+    - raw_symptom_pattern: 對不到詞庫的症狀關鍵字合併成一個正規表示式，直接比對原始文字 → 規則
+    - treatment_pattern: 治療關鍵字合併成一個正規表示式 → 規則
+    停用的規則不會編入；規則修改後需呼叫 compile()（update_rule() 等函式會自動呼叫）
+    """
+    
+    def __init__(self, rules):
+        self.lock = threading.Lock()
+        self.compile(rules)
+    
+    def compile(self, rules):
+        by_day, by_symptom, by_raw_symptom, by_treatment = {}, {}, {}, {}
+        for order, rule in enumerate(rules):
+            if not rule.get("enabled"):
+                continue
+            entry = (order, rule)
+            trigger = rule["trigger_value"]
+            if rule["trigger_type"] == "post_op_day":
+                by_day.setdefault(trigger, []).append(entry)
+            elif rule["trigger_type"] == "symptom":
+                # 規則可用症狀名稱的一部分（如「睡眠」對應「睡眠問題」）
+                names = [name for name in SYMPTOM_LEXICON if trigger in name]
+                for name in names:
+                    by_symptom.setdefault(name, []).append(entry)
+                if not names:
+                    # 詞庫沒有的關鍵字：比對症狀原始文字，與詞庫加入前的行為相同
+                    by_raw_symptom.setdefault(trigger, []).append(entry)
+            elif rule["trigger_type"] == "treatment":
+                by_treatment.setdefault(trigger.lower(), []).append(entry)
+        
+        with self.lock:
+            self.by_day, self.by_symptom, self.by_treatment = by_day, by_symptom, by_treatment
+            self.by_raw_symptom = by_raw_symptom
+            self.treatment_pattern = _keyword_pattern(by_treatment)
+            self.raw_symptom_pattern = _keyword_pattern(by_raw_symptom)
+    
+    def match(self, post_op_day=None, symptoms=None, treatment=None):
+        """回傳觸發的規則（依規則表順序，不重複）"""
+        with self.lock:
+            fired = list(self.by_day.get(post_op_day, []))
+            for name in normalize_symptoms(symptoms):
+                fired.extend(self.by_symptom.get(name, []))
+            if self.raw_symptom_pattern:
+                for text in symptoms or []:
+                    for m in self.raw_symptom_pattern.finditer(text):
+                        fired.extend(self.by_raw_symptom[m.group(0)])
+            if treatment and self.treatment_pattern:
+                for m in self.treatment_pattern.finditer(treatment.lower()):
+                    fired.extend(self.by_treatment[m.group(0)])
+        
+        return [rule for _, rule in sorted(dict(fired).items())]
+    
+    def match_materials(self, post_op_day=None, symptoms=None, treatment=None):
+        """觸發的衛教單張 ID（不重複）"""
+        materials = []
+        for rule in self.match(post_op_day, symptoms, treatment):
+            for material_id in rule["materials"]:
+                if material_id not in materials:
+                    materials.append(material_id)
+        return materials
+
+def _keyword_pattern(keywords):
+    """關鍵字合併成一個正規表示式（長的優先）"""
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+
+# 全域實例
+rule_engine = AutoPushRuleEngine(AUTO_PUSH_RULES)
+
+def update_rule(rule_id, **changes):
+    """修改規則（例如 enabled=False）並重新編譯"""
+    for rule in AUTO_PUSH_RULES:
+        if rule["id"] == rule_id:
+            rule.update(changes)
+            rule_engine.compile(AUTO_PUSH_RULES)
+            return rule
+    return None
+
+def add_rule(rule):
+    """新增規則並重新編譯"""
+    AUTO_PUSH_RULES.append(rule)
+    rule_engine.compile(AUTO_PUSH_RULES)
+    return rule
+
+def remove_rule(rule_id):
+    """刪除規則並重新編譯"""
+    AUTO_PUSH_RULES[:] = [r for r in AUTO_PUSH_RULES if r["id"] != rule_id]
+    rule_engine.compile(AUTO_PUSH_RULES)
+
 # ============================================
 # 推送紀錄管理
 # ============================================
 class EducationPushManager:
-    def __init__(self):
+    """
+    推送紀錄存在只附加的推送紀錄檔（與回報資料檔分開），記憶體中維持三個索引：
+    - by_id: 推送 ID → 紀錄
+    - by_patient: 病人 ID → 紀錄清單
+    - by_key: (病人 ID, 單張 ID, 推送方式) → 最近一筆紀錄
+    以及隨推送 / 已讀同步更新的統計：
+    - unread: 病人 ID → 未讀數
+    - material_stats: 單張 ID → {"pushed", "read"}
+    - read_materials: 病人 ID → 讀過的單張（含沒有推送、自己從單張庫讀的）
+    每次查詢只讀入檔案新增的部分（包含其他程序寫入的），回報寫入不影響索引
+    """
+    
+    def __init__(self, persist=True):
+        self.persist = persist and DATA_MANAGER_AVAILABLE
+        self.lock = threading.RLock()
+        self._reset()
+        self.offset = 0
+    
+    def _reset(self):
         self.push_history = []
+        self.by_id = {}
+        self.by_patient = {}
+        self.by_key = {}
+        self.unread = {}
+        self.material_stats = {}
+        self.read_materials = {}
     
-    def push_material(self, patient_id, patient_name, material_id, push_type="manual", pushed_by="system"):
+    def _index(self, record):
+        self.push_history.append(record)
+        self.by_id[record["id"]] = record
+        self.by_patient.setdefault(record["patient_id"], []).append(record)
+        self.by_key[(record["patient_id"], record["material_id"], record["push_type"])] = record
+        
+        stats = self.material_stats.setdefault(record["material_id"], {"pushed": 0, "read": 0})
+        stats["pushed"] += 1
+        if record["status"] == "read":
+            stats["read"] += 1
+            self.read_materials.setdefault(record["patient_id"], set()).add(record["material_id"])
+        else:
+            self.unread[record["patient_id"]] = self.unread.get(record["patient_id"], 0) + 1
+    
+    def _apply(self, entry):
+        """套用一筆變動：新推送、更新或病人讀完某張單張"""
+        op = entry.get("op")
+        if op == "push":
+            if entry["record"]["id"] not in self.by_id:
+                self._index(entry["record"])
+        elif op == "update":
+            record = self.by_id.get(entry.get("id"))
+            if record is not None:
+                was_read = record["status"] == "read"
+                record.update(entry["changes"])
+                if not was_read and record["status"] == "read":
+                    self._count_read(record)
+        elif op == "read":
+            # 這張單張所有未讀的推送一起標為已讀
+            patient_id, material_id = entry["patient_id"], entry["material_id"]
+            for record in self.by_patient.get(patient_id, []):
+                if record["material_id"] == material_id and record["status"] != "read":
+                    record.update({"read_at": entry["read_at"], "status": "read"})
+                    self._count_read(record)
+            self.read_materials.setdefault(patient_id, set()).add(material_id)
+    
+    def _count_read(self, record):
+        self.unread[record["patient_id"]] -= 1
+        self.material_stats[record["material_id"]]["read"] += 1
+        self.read_materials.setdefault(record["patient_id"], set()).add(record["material_id"])
+    
+    def _sync(self):
+        """讀入推送紀錄檔新增的變動"""
+        if not self.persist:
+            return
+        entries, self.offset, reset = read_push_entries(self.offset)
+        if reset:
+            self._reset()
+        for entry in entries:
+            self._apply(entry)
+    
+    def _commit(self, entries):
+        """寫入變動並更新索引（呼叫前需持有 lock）"""
+        if self.persist:
+            append_push_entries(entries)
+            self._sync()
+        else:
+            for entry in entries:
+                self._apply(entry)
+    
+    def push_material(self, patient_id, patient_name, material_id, push_type="manual", pushed_by="system",
+                      post_op_day=None):
         """推送衛教單張"""
-        material = EDUCATION_MATERIALS.get(material_id)
-        if not material:
-            return None
+        records = self.push_materials([(patient_id, patient_name, material_id, post_op_day)], push_type, pushed_by)
+        return records[0] if records else None
+    
+    def push_materials(self, items, push_type="manual", pushed_by="system"):
+        """
+        一次推送多筆，只寫一次檔
+        items: [(patient_id, patient_name, material_id), ...]，可再加第四個元素術後天數
+        """
+        records = [
+            self._build_record(*item[:3], push_type, pushed_by, item[3] if len(item) > 3 else None)
+            for item in items
+            if item[2] in EDUCATION_MATERIALS
+        ]
+        if not records:
+            return []
         
-        record = {
-            "id": f"PUSH{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        with self.lock:
+            self._commit([{"op": "push", "record": record} for record in records])
+        for record in records:
+            log_event("pushed", record["patient_id"], record["material_id"], record["category"],
+                      record["post_op_day"], record["id"])
+        return records
+    
+    def _build_record(self, patient_id, patient_name, material_id, push_type, pushed_by, post_op_day=None):
+        material = EDUCATION_MATERIALS[material_id]
+        return {
+            "id": new_id("PUSH"),
             "patient_id": patient_id,
             "patient_name": patient_name,
             "material_id": material_id,
@@ -775,74 +527,118 @@ class EducationPushManager:
             "push_type": push_type,  # manual, auto
             "pushed_by": pushed_by,
             "pushed_at": datetime.now().isoformat(),
+            "post_op_day": post_op_day,
             "read_at": None,
             "status": "sent"  # sent, read
         }
-        
-        self.push_history.append(record)
-        return record
     
     def get_patient_history(self, patient_id):
         """取得病人的推送紀錄"""
-        return [r for r in self.push_history if r["patient_id"] == patient_id]
+        with self.lock:
+            self._sync()
+            return list(self.by_patient.get(patient_id, []))
     
     def get_all_history(self):
         """取得所有推送紀錄"""
-        return sorted(self.push_history, key=lambda x: x["pushed_at"], reverse=True)
+        with self.lock:
+            self._sync()
+            return sorted(self.push_history, key=lambda x: x["pushed_at"], reverse=True)
+    
+    def get_pushed_keys(self, push_type="auto"):
+        """已推送過的 (病人 ID, 單張 ID) 集合"""
+        with self.lock:
+            self._sync()
+            return {(pid, mid) for pid, mid, ptype in self.by_key if ptype == push_type}
+    
+    def has_pushed(self, patient_id, material_id, push_type="auto"):
+        """是否已推送過"""
+        with self.lock:
+            self._sync()
+            return (patient_id, material_id, push_type) in self.by_key
     
     def mark_as_read(self, push_id):
-        """標記為已讀"""
-        for record in self.push_history:
-            if record["id"] == push_id:
-                record["read_at"] = datetime.now().isoformat()
-                record["status"] = "read"
+        """標記單筆推送為已讀"""
+        with self.lock:
+            self._sync()
+            record = self.by_id.get(push_id)
+            if not record:
+                return False
+            if record["status"] == "read":
                 return True
-        return False
+            changes = {"read_at": datetime.now().isoformat(), "status": "read"}
+            self._commit([{"op": "update", "id": push_id, "changes": changes}])
+        self._after_read(record["patient_id"], record["material_id"], [record])
+        return True
+    
+    def mark_material_read(self, patient_id, material_id, post_op_day=None):
+        """
+        病人讀完某張單張：這張單張所有未讀的推送都標為已讀，回傳標記數
+        沒有推送（自己從單張庫打開）也會記下讀過，供推薦與閱讀統計使用
+        """
+        with self.lock:
+            self._sync()
+            unread = [
+                r for r in self.by_patient.get(patient_id, [])
+                if r["material_id"] == material_id and r["status"] != "read"
+            ]
+            self._commit([{
+                "op": "read", "patient_id": patient_id, "material_id": material_id,
+                "read_at": datetime.now().isoformat()
+            }])
+        self._after_read(patient_id, material_id, unread, post_op_day)
+        return len(unread)
+    
+    def _after_read(self, patient_id, material_id, records, post_op_day=None):
+        """已讀後：記錄閱讀事件（每筆推送一筆，沒有推送時記一筆）並清除推薦快取"""
+        for record in records:
+            log_event("read", patient_id, material_id, record["category"],
+                      record.get("post_op_day"), record["id"])
+        if not records:
+            record_engagement("read", patient_id, material_id, post_op_day)
+        invalidate_recommendations(patient_id)
+    
+    def get_read_materials(self, patient_id):
+        """病人讀過的單張"""
+        with self.lock:
+            self._sync()
+            return set(self.read_materials.get(patient_id, ()))
+    
+    def get_inbox(self, patient_id, limit=20):
+        """病人收到的推送，新的在前"""
+        with self.lock:
+            self._sync()
+            return list(reversed(self.by_patient.get(patient_id, [])[-limit:]))
+    
+    def get_unread_count(self, patient_id):
+        """病人的未讀推送數"""
+        with self.lock:
+            self._sync()
+            return self.unread.get(patient_id, 0)
+    
+    def get_material_read_stats(self, material_id=None):
+        """各單張的推送數、已讀數與閱讀率（個管師端）"""
+        with self.lock:
+            self._sync()
+            items = self.material_stats.items() if material_id is None else \
+                [(material_id, self.material_stats.get(material_id, {"pushed": 0, "read": 0}))]
+            return {
+                mid: {**stats, "read_rate": round(stats["read"] / stats["pushed"], 3) if stats["pushed"] else 0.0}
+                for mid, stats in items
+            }
     
     def check_auto_push(self, patient_id, patient_name, post_op_day, symptoms=None, treatment=None):
         """檢查並執行自動推送"""
         pushed = []
         
-        for rule in AUTO_PUSH_RULES:
-            if not rule["enabled"]:
-                continue
-            
-            should_push = False
-            
-            # 術後天數觸發
-            if rule["trigger_type"] == "post_op_day":
-                if post_op_day == rule["trigger_value"]:
-                    should_push = True
-            
-            # 症狀觸發
-            elif rule["trigger_type"] == "symptom" and symptoms:
-                for symptom in symptoms:
-                    if rule["trigger_value"] in symptom:
-                        should_push = True
-                        break
-            
-            # 治療觸發
-            elif rule["trigger_type"] == "treatment" and treatment:
-                if rule["trigger_value"] in treatment.lower():
-                    should_push = True
-            
-            if should_push:
-                for material_id in rule["materials"]:
-                    # 檢查是否已推送過
-                    already_pushed = any(
-                        r["patient_id"] == patient_id and 
-                        r["material_id"] == material_id and
-                        r["push_type"] == "auto"
-                        for r in self.push_history
-                    )
-                    
-                    if not already_pushed:
-                        record = self.push_material(
-                            patient_id, patient_name, material_id,
-                            push_type="auto", pushed_by="system"
-                        )
-                        if record:
-                            pushed.append(record)
+        # 症狀可為標準名稱或病人原話，由規則引擎統一轉為詞庫中的症狀名稱
+        for material_id in rule_engine.match_materials(post_op_day, symptoms, treatment):
+            if not self.has_pushed(patient_id, material_id, "auto"):
+                record = self.push_material(
+                    patient_id, patient_name, material_id,
+                    push_type="auto", pushed_by="system", post_op_day=post_op_day
+                )
+                if record:
+                    pushed.append(record)
         
         return pushed
 
@@ -859,9 +655,218 @@ def get_materials_by_category():
         cat = material["category"]
         if cat not in categories:
             categories[cat] = []
-        categories[cat].append({"key": key, **material})
+        categories[cat].append({"key": key, **material.metadata()})
     return categories
 
+def record_engagement(event, patient_id, material_id, post_op_day=None):
+    """記錄病人打開 / 讀完 / 提問等互動事件（類別由單張庫帶入）"""
+    material = EDUCATION_MATERIALS.get(material_id)
+    if material is None:
+        return None
+    return log_event(event, patient_id, material_id, material["category"], post_op_day)
+
 def get_material_by_id(material_id):
     """根據 ID 取得衛教單張"""
     return EDUCATION_MATERIALS.get(material_id)
+
+# ============================================
+# 全文檢索
+# ============================================
+# 中文沒有空白分詞：連續的中文字切成單字與相鄰兩字（bigram），英數字以整個詞為單位
+CJK_PATTERN = re.compile(r"[㐀-鿿豈-﫿]+|[a-z0-9]+")
+
+# 欄位權重（以重複詞頻實作）
+FIELD_WEIGHTS = {"title": 3, "description": 2, "content": 1}
+
+def tokenize(text):
+    """切詞：中文單字 + bigram，英數字整個詞"""
+    tokens = []
+    for run in CJK_PATTERN.findall((text or "").lower()):
+        if run.isascii():
+            tokens.append(run)
+            continue
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class MaterialSearchIndex:
+    """衛教單張的倒排索引，以 BM25 排序"""
+    
+    def __init__(self, materials, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # 詞 → {單張 key: 詞頻}
+        self.doc_len = {}
+        
+        for key, material in materials.items():
+            counts = {}
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(material.get(field, "")):
+                    counts[token] = counts.get(token, 0) + weight
+            self.doc_len[key] = sum(counts.values())
+            for token, tf in counts.items():
+                self.postings.setdefault(token, {})[key] = tf
+        
+        n = len(self.doc_len)
+        self.avg_len = (sum(self.doc_len.values()) / n) if n else 0
+        self.idf = {
+            token: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for token, docs in self.postings.items()
+        }
+    
+    def search(self, query, limit=5):
+        """回傳 [(單張 key, 分數), ...]，分數由高到低"""
+        scores = {}
+        for token in set(tokenize(query)):
+            docs = self.postings.get(token)
+            if not docs:
+                continue
+            idf = self.idf[token]
+            for key, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[key] / self.avg_len)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+_search_index = None
+_search_index_version = None
+
+def get_search_index():
+    """第一次搜尋時建立索引；單張內容更新後重建"""
+    global _search_index, _search_index_version
+    version = EDUCATION_MATERIALS.get_version()
+    if _search_index is None or version != _search_index_version:
+        _search_index = MaterialSearchIndex(EDUCATION_MATERIALS)
+        # 建立索引時會載入所有內容，版本以建立後為準
+        _search_index_version = EDUCATION_MATERIALS.get_version()
+    return _search_index
+
+def search_materials(query, limit=5, min_score=0.0):
+    """搜尋衛教單張，回傳 [{"key", "title", "category", "icon", "description", "score"}, ...]"""
+    results = []
+    for key, score in get_search_index().search(query, limit):
+        if score < min_score:
+            break
+        material = EDUCATION_MATERIALS[key]
+        results.append({
+            "key": key,
+            "title": material["title"],
+            "category": material["category"],
+            "icon": material.get("icon", "📄"),
+            "description": material.get("description", ""),
+            "score": round(score, 3)
+        })
+    return results
+
+# ============================================
+# 個人化推薦
+# ============================================
+# 分數權重
+RECOMMEND_WEIGHTS = {
+    "post_op_day": 3.0,   # 術後天數規則（天數越接近越高）
+    "symptom": 4.0,       # 近期回報的症狀（越近、分數越高越高）
+    "treatment": 3.0,     # 治療計畫
+    "priority": 0.5,      # 單張本身的重要程度（priority 1 最高）
+}
+READ_PENALTY = 0.1        # 已讀過的單張分數打折
+RECENT_REPORTS = 5        # 參考最近幾筆回報
+REPORT_DECAY = 0.7        # 每往前一筆回報的權重遞減
+RECOMMEND_CACHE_TTL = 600 # 秒；其他程序寫入的回報最晚在此時間後反映
+
+class MaterialRecommender:
+    """
+    依術後天數、近期症狀、治療計畫與閱讀紀錄為病人排序衛教單張
+    結果依病人快取；病人有新回報寫入後自動重新計算，已讀時呼叫 invalidate()
+    """
+    
+    def __init__(self, manager, engine):
+        self.manager = manager
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.cache = {}  # patient_id → (快取鍵, 建立時間, 結果)
+    
+    def invalidate(self, patient_id=None):
+        """清除病人（或全部）的推薦快取"""
+        with self.lock:
+            if patient_id is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(patient_id, None)
+    
+    def recommend(self, patient_id, post_op_day, treatment=None, limit=3):
+        """回傳 [{"key", "title", "icon", "category", "score", "reason"}, ...]"""
+        # 回報在背景寫入，送出當下可能還沒存檔；以病人最新回報的時間作為快取鍵的一部分，
+        # 存檔後自然重新計算，不依賴送出時的 invalidate()
+        report_version = get_patient_report_version(patient_id) if DATA_MANAGER_AVAILABLE else ""
+        cache_key = (post_op_day, treatment, limit, EDUCATION_MATERIALS.get_version(), report_version)
+        with self.lock:
+            cached = self.cache.get(patient_id)
+            if cached and cached[0] == cache_key and time.monotonic() - cached[1] < RECOMMEND_CACHE_TTL:
+                return cached[2]
+        
+        results = self._score(patient_id, post_op_day, treatment, limit)
+        with self.lock:
+            self.cache[patient_id] = (cache_key, time.monotonic(), results)
+        return results
+    
+    def _score(self, patient_id, post_op_day, treatment, limit):
+        scores, reasons = {}, {}
+        
+        def add(material_id, score, reason):
+            scores[material_id] = scores.get(material_id, 0.0) + score
+            if reason and score > reasons.get(material_id, (0, ""))[0]:
+                reasons[material_id] = (score, reason)
+        
+        # 術後天數：已到或即將到（2 天內）的規則，天數越接近分數越高
+        for day, rules in self.engine.by_day.items():
+            if day > post_op_day + 2:
+                continue
+            weight = RECOMMEND_WEIGHTS["post_op_day"] / (1 + abs(post_op_day - day) / 3)
+            for _, rule in rules:
+                for material_id in rule["materials"]:
+                    add(material_id, weight, f"術後第 {day} 天建議閱讀")
+        
+        # 近期症狀：越近的回報、分數越高權重越大
+        if DATA_MANAGER_AVAILABLE:
+            for i, report in enumerate(get_patient_reports(patient_id, limit=RECENT_REPORTS)):
+                severity = 1 + report.get("overall_score", 0) / 5
+                weight = RECOMMEND_WEIGHTS["symptom"] * severity * REPORT_DECAY ** i
+                for name in normalize_symptoms(report.get("symptoms")):
+                    for material_id in self.engine.match_materials(symptoms=[name]):
+                        add(material_id, weight, f"您回報了{name}")
+        
+        # 治療計畫
+        for material_id in self.engine.match_materials(treatment=treatment):
+            add(material_id, RECOMMEND_WEIGHTS["treatment"], "配合您的治療計畫")
+        
+        # 已讀的打折
+        read = self.manager.get_read_materials(patient_id)
+        
+        results = []
+        for material_id, score in scores.items():
+            material = EDUCATION_MATERIALS.get(material_id)
+            if not material:
+                continue
+            score += RECOMMEND_WEIGHTS["priority"] / material.get("priority", 3)
+            if material_id in read:
+                score *= READ_PENALTY
+            results.append({
+                "key": material_id,
+                "title": material["title"],
+                "icon": material.get("icon", "📄"),
+                "category": material["category"],
+                "score": round(score, 3),
+                "reason": "已閱讀，可再複習" if material_id in read else reasons.get(material_id, (0, ""))[1]
+            })
+        
+        return heapq.nlargest(limit, results, key=lambda r: r["score"])
+
+# 全域實例
+recommender = MaterialRecommender(education_manager, rule_engine)
+
+def recommend_materials(patient_id, post_op_day, treatment=None, limit=3):
+    """為病人推薦衛教單張"""
+    return recommender.recommend(patient_id, post_op_day, treatment, limit)
+
+def invalidate_recommendations(patient_id=None):
+    """病人有新回報或閱讀紀錄時呼叫"""
+    recommender.invalidate(patient_id)
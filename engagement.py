@@ -0,0 +1,217 @@
+"""
+AI-CARE Lung - 衛教互動紀錄
+============================
+
+記錄病人與衛教單張的互動事件，並即時維護統計：
+- 事件：pushed（推送）、opened（打開）、read（按下我已閱讀）、asked（按下有問題想問）
+- 統計：依單張、類別、術後天數分組的推送數、閱讀率與平均閱讀時間，查詢為常數時間
+  每筆閱讀依推送 ID 對應到它的推送；同一單張推送兩次就要讀兩次才算全部讀完
+- 匯出：逐行讀取事件檔輸出 CSV，不需把整個檔案載入記憶體
+
+事件以 JSON Lines 附加在檔案中；統計從檔案尾端增量更新，
+其他程序寫入的事件也會在下次查詢時併入。
+
+匯出與查看統計：
+    python engagement.py export --since 2024-12-01 > events.csv
+    python engagement.py summary material
+"""
+
+import csv
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+try:
+    from config import ENGAGEMENT_LOG_FILE
+except:
+    ENGAGEMENT_LOG_FILE = "data/engagement_events.jsonl"
+
+EVENT_TYPES = ("pushed", "opened", "read", "asked")
+DIMENSIONS = ("material", "category", "post_op_day")
+EXPORT_FIELDS = ["timestamp", "event", "patient_id", "material_id", "category", "post_op_day", "push_id"]
+
+def _empty_stats() -> Dict:
+    return {
+        "pushed": 0, "opened": 0, "asked": 0,
+        "read": 0,                  # 對應到推送的閱讀（閱讀率的分子），算在推送當時的分組
+        "other_read": 0,            # 沒有對應推送的閱讀（自己從單張庫讀、或推送早於紀錄檔）
+        "time_to_read_total": 0.0   # 推送到讀完的總秒數
+    }
+
+class EngagementLog:
+    def __init__(self, path: str = "data/engagement_events.jsonl"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offset = 0
+        self.stats = {dim: {} for dim in DIMENSIONS}
+        # 推送 ID → 尚未讀完的推送 (推送時間, 單張 ID, 類別, 推送時的術後天數)
+        self.pending = {}
+
+    # ============================================
+    # 寫入
+    # ============================================
+    def record(self, event: str, patient_id: str, material_id: str, category: str = "",
+               post_op_day: Optional[int] = None, push_id: Optional[str] = None) -> Dict:
+        """記錄一筆事件"""
+        if event not in EVENT_TYPES:
+            raise ValueError(f"未知的事件類型：{event}")
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "event": event,
+            "patient_id": patient_id,
+            "material_id": material_id,
+            "category": category,
+            "post_op_day": post_op_day,
+            "push_id": push_id
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._catch_up()
+        return entry
+
+    # ============================================
+    # 增量統計
+    # ============================================
+    def _catch_up(self):
+        """從上次讀到的位置讀入新事件（呼叫前需持有 lock）"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self.offset:
+            # 檔案被清空或輪替，重新計算
+            self.offset = 0
+            self.stats = {dim: {} for dim in DIMENSIONS}
+            self.pending = {}
+        if size == self.offset:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # 其他程序還在寫的最後一行，下次再讀
+                self.offset += len(raw)
+                try:
+                    self._apply(json.loads(raw))
+                except (ValueError, KeyError):
+                    continue
+
+    def _bucket(self, dim: str, key) -> Dict:
+        return self.stats[dim].setdefault(key, _empty_stats())
+
+    def _apply(self, entry: Dict):
+        event = entry["event"]
+        timestamp = datetime.fromisoformat(entry["timestamp"])
+        keys = (entry["material_id"], entry.get("category") or "", entry.get("post_op_day"))
+        push_id = entry.get("push_id")
+
+        if event == "pushed" and push_id:
+            self.pending[push_id] = (timestamp, *keys)
+        elif event == "read":
+            pushed = self.pending.pop(push_id, None) if push_id else None
+            if pushed is None:
+                event = "other_read"
+            else:
+                # 閱讀率與閱讀時間算在推送當時的分組
+                pushed_at, *keys = pushed
+                elapsed = max(0.0, (timestamp - pushed_at).total_seconds())
+                for dim, key in zip(DIMENSIONS, keys):
+                    self._bucket(dim, key)["time_to_read_total"] += elapsed
+
+        for dim, key in zip(DIMENSIONS, keys):
+            self._bucket(dim, key)[event] += 1
+
+    # ============================================
+    # 查詢
+    # ============================================
+    def get_stats(self, dimension: str, key) -> Dict:
+        """單一分組的統計，例如 get_stats("material", "WOUND_CARE")"""
+        with self.lock:
+            self._catch_up()
+            bucket = self.stats[dimension].get(key)
+            return _summarize(bucket or _empty_stats())
+
+    def get_all_stats(self, dimension: str) -> Dict:
+        """某個維度所有分組的統計"""
+        with self.lock:
+            self._catch_up()
+            return {key: _summarize(bucket) for key, bucket in self.stats[dimension].items()}
+
+    # ============================================
+    # 匯出
+    # ============================================
+    def iter_events(self, since: str = None, until: str = None) -> Iterator[Dict]:
+        """逐筆讀出事件；since / until 為 ISO 日期或時間"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if since and entry["timestamp"] < since:
+                    continue
+                if until and entry["timestamp"] >= until:
+                    continue
+                yield entry
+
+    def export_csv(self, out, since: str = None, until: str = None) -> int:
+        """以 CSV 串流寫出事件，回傳筆數"""
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        count = 0
+        for entry in self.iter_events(since, until):
+            writer.writerow(entry)
+            count += 1
+        return count
+
+def _summarize(bucket: Dict) -> Dict:
+    read = bucket["read"]
+    return {
+        "pushed": bucket["pushed"],
+        "opened": bucket["opened"],
+        "read": read,
+        "other_read": bucket["other_read"],
+        "asked": bucket["asked"],
+        "read_rate": round(read / bucket["pushed"], 3) if bucket["pushed"] else 0.0,
+        "avg_hours_to_read": round(bucket["time_to_read_total"] / read / 3600, 2) if read else None
+    }
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+def get_engagement_log(path: str = None) -> EngagementLog:
+    """每個紀錄檔共用一個實例"""
+    path = path or ENGAGEMENT_LOG_FILE
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = EngagementLog(path)
+        return _logs[path]
+
+def log_event(event: str, patient_id: str, material_id: str, category: str = "",
+              post_op_day: Optional[int] = None, push_id: Optional[str] = None):
+    """記錄衛教互動事件（寫入失敗不影響病人操作）"""
+    try:
+        return get_engagement_log().record(event, patient_id, material_id, category, post_op_day, push_id)
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "summary"
+    if command == "export":
+        args = sys.argv[2:]
+        since = args[args.index("--since") + 1] if "--since" in args else None
+        until = args[args.index("--until") + 1] if "--until" in args else None
+        get_engagement_log().export_csv(sys.stdout, since, until)
+    else:
+        dimension = sys.argv[2] if len(sys.argv) > 2 else "material"
+        stats = get_engagement_log().get_all_stats(dimension)
+        print(json.dumps({str(k): v for k, v in stats.items()}, ensure_ascii=False, indent=2))
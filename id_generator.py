@@ -0,0 +1,120 @@
+"""
+AI-CARE Lung - ID 產生器
+=========================
+
+全系統共用的 ID（回報、警示、介入紀錄、病人、衛教推送）：
+- 依時間排序：字串排序即建立時間順序，可直接當索引鍵
+- 同一程序內嚴格遞增（同一毫秒內以序號區分，時鐘倒退時沿用上一個時間）
+- 帶副本編號：多個副本同時產生也不會重複；fork 出的子程序會換一個副本編號
+
+格式：前綴 + 13 碼 Crockford Base32（64 位元：42 位元毫秒時間、10 位元副本編號、12 位元序號）
+"""
+
+import hashlib
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Tuple
+
+try:
+    from config import NODE_ID
+except:
+    NODE_ID = ""
+
+# 2024-01-01 00:00:00 UTC（毫秒）；42 位元可用到 2163 年
+EPOCH_MS = 1704067200000
+
+TIME_BITS = 42
+NODE_BITS = 10
+SEQ_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQ = (1 << SEQ_BITS) - 1
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ENCODED_LENGTH = 13
+
+def _configured_node_id() -> str:
+    value = os.environ.get("AICARE_NODE_ID") or NODE_ID
+    return "" if value is None else str(value)
+
+def _hashed_node_id(seed: str) -> int:
+    return int.from_bytes(hashlib.sha256(seed.encode("utf-8")).digest()[:2], "big") & MAX_NODE
+
+def _default_node_id() -> int:
+    """
+    副本編號：環境變數 AICARE_NODE_ID → config.NODE_ID → 主機名稱與程序編號的雜湊
+    多副本部署建議明確設定，雜湊只能降低而無法排除重複
+    """
+    value = _configured_node_id()
+    if value != "":
+        return int(value) & MAX_NODE
+    return _hashed_node_id(f"{socket.gethostname()}:{os.getpid()}")
+
+def _forked_node_id() -> int:
+    """
+    fork 出的子程序：與父程序同一毫秒產生會撞號，改用（設定的編號、主機名稱、程序編號）的雜湊
+    """
+    return _hashed_node_id(f"{_configured_node_id()}:{socket.gethostname()}:{os.getpid()}")
+
+def encode(value: int) -> str:
+    chars = []
+    for _ in range(ENCODED_LENGTH):
+        value, remainder = divmod(value, 32)
+        chars.append(ALPHABET[remainder])
+    return "".join(reversed(chars))
+
+def decode(text: str) -> int:
+    value = 0
+    for char in text:
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+class IdGenerator:
+    def __init__(self, node_id: int = None):
+        self.node_id = _default_node_id() if node_id is None else node_id & MAX_NODE
+        self.lock = threading.Lock()
+        self.last_ms = 0
+        self.seq = 0
+
+    def next_value(self) -> int:
+        with self.lock:
+            now = int(time.time() * 1000) - EPOCH_MS
+            if now > self.last_ms:
+                self.last_ms = now
+                self.seq = 0
+            else:
+                # 同一毫秒或時鐘倒退：沿用上一個時間，序號用完就借用下一毫秒
+                self.seq += 1
+                if self.seq > MAX_SEQ:
+                    self.last_ms += 1
+                    self.seq = 0
+            return (self.last_ms << (NODE_BITS + SEQ_BITS)) | (self.node_id << SEQ_BITS) | self.seq
+
+    def new_id(self, prefix: str = "") -> str:
+        return prefix + encode(self.next_value())
+
+    def reseed(self, node_id: int):
+        """子程序中換副本編號；鎖重新建立，避免 fork 當下被其他執行緒持有"""
+        self.lock = threading.Lock()
+        self.node_id = node_id & MAX_NODE
+        self.seq = 0
+
+# 全域實例（每個程序一個）
+id_generator = IdGenerator()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: id_generator.reseed(_forked_node_id()))
+
+def new_id(prefix: str = "") -> str:
+    """產生新 ID，例如 new_id("R") → "R0A95A6Z3NKW00" """
+    return id_generator.new_id(prefix)
+
+def parse_id(id_: str, prefix: str = "") -> Tuple[datetime, int, int]:
+    """解析 ID，回傳 (建立時間, 副本編號, 序號)"""
+    value = decode(id_[len(prefix):])
+    ms = (value >> (NODE_BITS + SEQ_BITS)) + EPOCH_MS
+    node = (value >> SEQ_BITS) & MAX_NODE
+    seq = value & MAX_SEQ
+    return datetime.fromtimestamp(ms / 1000), node, seq
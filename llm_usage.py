@@ -0,0 +1,190 @@
+"""
+AI-CARE Lung - GPT 用量控管
+============================
+
+1. 每位病人的呼叫頻率限制（token bucket）
+2. 全系統同時進行中的 OpenAI 呼叫上限
+3. 用量紀錄：每一輪的 prompt / completion / 快取命中 tokens 與延遲，可依日彙總；
+   本地路由直接回應的訊息也記一筆（status 為 local），可看出省下多少 GPT 呼叫
+
+查看每日用量：
+    python llm_usage.py
+    python llm_usage.py 2024-12-27
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+# ============================================
+# 頻率限制
+# ============================================
+class TokenBucket:
+    """容量 capacity，每秒補充 rate 個"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class LLMGuard:
+    """
+    呼叫 GPT 前先 acquire()：
+    - "ok": 可以呼叫，結束後必須 release()
+    - "rate_limited": 這位病人呼叫太頻繁
+    - "busy": 同時進行中的呼叫已達上限
+    """
+
+    def __init__(self, rate_per_minute: float = 6, burst: int = 6,
+                 max_concurrent: int = 8, acquire_timeout: float = 5.0, max_patients: int = 10000):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.acquire_timeout = acquire_timeout
+        self.max_patients = max_patients
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+
+    def acquire(self, patient_id: str) -> str:
+        with self.lock:
+            bucket = self.buckets.get(patient_id)
+            if bucket is None:
+                if len(self.buckets) >= self.max_patients:
+                    self._prune()
+                bucket = self.buckets[patient_id] = TokenBucket(self.burst, self.rate)
+            allowed = bucket.take()
+
+        if not allowed:
+            return "rate_limited"
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            # 沒有呼叫成功，不扣這位病人的額度
+            with self.lock:
+                bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+            return "busy"
+        return "ok"
+
+    def release(self):
+        self.slots.release()
+
+    def _prune(self):
+        """移除已補滿（近期沒有呼叫）的病人"""
+        now = time.monotonic()
+        for patient_id, bucket in list(self.buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity:
+                del self.buckets[patient_id]
+
+# ============================================
+# 用量紀錄
+# ============================================
+class UsageLedger:
+    """以 JSON Lines 逐筆附加，每行一輪呼叫"""
+
+    def __init__(self, path: str = "data/llm_usage.jsonl"):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, patient_id: str, model: str, status: str, latency_ms: float = 0,
+               prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0, **extra) -> Dict:
+        """記錄一輪呼叫"""
+        now = datetime.now()
+        entry = {
+            "timestamp": now.isoformat(),
+            "date": now.strftime("%Y-%m-%d"),
+            "patient_id": patient_id,
+            "model": model,
+            "status": status,  # ok, error, rate_limited, busy, local
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "latency_ms": round(latency_ms, 1),
+            **extra
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return entry
+
+    def summarize(self, date: Optional[str] = None) -> Dict:
+        """依日彙總：呼叫次數、tokens、快取命中率、平均延遲、各病人 tokens、各前綴的呼叫數、本地回應比例"""
+        summary = {}
+        if not os.path.exists(self.path):
+            return summary
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if date and entry["date"] != date:
+                    continue
+
+                day = summary.setdefault(entry["date"], {
+                    "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                    "latency_ms_total": 0.0, "statuses": {}, "per_patient": {}, "per_prefix": {},
+                    "per_route": {}
+                })
+                day["statuses"][entry["status"]] = day["statuses"].get(entry["status"], 0) + 1
+                if entry["status"] == "local":
+                    route = entry.get("route", "")
+                    day["per_route"][route] = day["per_route"].get(route, 0) + 1
+                if entry["status"] != "ok":
+                    continue
+
+                tokens = entry["prompt_tokens"] + entry["completion_tokens"]
+                day["calls"] += 1
+                day["prompt_tokens"] += entry["prompt_tokens"]
+                day["completion_tokens"] += entry["completion_tokens"]
+                day["cached_tokens"] += entry.get("cached_tokens", 0)
+                day["latency_ms_total"] += entry["latency_ms"]
+                day["per_patient"][entry["patient_id"]] = day["per_patient"].get(entry["patient_id"], 0) + tokens
+                prefix = entry.get("prefix_hash")
+                if prefix:
+                    day["per_prefix"][prefix] = day["per_prefix"].get(prefix, 0) + 1
+
+        for day in summary.values():
+            latency_total = day.pop("latency_ms_total")
+            day["avg_latency_ms"] = round(latency_total / day["calls"], 1) if day["calls"] else 0
+            day["cache_hit_rate"] = round(day["cached_tokens"] / day["prompt_tokens"], 3) if day["prompt_tokens"] else 0
+            local = day["statuses"].get("local", 0)
+            day["local_rate"] = round(local / (local + day["calls"]), 3) if local + day["calls"] else 0
+        return summary
+
+_guard = None
+_ledgers = {}
+_init_lock = threading.Lock()
+
+def get_llm_guard(rate_per_minute: float = 6, burst: int = 6, max_concurrent: int = 8) -> LLMGuard:
+    """全程序共用的頻率限制（第一次呼叫時的設定為準）"""
+    global _guard
+    with _init_lock:
+        if _guard is None:
+            _guard = LLMGuard(rate_per_minute, burst, max_concurrent)
+        return _guard
+
+def get_usage_ledger(path: str = "data/llm_usage.jsonl") -> UsageLedger:
+    """每個紀錄檔共用一個實例"""
+    with _init_lock:
+        if path not in _ledgers:
+            _ledgers[path] = UsageLedger(path)
+        return _ledgers[path]
+
+if __name__ == "__main__":
+    day = sys.argv[1] if len(sys.argv) > 1 else None
+    print(json.dumps(get_usage_ledger().summarize(day), ensure_ascii=False, indent=2))
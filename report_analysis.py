@@ -0,0 +1,377 @@
+"""
+AI-CARE Lung - 回報批次分析
+============================
+
+夜間離線重新分析已儲存的對話：
+- 讀取尚未分析的回報，多筆對話合併成一次 GPT 請求（JSON schema 結構化輸出）
+- 取得標準化的各症狀分數與注意事項（flags），批次寫回資料檔
+- 多個工作執行緒平行呼叫；每批結果先寫入檢查點，中斷後重跑會接續
+- 寫回時與線上的應用程式共用資料檔的跨程序寫入鎖，可在有病人使用時執行
+
+使用方式：
+    python report_analysis.py                       # 分析所有未分析的回報
+    python report_analysis.py --since 2024-12-01 --workers 8 --batch-size 20
+    python report_analysis.py --dry-run --limit 50  # 只分析、不寫回
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python report_analysis.py
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List
+
+from data_manager import alert_level, get_unanalyzed_reports, save_report_analyses
+from llm_usage import get_usage_ledger
+from symptom_lexicon import SYMPTOM_LEXICON, normalize_symptoms
+
+try:
+    from config import OPENAI_API_KEY, DEFAULT_MODEL
+except:
+    OPENAI_API_KEY = ""
+    DEFAULT_MODEL = "gpt-4o-mini"
+
+try:
+    from config import OPENAI_BASE_URL
+except:
+    OPENAI_BASE_URL = ""
+
+try:
+    from config import USAGE_LEDGER_FILE
+except:
+    USAGE_LEDGER_FILE = "data/llm_usage.jsonl"
+
+try:
+    from config import ANALYSIS_BATCH_SIZE, ANALYSIS_WORKERS, ANALYSIS_CHECKPOINT_FILE
+except:
+    ANALYSIS_BATCH_SIZE = 20
+    ANALYSIS_WORKERS = 4
+    ANALYSIS_CHECKPOINT_FILE = "data/analysis_checkpoint.jsonl"
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") or OPENAI_API_KEY
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or OPENAI_BASE_URL
+
+# 分析邏輯或 schema 改變時加一，舊結果會被重新分析
+ANALYSIS_VERSION = 1
+
+# 單次請求的對話字數上限（避免超過 context）
+MAX_BATCH_CHARS = 24000
+# 每筆回報最多帶入的訊息數
+MAX_MESSAGES_PER_REPORT = 40
+
+# 注意事項代碼 → 說明
+ANALYSIS_FLAGS = {
+    "fever": "提到發燒",
+    "wound_concern": "傷口紅腫、滲液或裂開",
+    "breathing_at_rest": "休息時也會喘",
+    "emotional_distress": "明顯焦慮或情緒低落",
+    "medication_issue": "用藥問題（忘記吃、副作用、自行停藥）",
+    "wants_callback": "希望個管師聯絡",
+}
+
+# ============================================
+# Prompt 與輸出格式
+# ============================================
+# 固定內容放在 system，每批請求的前綴相同
+ANALYSIS_PROMPT = f"""你是肺癌術後照護的病歷整理助手。
+使用者會提供多筆病人與 AI 助手的症狀回報對話（JSON），請逐筆整理：
+
+1. symptoms：病人本次回報的症狀，name 只能使用：{"、".join(SYMPTOM_LEXICON)}
+   - score 為病人自評的 0-10 分；沒有給分則為 null
+   - 病人明確表示沒有的症狀，negated 為 true
+2. flags：符合的注意事項代碼（可為空陣列）
+{chr(10).join(f"   - {code}：{desc}" for code, desc in ANALYSIS_FLAGS.items())}
+
+規則：
+- 只根據病人說的話，不要推測
+- 每一筆輸入都要有一筆結果，report_id 與輸入相同"""
+
+ANALYSIS_SCHEMA = {
+    "name": "report_analysis",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "report_id": {"type": "string"},
+                        "symptoms": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "name": {"type": "string", "enum": list(SYMPTOM_LEXICON)},
+                                    "score": {"type": ["integer", "null"]},
+                                    "negated": {"type": "boolean"}
+                                },
+                                "required": ["name", "score", "negated"],
+                                "additionalProperties": False
+                            }
+                        },
+                        "flags": {
+                            "type": "array",
+                            "items": {"type": "string", "enum": list(ANALYSIS_FLAGS)}
+                        }
+                    },
+                    "required": ["report_id", "symptoms", "flags"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["results"],
+        "additionalProperties": False
+    }
+}
+
+def format_report(report: Dict) -> Dict:
+    """一筆回報在請求中的表示方式"""
+    speakers = {"user": "病人", "assistant": "助手"}
+    conversation = report.get("conversation", [])[-MAX_MESSAGES_PER_REPORT:]
+    return {
+        "report_id": report["id"],
+        "conversation": [
+            f"{speakers.get(m.get('role'), m.get('role'))}：{m.get('content', '')}"
+            for m in conversation
+        ]
+    }
+
+def make_batches(reports: List[Dict], batch_size: int) -> List[List[Dict]]:
+    """依筆數與字數上限分批"""
+    batches, current, size = [], [], 0
+    for report in reports:
+        item_size = sum(len(m.get("content", "")) for m in report.get("conversation", []))
+        if current and (len(current) >= batch_size or size + item_size > MAX_BATCH_CHARS):
+            batches.append(current)
+            current, size = [], 0
+        current.append(report)
+        size += item_size
+    if current:
+        batches.append(current)
+    return batches
+
+def normalize_result(result: Dict, model: str) -> Dict:
+    """整理模型輸出：症狀名稱標準化、分數限制在 0-10、同一症狀取最高分"""
+    scores = {}
+    negated = []
+    for item in result.get("symptoms", []):
+        names = normalize_symptoms([item.get("name", "")])
+        if not names:
+            continue
+        name = names[0]
+        if item.get("negated"):
+            if name not in negated:
+                negated.append(name)
+            continue
+
+        score = item.get("score")
+        if isinstance(score, (int, float)):
+            score = max(0, min(10, int(score)))
+        else:
+            score = None
+        if name not in scores or (score is not None and (scores[name] is None or score > scores[name])):
+            scores[name] = score
+
+    flags = [f for f in dict.fromkeys(result.get("flags", [])) if f in ANALYSIS_FLAGS]
+    max_score = max((s for s in scores.values() if s is not None), default=0)
+    return {
+        "version": ANALYSIS_VERSION,
+        "model": model,
+        "analyzed_at": datetime.now().isoformat(),
+        "scores": scores,
+        "negated": [n for n in negated if n not in scores],
+        "flags": flags,
+        "max_score": max_score,
+        "alert_level": alert_level(max_score)
+    }
+
+# ============================================
+# 檢查點
+# ============================================
+class AnalysisCheckpoint:
+    """
+    已完成的分析結果逐批附加到 JSON Lines 檔（每行一筆回報）
+    寫回資料檔成功後才清除；中斷重跑時先把檢查點內的結果寫回
+    """
+
+    def __init__(self, path: str = "data/analysis_checkpoint.jsonl"):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict]:
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 中斷時寫到一半的最後一行
+                if entry["analysis"].get("version") == ANALYSIS_VERSION:
+                    done[entry["report_id"]] = entry["analysis"]
+        return done
+
+    def append(self, analyses: Dict[str, Dict]):
+        lines = "".join(
+            json.dumps({"report_id": rid, "analysis": a}, ensure_ascii=False) + "\n"
+            for rid, a in analyses.items()
+        )
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def clear(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+# ============================================
+# 分析流程
+# ============================================
+def get_client(api_key: str = None, base_url: str = None):
+    """建立 OpenAI client（延遲載入 openai 套件）"""
+    from openai import OpenAI
+    return OpenAI(api_key=api_key or OPENAI_API_KEY, base_url=(base_url or OPENAI_BASE_URL) or None)
+
+def analyze_batch(client, reports: List[Dict], model: str, retries: int = 2) -> Dict[str, Dict]:
+    """一次請求分析多筆回報，回傳 {report_id: analysis}；模型漏掉的回報留待下次"""
+    payload = json.dumps({"reports": [format_report(r) for r in reports]}, ensure_ascii=False)
+    ledger = get_usage_ledger(USAGE_LEDGER_FILE)
+
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": ANALYSIS_PROMPT},
+                    {"role": "user", "content": payload}
+                ],
+                temperature=0,
+                response_format={"type": "json_schema", "json_schema": ANALYSIS_SCHEMA}
+            )
+            results = json.loads(response.choices[0].message.content)["results"]
+        except Exception as e:
+            ledger.record("batch-analysis", model, "error",
+                          latency_ms=(time.perf_counter() - start) * 1000, error=type(e).__name__)
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+            continue
+
+        usage = response.usage
+        details = getattr(usage, "prompt_tokens_details", None)
+        ledger.record(
+            "batch-analysis", model, "ok",
+            latency_ms=(time.perf_counter() - start) * 1000,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+            reports=len(reports)
+        )
+
+        # 記下分析時的對話長度，之後合併進新對話就會重新分析
+        message_counts = {r["id"]: len(r.get("conversation", [])) for r in reports}
+        return {
+            r["report_id"]: {**normalize_result(r, model), "messages": message_counts[r["report_id"]]}
+            for r in results if r.get("report_id") in message_counts
+        }
+
+def run_analysis(client=None, model: str = None, since: str = None, limit: int = None,
+                 batch_size: int = ANALYSIS_BATCH_SIZE, workers: int = ANALYSIS_WORKERS,
+                 commit_every: int = 500, checkpoint_path: str = ANALYSIS_CHECKPOINT_FILE,
+                 dry_run: bool = False, progress=None) -> Dict:
+    """
+    分析所有未分析的回報
+    - 每批完成即寫入檢查點；累積 commit_every 筆後寫回資料檔一次
+    - dry_run: 不寫檢查點也不寫回資料檔，結果放在回傳值的 analyses
+    """
+    client = client or get_client()
+    model = model or DEFAULT_MODEL
+    checkpoint = AnalysisCheckpoint(checkpoint_path)
+    start = time.perf_counter()
+
+    # 上次中斷留下的結果先寫回
+    resumed = {} if dry_run else checkpoint.load()
+    if resumed:
+        save_report_analyses(resumed)
+
+    # 檢查點的結果寫回後就不再列為未分析；寫回時被略過的（期間又有新對話）重新分析
+    reports = get_unanalyzed_reports(ANALYSIS_VERSION, since, limit)
+    batches = make_batches(reports, batch_size)
+
+    stats = {
+        "reports": len(reports), "batches": len(batches), "resumed": len(resumed),
+        "analyzed": 0, "failed_batches": 0, "committed": len(resumed), "dry_run": dry_run
+    }
+    pending = {}
+    analyses = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(analyze_batch, client, batch, model) for batch in batches]
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception:
+                stats["failed_batches"] += 1
+                continue
+
+            stats["analyzed"] += len(results)
+            if dry_run:
+                analyses.update(results)
+            else:
+                checkpoint.append(results)
+                pending.update(results)
+                if len(pending) >= commit_every:
+                    stats["committed"] += save_report_analyses(pending)
+                    pending = {}
+            if progress:
+                progress(stats)
+
+    if not dry_run:
+        stats["committed"] += save_report_analyses(pending)
+        checkpoint.clear()
+    else:
+        stats["analyses"] = analyses
+
+    stats["elapsed"] = round(time.perf_counter() - start, 2)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="AI-CARE Lung 回報批次分析")
+    parser.add_argument("--since", help="只分析此日期之後的回報（YYYY-MM-DD）")
+    parser.add_argument("--limit", type=int, help="最多分析幾筆")
+    parser.add_argument("--batch-size", type=int, default=ANALYSIS_BATCH_SIZE, help="每次請求的回報數")
+    parser.add_argument("--workers", type=int, default=ANALYSIS_WORKERS, help="同時進行的請求數")
+    parser.add_argument("--commit-every", type=int, default=500, help="累積幾筆寫回資料檔一次")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--dry-run", action="store_true", help="只分析、不寫回")
+    args = parser.parse_args()
+
+    if not OPENAI_API_KEY:
+        raise SystemExit("請在 config.py 或環境變數 OPENAI_API_KEY 設定 API Key")
+
+    def progress(stats):
+        print(f"\r已分析 {stats['analyzed']} / {stats['reports']} 筆，失敗批次 {stats['failed_batches']}", end="", flush=True)
+
+    stats = run_analysis(
+        model=args.model, since=args.since, limit=args.limit, batch_size=args.batch_size,
+        workers=args.workers, commit_every=args.commit_every, dry_run=args.dry_run, progress=progress
+    )
+    print()
+    analyses = stats.pop("analyses", {})
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    for report_id, analysis in list(analyses.items())[:5]:
+        print(report_id, json.dumps(analysis, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
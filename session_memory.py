@@ -0,0 +1,163 @@
+"""
+AI-CARE Lung - Session 記憶體管理
+==================================
+
+追蹤每個連線中的 session 佔用的記憶體，
+並在病人閒置一段時間後釋放已儲存完成的對話內容（由該 session 下次執行時自行清空）。
+
+背景執行緒每輪把統計寫到 SESSION_MEMORY_STATS_FILE，查看目前用量：
+    python session_memory.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+try:
+    from config import SESSION_MEMORY_STATS_FILE
+except:
+    SESSION_MEMORY_STATS_FILE = "data/session_memory.json"
+
+class SessionRegistry:
+    """
+    - touch(): 每次畫面執行時登記 session 的大小與是否可回收
+    - 背景執行緒定期找出閒置的 session：
+      可回收的（回報已儲存、或尚未開始對話）標記為過期，
+      由該 session 下一次畫面執行時自己清空（pop_expired()），
+      背景執行緒不直接碰 session_state，避免與進行中的畫面執行互相干擾
+    """
+
+    def __init__(self, idle_timeout: float = 1800, interval: float = 60, stats_path: str = None):
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.stats_path = stats_path
+        self.sessions = {}
+        self.expired = {}  # session_id → 標記時間
+        self.lock = threading.Lock()
+        self.thread = None
+        self.reaped = 0
+
+    def touch(self, session_id: str, size: int, evictable: bool):
+        """登記 session 活動與目前大小（位元組）"""
+        with self.lock:
+            self.sessions[session_id] = {
+                "last_seen": time.time(),
+                "bytes": size,
+                "evictable": evictable
+            }
+        self._ensure_thread()
+
+    def reap(self, now: float = None) -> int:
+        """把閒置的 session 標記為過期，回傳新標記的數量"""
+        now = now or time.time()
+        marked = 0
+        with self.lock:
+            for session_id, entry in list(self.sessions.items()):
+                if now - entry["last_seen"] < self.idle_timeout:
+                    continue
+                if entry["evictable"]:
+                    self.expired[session_id] = now
+                    marked += 1
+                # 不論是否標記都移除登記，已關閉的分頁不再追蹤
+                del self.sessions[session_id]
+            # 再閒置一輪仍未回來的（分頁已關閉）不必保留標記
+            for session_id, marked_at in list(self.expired.items()):
+                if now - marked_at >= self.idle_timeout:
+                    del self.expired[session_id]
+            self.reaped += marked
+        return marked
+
+    def pop_expired(self, session_id: str) -> bool:
+        """session 是否已被標記為過期（取出後清除標記），由該 session 自己的畫面執行呼叫"""
+        with self.lock:
+            return self.expired.pop(session_id, None) is not None
+
+    def get_summary(self) -> Dict:
+        """各 session 佔用的位元組數"""
+        with self.lock:
+            per_session = {sid: entry["bytes"] for sid, entry in self.sessions.items()}
+            reaped = self.reaped
+        return {
+            "sessions": len(per_session),
+            "total_bytes": sum(per_session.values()),
+            "max_bytes": max(per_session.values(), default=0),
+            "reaped": reaped,
+            "per_session": per_session
+        }
+
+    def write_summary(self):
+        """把統計寫到 stats_path（各 session 只列位元組數，不寫出 session ID）"""
+        if not self.stats_path:
+            return
+        summary = self.get_summary()
+        summary["per_session"] = sorted(summary["per_session"].values(), reverse=True)
+        summary["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        summary["pid"] = os.getpid()
+        tmp_path = f"{self.stats_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.stats_path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(summary, f)
+            os.replace(tmp_path, self.stats_path)
+        except OSError:
+            pass
+
+    def _ensure_thread(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="session-reaper", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.reap()
+            self.write_summary()
+
+class SizeTracker:
+    """
+    逐筆累計 list 的估計大小，每次畫面執行不必重新序列化整段對話
+    add() / remove() 在附加或截短時更新；list 被整個換掉或長度對不上時，size() 才重新計算
+    """
+
+    def __init__(self):
+        self.entries = {}  # 名稱 → [list 物件, 長度, 位元組數]
+
+    def add(self, name: str, items: List, added: List):
+        entry = self.entries.get(name)
+        if entry and entry[0] is items and entry[1] == len(items) - len(added):
+            entry[1] = len(items)
+            entry[2] += sum(estimate_bytes(item) for item in added)
+
+    def remove(self, name: str, items: List, removed: List):
+        entry = self.entries.get(name)
+        if entry and entry[0] is items and entry[1] == len(items) + len(removed):
+            entry[1] = len(items)
+            entry[2] -= sum(estimate_bytes(item) for item in removed)
+
+    def size(self, name: str, items: List) -> int:
+        entry = self.entries.get(name)
+        if not entry or entry[0] is not items or entry[1] != len(items):
+            entry = self.entries[name] = [items, len(items), sum(estimate_bytes(item) for item in items)]
+        return entry[2]
+
+def estimate_bytes(value) -> int:
+    """以 JSON 長度估算佔用大小"""
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 0
+
+# 全域實例
+session_registry = SessionRegistry(stats_path=SESSION_MEMORY_STATS_FILE)
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else SESSION_MEMORY_STATS_FILE
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            print(json.dumps(json.load(f), ensure_ascii=False, indent=2))
+    except (OSError, ValueError):
+        print(f"尚無統計（{path}），應用程式啟動後每 {session_registry.interval:.0f} 秒更新")
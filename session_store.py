@@ -0,0 +1,190 @@
+"""
+AI-CARE Lung - Session 狀態儲存
+================================
+
+把病人的對話進度存到 SQLite，工作程序重啟或連線被分配到
+其他副本時，可以從最近一次存檔接續，不需要黏著式 session。
+
+- 對話狀態依 patient_id 存放，採延遲寫入（同一病人只寫最新一份）
+- 登入後發給瀏覽器一個 session token（放在網址參數），
+  新連線可用它找回病人身分；token 效期短，每次找回時換發新的，舊的立即作廢
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+class SessionStore:
+    def __init__(self, path: str = "data/sessions.db", flush_interval: float = 2.0,
+                 token_ttl: float = 3600):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.token_ttl = token_ttl
+        self.pending = {}  # patient_id -> 尚未寫入的狀態
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self._init_db()
+
+    # ============================================
+    # 資料庫
+    # ============================================
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """開連線執行一次交易（成功 commit、失敗 rollback），結束後關閉連線"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    patient_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS session_tokens (
+                    token TEXT PRIMARY KEY,
+                    patient_id TEXT NOT NULL,
+                    patient_info TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    # ============================================
+    # 對話狀態
+    # ============================================
+    def checkpoint(self, patient_id: str, state: Dict):
+        """排入延遲寫入；同一病人只保留最新狀態"""
+        payload = json.dumps(state, ensure_ascii=False, default=str)
+        with self.lock:
+            self.pending[patient_id] = (payload, time.time())
+        self._ensure_thread()
+
+    def load(self, patient_id: str) -> Optional[Dict]:
+        """讀取病人最近一次的對話狀態"""
+        with self.lock:
+            if patient_id in self.pending:
+                return json.loads(self.pending[patient_id][0])
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT state FROM sessions WHERE patient_id = ?", (patient_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, patient_id: str):
+        """刪除病人的對話狀態"""
+        with self.lock:
+            self.pending.pop(patient_id, None)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE patient_id = ?", (patient_id,))
+
+    def flush(self):
+        """把待寫入的狀態一次寫進資料庫"""
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return
+
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO sessions (patient_id, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(patient_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at "
+                    "WHERE excluded.updated_at >= sessions.updated_at",
+                    [(pid, payload, ts) for pid, (payload, ts) in batch.items()]
+                )
+        except sqlite3.Error:
+            # 寫入失敗時放回佇列，較新的狀態優先
+            with self.lock:
+                for pid, item in batch.items():
+                    if pid not in self.pending:
+                        self.pending[pid] = item
+            raise
+
+    def _ensure_thread(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="session-checkpoint", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                time.sleep(self.flush_interval)
+
+    # ============================================
+    # Session token
+    # ============================================
+    def create_token(self, patient_id: str, patient_info: Dict) -> str:
+        """登入後發給瀏覽器的 token"""
+        token = uuid.uuid4().hex
+        info = {k: v for k, v in patient_info.items() if k != "password"}
+        with self._connect() as conn:
+            conn.execute("DELETE FROM session_tokens WHERE expires_at < ?", (time.time(),))
+            conn.execute(
+                "INSERT INTO session_tokens (token, patient_id, patient_info, expires_at) VALUES (?, ?, ?, ?)",
+                (token, patient_id, json.dumps(info, ensure_ascii=False, default=str), time.time() + self.token_ttl)
+            )
+        return token
+
+    def rotate_token(self, token: str) -> Optional[Dict]:
+        """
+        以 token 找回病人身分並換發新 token（同一交易內作廢舊的），過期或已被換過則回傳 None
+        回傳 {"token", "patient_id", "patient_info"}
+        """
+        new_token = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT patient_id, patient_info FROM session_tokens WHERE token = ? AND expires_at >= ?",
+                (token, now)
+            ).fetchone()
+            if not row:
+                return None
+            # 兩個連線同時拿同一個 token 換發時，只有刪到舊 token 的那一個成功
+            if conn.execute("DELETE FROM session_tokens WHERE token = ?", (token,)).rowcount != 1:
+                return None
+            conn.execute(
+                "INSERT INTO session_tokens (token, patient_id, patient_info, expires_at) VALUES (?, ?, ?, ?)",
+                (new_token, row[0], row[1], now + self.token_ttl)
+            )
+        return {"token": new_token, "patient_id": row[0], "patient_info": json.loads(row[1])}
+
+    def revoke_token(self, token: str):
+        """登出時作廢 token"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM session_tokens WHERE token = ?", (token,))
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_session_store(path: str = "data/sessions.db", flush_interval: float = 2.0,
+                      token_ttl: float = 3600) -> SessionStore:
+    """每個資料庫路徑共用一個實例，程式結束前寫完待寫入的狀態"""
+    with _stores_lock:
+        if path not in _stores:
+            store = SessionStore(path, flush_interval, token_ttl)
+            atexit.register(store.flush)
+            _stores[path] = store
+        return _stores[path]
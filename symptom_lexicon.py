@@ -0,0 +1,107 @@
+"""
+AI-CARE Lung - 症狀詞庫
+========================
+
+症狀關鍵字、否定詞與 0-10 分數的單次比對。
+對話處理、備用回應與衛教自動推送共用同一份詞庫。
+"""
+
+import re
+from typing import Dict, List
+
+# ============================================
+# 詞庫
+# ============================================
+# 症狀名稱 → 關鍵字
+SYMPTOM_LEXICON = {
+    "呼吸困難": ['喘', '呼吸', '悶', '吸不到氣'],
+    "疼痛": ['痛', '疼', '刺'],
+    "咳嗽": ['咳', '痰'],
+    "疲勞": ['累', '疲', '沒力', '虛弱'],
+    "睡眠問題": ['睡', '失眠'],
+    "食慾不振": ['吃', '食', '胃口'],
+    "焦慮": ['焦慮', '擔心', '緊張', '害怕'],
+    "傷口問題": ['傷口'],
+}
+
+# 回覆意圖 → 關鍵字
+INTENT_LEXICON = {
+    "positive": ['不錯', '還好', '好', '正常', '沒事', '很好'],
+    "complete": ['沒有', '沒了', '就這樣', '結束', '完成', '都沒'],
+}
+
+# 緊接在關鍵字前的否定詞（可夾一個程度副詞，如「不太喘」）
+NEGATION_WORDS = ['沒有', '不會', '不', '沒', '無']
+NEGATION_ADVERBS = ['怎麼', '太', '會', '再', '很']
+
+# ============================================
+# 編譯
+# ============================================
+def _alternation(words: List[str]) -> str:
+    """長的詞優先，避免「沒」吃掉「沒有」"""
+    return "|".join(re.escape(w) for w in sorted(set(words), key=len, reverse=True))
+
+def _compile_lexicon():
+    """把所有關鍵字編成一個正規表示式，並建立關鍵字 → 類別的對照表"""
+    keyword_map = {}
+    for intent, words in INTENT_LEXICON.items():
+        for word in words:
+            keyword_map.setdefault(word, []).append(("intent", intent))
+    for symptom, words in SYMPTOM_LEXICON.items():
+        for word in words:
+            keyword_map.setdefault(word, []).append(("symptom", symptom))
+
+    pattern = re.compile(
+        r"(?P<score>(?<!\d)\d{1,2}(?!\d))"
+        r"|(?P<neg>" + _alternation(NEGATION_WORDS) + r")?"
+        r"(?:" + _alternation(NEGATION_ADVERBS) + r")?"
+        r"(?P<kw>" + _alternation(list(keyword_map)) + r")"
+    )
+    return pattern, keyword_map
+
+LEXICON_PATTERN, KEYWORD_MAP = _compile_lexicon()
+
+# ============================================
+# 比對
+# ============================================
+def extract_symptoms(text: str) -> Dict:
+    """
+    單次掃描取得：
+    - symptoms: 有提到的症狀（未被否定）
+    - negated: 被否定的症狀（如「不喘」）
+    - intents: 正向 / 結束等回覆意圖（未被否定）
+    - scores: 0-10 的分數（依出現順序）
+    """
+    result = {"symptoms": [], "negated": [], "intents": [], "scores": []}
+    if not text:
+        return result
+
+    for match in LEXICON_PATTERN.finditer(text.lower()):
+        if match.group("score") is not None:
+            score = int(match.group("score"))
+            if score <= 10:
+                result["scores"].append(score)
+            continue
+
+        negated = match.group("neg") is not None
+        for kind, name in KEYWORD_MAP[match.group("kw")]:
+            if kind == "intent":
+                target = result["intents"] if not negated else None
+            else:
+                target = result["negated"] if negated else result["symptoms"]
+            if target is not None and name not in target:
+                target.append(name)
+
+    # 同一句話裡又提到、又否定時，以有提到為準
+    result["negated"] = [s for s in result["negated"] if s not in result["symptoms"]]
+    return result
+
+def normalize_symptoms(symptoms: List[str]) -> List[str]:
+    """把症狀清單（標準名稱或病人原話）轉為標準症狀名稱"""
+    normalized = []
+    for item in symptoms or []:
+        names = [item] if item in SYMPTOM_LEXICON else extract_symptoms(item)["symptoms"]
+        for name in names:
+            if name not in normalized:
+                normalized.append(name)
+    return normalized
@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# 專案模組都在根目錄
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """在暫存目錄執行，資料檔（data/...）都寫到這裡"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
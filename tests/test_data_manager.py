@@ -0,0 +1,159 @@
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import data_manager
+from data_manager import get_score_series, lttb_indices
+
+def write_data(reports, alerts=None, patients=None):
+    data_manager.ensure_data_file()
+    data = {"patients": patients or {}, "reports": reports, "alerts": alerts or [], "interventions": []}
+    with open(data_manager.DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+# ============================================
+# LTTB 降採樣
+# ============================================
+def test_lttb_keeps_everything_under_threshold():
+    points = [(i, i % 3) for i in range(10)]
+    assert lttb_indices(points, 10) == list(range(10))
+    assert lttb_indices(points, 50) == list(range(10))
+    assert lttb_indices(points, 2) == list(range(10))
+
+def test_lttb_size_endpoints_and_order():
+    points = [(i, math.sin(i / 5)) for i in range(1000)]
+    indices = lttb_indices(points, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 999
+    assert indices == sorted(set(indices))
+
+def test_lttb_keeps_spike():
+    points = [(i, 0) for i in range(500)]
+    points[250] = (250, 10)
+    assert 250 in lttb_indices(points, 20)
+
+def test_score_series_downsamples_by_day(workdir):
+    start = date(2024, 1, 1)
+    reports = []
+    for i in range(40):
+        day = (start + timedelta(days=i)).isoformat()
+        for score in (i % 10, 1):
+            reports.append({"id": f"R{i}-{score}", "patient_id": "P1", "date": day, "overall_score": score})
+    reports.append({"id": "other", "patient_id": "P2", "date": "2024-01-01", "overall_score": 9})
+    write_data(reports)
+    
+    full = get_score_series("P1")
+    assert len(full) == 40
+    assert full[9] == {"date": "2024-01-10", "max": 9, "mean": 5.0, "count": 2}
+    
+    sampled = get_score_series("P1", max_points=10)
+    assert len(sampled) == 10
+    assert sampled[0]["date"] == "2024-01-01" and sampled[-1]["date"] == "2024-02-09"
+    
+    assert get_score_series("P1", since="2024-02-01")[0]["date"] == "2024-02-01"
+
+# ============================================
+# 重複回報整理
+# ============================================
+def make_report(report_id, timestamp, conversation, submission_id=None, score=0, symptoms=None):
+    return {
+        "id": report_id, "patient_id": "P1", "date": timestamp[:10], "timestamp": timestamp,
+        "submission_id": submission_id, "symptoms": symptoms or [], "scores": {},
+        "overall_score": score, "conversation": conversation
+    }
+
+def duplicated_data():
+    first = [{"id": "m1", "role": "assistant", "content": "早安"}, {"id": "m2", "role": "user", "content": "有點喘"}]
+    longer = first + [{"id": "m3", "role": "user", "content": "7 分"}]
+    reports = [
+        make_report("R1", "2024-01-01T09:00:00", first, "S1", 3, ["呼吸困難"]),
+        make_report("R2", "2024-01-01T09:05:00", longer, "S1", 7, ["呼吸困難", "疼痛"]),
+        make_report("R3", "2024-01-02T09:00:00", first, "S2", 1),
+    ]
+    alerts = [
+        {"id": "A1", "patient_id": "P1", "report_id": "R1", "level": "yellow", "status": "pending", "timestamp": "2024-01-01T09:00:00"},
+        {"id": "A2", "patient_id": "P1", "report_id": "R2", "level": "red", "status": "pending", "timestamp": "2024-01-01T09:05:00"},
+    ]
+    write_data(reports, alerts, {"P1": {"id": "P1", "total_reports": 3}})
+
+def test_dedupe_dry_run_reports_without_writing(workdir):
+    duplicated_data()
+    before = open(data_manager.DATA_FILE, encoding="utf-8").read()
+    
+    stats = data_manager.dedupe_reports(dry_run=True)
+    
+    assert stats == {"reports_before": 3, "reports_after": 2, "alerts_before": 2, "alerts_after": 1, "dry_run": True}
+    assert open(data_manager.DATA_FILE, encoding="utf-8").read() == before
+
+def test_dedupe_merges_into_earliest_and_keeps_worst_alert(workdir):
+    duplicated_data()
+    
+    data_manager.dedupe_reports()
+    
+    data = data_manager.load_data()
+    assert [r["id"] for r in data["reports"]] == ["R1", "R3"]
+    merged = data["reports"][0]
+    assert [m["id"] for m in merged["conversation"]] == ["m1", "m2", "m3"]
+    assert merged["symptoms"] == ["呼吸困難", "疼痛"]
+    assert merged["overall_score"] == 7
+    assert [(a["id"], a["report_id"]) for a in data["alerts"]] == [("A2", "R1")]
+    assert data["patients"]["P1"]["total_reports"] == 2
+    
+    # 再跑一次不會有變化
+    assert data_manager.dedupe_reports()["reports_after"] == 2
+
+def test_patient_report_version_ignores_other_patients(workdir):
+    write_data([
+        {"id": "R1", "patient_id": "P1", "date": "2024-01-01", "timestamp": "2024-01-01T09:00:00", "overall_score": 1},
+        {"id": "R2", "patient_id": "P1", "date": "2024-01-02", "timestamp": "2024-01-02T09:00:00",
+         "updated_at": "2024-01-02T10:00:00", "overall_score": 2},
+    ])
+    assert data_manager.get_patient_report_version("P1") == "2024-01-02T10:00:00"
+    assert data_manager.get_patient_report_version("P2") == ""
+    
+    data_manager.save_report("P2", {"symptoms": [], "scores": {}, "overall_score": 3, "conversation": []})
+    assert data_manager.get_patient_report_version("P1") == "2024-01-02T10:00:00"
+    assert data_manager.get_patient_report_version("P2") != ""
+
+def test_is_report_saved_by_submission_id(workdir):
+    assert not data_manager.is_report_saved("P1", "S1")
+    data_manager.save_report("P1", {"submission_id": "S1", "symptoms": [], "scores": {}, "overall_score": 1, "conversation": []})
+    assert data_manager.is_report_saved("P1", "S1")
+    assert not data_manager.is_report_saved("P2", "S1")
+    assert not data_manager.is_report_saved("P1", None)
+
+# ============================================
+# 跨程序寫入鎖
+# ============================================
+HOLD_LOCK_SCRIPT = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+import data_manager
+with data_manager._data_write_lock():
+    data = data_manager.load_data()
+    open("locked", "w").close()
+    time.sleep(0.5)
+    data["reports"].append({"id": "FROM_OTHER_PROCESS", "patient_id": "P2"})
+    data_manager.save_data(data)
+"""
+
+def test_write_lock_serializes_processes(workdir):
+    if data_manager.fcntl is None:
+        return
+    data_manager.ensure_data_file()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    other = subprocess.Popen([sys.executable, "-c", HOLD_LOCK_SCRIPT, root])
+    try:
+        while not os.path.exists("locked"):
+            assert other.poll() is None
+            time.sleep(0.01)
+        # 另一個程序讀完還沒寫回：這裡要等它寫完再讀，不能蓋掉它的回報
+        data_manager.save_report("P1", {"symptoms": [], "scores": {}, "overall_score": 1, "conversation": []})
+    finally:
+        other.wait(10)
+    ids = [r["patient_id"] for r in data_manager.load_data()["reports"]]
+    assert sorted(ids) == ["P1", "P2"]
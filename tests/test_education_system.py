@@ -0,0 +1,135 @@
+import json
+
+import data_manager
+from education_system import AutoPushRuleEngine, EducationPushManager, MaterialSearchIndex, search_materials, tokenize, recommend_materials
+
+# ============================================
+# 自動推送規則
+# ============================================
+RULES = [
+    {"id": "D1", "trigger_type": "post_op_day", "trigger_value": 1, "materials": ["A", "B"], "enabled": True},
+    {"id": "D1X", "trigger_type": "post_op_day", "trigger_value": 1, "materials": ["X"], "enabled": False},
+    {"id": "S1", "trigger_type": "symptom", "trigger_value": "睡眠", "materials": ["SLEEP"], "enabled": True},
+    {"id": "S2", "trigger_type": "symptom", "trigger_value": "疼痛", "materials": ["PAIN", "B"], "enabled": True},
+    {"id": "S3", "trigger_type": "symptom", "trigger_value": "頭暈", "materials": ["DIZZY"], "enabled": True},
+    {"id": "T1", "trigger_type": "treatment", "trigger_value": "化療", "materials": ["CHEMO"], "enabled": True},
+    {"id": "T2", "trigger_type": "treatment", "trigger_value": "標靶", "materials": ["TARGET"], "enabled": True},
+]
+
+def rule_ids(rules):
+    return [r["id"] for r in rules]
+
+def test_post_op_day_dispatch_skips_disabled():
+    engine = AutoPushRuleEngine(RULES)
+    assert rule_ids(engine.match(post_op_day=1)) == ["D1"]
+    assert engine.match(post_op_day=2) == []
+
+def test_symptom_trigger_matches_lexicon_name_and_raw_text():
+    engine = AutoPushRuleEngine(RULES)
+    # 「睡眠」是「睡眠問題」的一部分；病人原話先轉成症狀名稱
+    assert rule_ids(engine.match(symptoms=["睡眠問題"])) == ["S1"]
+    assert rule_ids(engine.match(symptoms=["晚上都睡不好"])) == ["S1"]
+    # 否定的症狀不觸發
+    assert engine.match(symptoms=["不痛"]) == []
+
+def test_symptom_trigger_outside_lexicon_matches_raw_text():
+    engine = AutoPushRuleEngine(RULES)
+    assert rule_ids(engine.match(symptoms=["起床有點頭暈"])) == ["S3"]
+    assert engine.match(symptoms=["呼吸困難"]) == []
+
+def test_treatment_keywords_in_one_pass():
+    engine = AutoPushRuleEngine(RULES)
+    assert rule_ids(engine.match(treatment="術後化療合併標靶治療")) == ["T1", "T2"]
+    assert engine.match(treatment="放射治療") == []
+
+def test_materials_follow_rule_order_without_duplicates():
+    engine = AutoPushRuleEngine(RULES)
+    materials = engine.match_materials(post_op_day=1, symptoms=["傷口很痛"], treatment="化療")
+    assert materials == ["A", "B", "PAIN", "CHEMO"]
+
+def test_recompile_picks_up_rule_changes():
+    rules = [dict(r) for r in RULES]
+    engine = AutoPushRuleEngine(rules)
+    rules[1]["enabled"] = True
+    engine.compile(rules)
+    assert rule_ids(engine.match(post_op_day=1)) == ["D1", "D1X"]
+
+# ============================================
+# 全文搜尋
+# ============================================
+DOCS = {
+    "WOUND": {"title": "傷口照護", "description": "換藥與清潔", "content": "保持傷口乾燥，每天觀察紅腫。"},
+    "BREATH": {"title": "呼吸訓練", "description": "深呼吸與咳嗽", "content": "每小時做十次深呼吸，用枕頭壓住傷口再咳嗽。"},
+    "FOOD": {"title": "營養建議", "description": "術後飲食", "content": "多吃蛋白質，少量多餐。"},
+}
+
+def test_tokenize_cjk_unigrams_bigrams_and_ascii_words():
+    assert tokenize("傷口 CT") == ["傷", "口", "傷口", "ct"]
+    assert tokenize("") == []
+
+def test_bm25_ranks_title_match_first():
+    index = MaterialSearchIndex(DOCS)
+    results = index.search("傷口")
+    assert [key for key, _ in results] == ["WOUND", "BREATH"]
+    assert results[0][1] > results[1][1] > 0
+
+def test_bm25_no_match_and_limit():
+    index = MaterialSearchIndex(DOCS)
+    assert index.search("xyz") == []
+    assert len(index.search("術後 呼吸 傷口", limit=2)) == 2
+
+def test_bm25_rare_term_weighs_more():
+    index = MaterialSearchIndex(DOCS)
+    # 「蛋白」只出現在一張，「傷口」出現在兩張
+    assert index.idf["蛋白"] > index.idf["傷口"]
+    assert index.search("蛋白 傷口")[0][0] == "FOOD"
+
+def test_search_materials_on_shipped_content():
+    results = search_materials("呼吸訓練", limit=3)
+    assert results[0]["key"] == "BREATHING_EXERCISE"
+    assert search_materials("呼吸訓練", min_score=1000) == []
+
+# ============================================
+# 推送紀錄
+# ============================================
+def test_pushes_and_reads_sync_between_instances(workdir):
+    writer, reader = EducationPushManager(), EducationPushManager()
+    writer.push_materials([("P1", "甲", "WOUND_CARE", 3), ("P1", "甲", "WOUND_CARE", 4), ("P1", "甲", "NO_SUCH")])
+    
+    assert reader.get_unread_count("P1") == 2
+    assert writer.mark_material_read("P1", "WOUND_CARE") == 2
+    assert reader.get_unread_count("P1") == 0
+    assert reader.get_material_read_stats("WOUND_CARE")["WOUND_CARE"]["read_rate"] == 1.0
+    
+    # 沒有推送的單張也記為讀過
+    assert writer.mark_material_read("P1", "SLEEP_GUIDE") == 0
+    assert reader.get_read_materials("P1") == {"WOUND_CARE", "SLEEP_GUIDE"}
+
+def test_report_writes_do_not_reload_pushes(workdir):
+    manager = EducationPushManager()
+    manager.push_material("P1", "甲", "WOUND_CARE")
+    offset = manager.offset
+    data_manager.save_report("P1", {"symptoms": [], "scores": {}, "overall_score": 1, "conversation": []})
+    assert manager.has_pushed("P1", "WOUND_CARE", "manual")
+    assert manager.offset == offset
+
+def test_legacy_pushes_are_migrated(workdir):
+    record = {
+        "id": "PUSHOLD", "patient_id": "P9", "patient_name": "舊", "material_id": "WOUND_CARE",
+        "material_title": "傷口", "category": "傷口照護", "push_type": "auto", "pushed_by": "system",
+        "pushed_at": "2024-01-01T00:00:00", "read_at": None, "status": "sent"
+    }
+    data_manager.ensure_data_file()
+    with open(data_manager.DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump({"patients": {}, "reports": [], "alerts": [], "interventions": [], "pushes": [record]}, f)
+    
+    manager = EducationPushManager()
+    assert manager.has_pushed("P9", "WOUND_CARE")
+    assert manager.get_unread_count("P9") == 1
+
+def test_recommendations_refresh_after_queued_report_lands(workdir):
+    assert all(r["reason"] != "您回報了焦慮" for r in recommend_materials("P1", 30))
+    data_manager.submit_report("P1", {"symptoms": ["焦慮"], "scores": {}, "overall_score": 6, "conversation": []})
+    recommend_materials("P1", 30)  # 寫入前的結果不應被沿用
+    data_manager.report_writer.flush(10)
+    assert recommend_materials("P1", 30)[0]["reason"] == "您回報了焦慮"
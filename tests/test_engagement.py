@@ -0,0 +1,50 @@
+import io
+
+from engagement import EngagementLog
+
+def test_reads_match_their_own_push(workdir):
+    log = EngagementLog("events.jsonl")
+    log.record("pushed", "P1", "WOUND", "傷口", 3, "PUSH1")
+    log.record("pushed", "P1", "WOUND", "傷口", 5, "PUSH2")
+    log.record("read", "P1", "WOUND", "傷口", 3, "PUSH1")
+    
+    stats = log.get_stats("material", "WOUND")
+    assert (stats["pushed"], stats["read"], stats["read_rate"]) == (2, 1, 0.5)
+    
+    log.record("read", "P1", "WOUND", "傷口", 5, "PUSH2")
+    assert log.get_stats("material", "WOUND")["read_rate"] == 1.0
+    assert log.get_stats("post_op_day", 3)["read"] == 1
+    assert log.get_stats("post_op_day", 5)["read"] == 1
+
+def test_reads_without_push_are_counted_separately(workdir):
+    log = EngagementLog("events.jsonl")
+    log.record("pushed", "P1", "WOUND", "傷口", 3, "PUSH1")
+    log.record("read", "P1", "WOUND", "傷口", 7)
+    log.record("read", "P1", "WOUND", "傷口", 7, "UNKNOWN")
+    
+    stats = log.get_stats("material", "WOUND")
+    assert (stats["read"], stats["other_read"], stats["read_rate"]) == (0, 2, 0.0)
+    assert stats["avg_hours_to_read"] is None
+
+def test_other_processes_are_folded_in_and_rebuild_matches(workdir):
+    writer, reader = EngagementLog("events.jsonl"), EngagementLog("events.jsonl")
+    writer.record("pushed", "P1", "WOUND", "傷口", 3, "PUSH1")
+    writer.record("opened", "P1", "WOUND", "傷口", 3)
+    writer.record("asked", "P1", "WOUND", "傷口", 3)
+    writer.record("read", "P1", "WOUND", "傷口", 3, "PUSH1")
+    
+    assert reader.get_all_stats("category") == writer.get_all_stats("category")
+    assert reader.get_stats("category", "傷口")["opened"] == 1
+    assert reader.get_stats("category", "傷口")["asked"] == 1
+
+def test_export_streams_filtered_csv(workdir):
+    log = EngagementLog("events.jsonl")
+    log.record("pushed", "P1", "WOUND", "傷口", 3, "PUSH1")
+    log.record("opened", "P1", "WOUND", "傷口", 3)
+    
+    out = io.StringIO()
+    assert log.export_csv(out) == 2
+    lines = out.getvalue().splitlines()
+    assert lines[0] == "timestamp,event,patient_id,material_id,category,post_op_day,push_id"
+    assert lines[1].endswith(",pushed,P1,WOUND,傷口,3,PUSH1")
+    assert log.export_csv(io.StringIO(), since="9999-01-01") == 0
@@ -0,0 +1,62 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from id_generator import ENCODED_LENGTH, IdGenerator, decode, encode, parse_id
+
+def test_encode_decode_round_trip():
+    for value in (0, 1, 31, 32, 2 ** 40 + 12345, 2 ** 64 - 1):
+        text = encode(value)
+        assert len(text) == ENCODED_LENGTH
+        assert decode(text) == value
+
+def test_ids_are_strictly_increasing_as_strings():
+    generator = IdGenerator(node_id=7)
+    ids = [generator.new_id("R") for _ in range(10000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert all(len(i) == 1 + ENCODED_LENGTH for i in ids)
+
+def test_clock_going_backwards_keeps_order(monkeypatch):
+    generator = IdGenerator(node_id=1)
+    now = [1_800_000_000.0]
+    monkeypatch.setattr("id_generator.time.time", lambda: now[0])
+    first = generator.new_id()
+    now[0] -= 5
+    second = generator.new_id()
+    assert second > first
+
+def test_threads_do_not_collide():
+    generator = IdGenerator(node_id=3)
+    results = []
+    def worker():
+        results.extend(generator.new_id() for _ in range(2000))
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(results)) == 8000
+
+def test_parse_id():
+    generator = IdGenerator(node_id=42)
+    created, node, seq = parse_id(generator.new_id("PUSH"), "PUSH")
+    assert node == 42 and seq == 0
+    assert abs(created - datetime.now()) < timedelta(seconds=5)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 fork")
+def test_forked_child_is_reseeded():
+    from id_generator import _forked_node_id, id_generator
+    id_generator.new_id()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_fd, f"{id_generator.node_id},{_forked_node_id()},{id_generator.seq}".encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    node, expected, seq = map(int, os.read(read_fd, 64).decode().split(","))
+    # 子程序換成依自己的程序編號算出的副本編號
+    assert node == expected
+    assert seq == 0
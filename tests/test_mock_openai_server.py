@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from mock_openai_server import (
+    CACHE_BLOCK_TOKENS, CACHE_MIN_TOKENS, CHARS_PER_TOKEN, MockState, build_reply, start_server
+)
+
+def long_prompt(tokens, filler="前"):
+    return filler * int(tokens * CHARS_PER_TOKEN)
+
+def test_short_prompts_are_never_cached():
+    state = MockState(0, 0)
+    prompt = long_prompt(CACHE_MIN_TOKENS // 2)
+    assert state.cached_tokens(prompt) == 0
+    assert state.cached_tokens(prompt) == 0
+
+def test_repeated_prefix_is_cached_in_blocks():
+    state = MockState(0, 0)
+    prefix = long_prompt(CACHE_MIN_TOKENS + CACHE_BLOCK_TOKENS)
+    assert state.cached_tokens(prefix + "第一輪") == 0
+    cached = state.cached_tokens(prefix + "第二輪，內容不同")
+    assert cached >= CACHE_MIN_TOKENS
+    assert cached % CACHE_BLOCK_TOKENS == 0
+    assert state.cached_prompt_tokens == cached
+
+def test_different_prefix_misses():
+    state = MockState(0, 0)
+    state.cached_tokens(long_prompt(CACHE_MIN_TOKENS * 2, "甲"))
+    assert state.cached_tokens(long_prompt(CACHE_MIN_TOKENS * 2, "乙")) == 0
+
+def test_build_reply_flow():
+    assert build_reply("有點喘")["symptoms"][0]["name"] == "呼吸困難"
+    assert "7 分" in build_reply("7")["reply"]
+    assert build_reply("就這樣")["completed"] is True
+
+def test_chat_completion_over_http():
+    server, state, base_url = start_server(0, 0, 0)
+    try:
+        body = json.dumps({
+            "model": "mock",
+            "messages": [{"role": "user", "content": "傷口有點痛"}]
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            f"{base_url}/chat/completions", data=body, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            result = json.load(response)
+    finally:
+        server.shutdown()
+    assert result["choices"][0]["message"]["content"]
+    assert result["usage"]["prompt_tokens"] > 0
+    assert state.requests == 1
@@ -0,0 +1,95 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import data_manager
+import report_analysis
+from mock_openai_server import start_server
+
+def conversation(text, turns=1):
+    messages = [{"role": "assistant", "content": "今天感覺怎麼樣？"}]
+    for _ in range(turns):
+        messages.append({"role": "user", "content": text})
+    return messages
+
+def seed_reports(count):
+    texts = ["有點喘", "傷口痛而且紅腫", "不太咳", "還不錯"]
+    data_manager.save_reports([
+        (f"P{i % 5}", {"submission_id": f"S{i}", "symptoms": [], "scores": {}, "overall_score": 0,
+                       "conversation": conversation(texts[i % 4])})
+        for i in range(count)
+    ])
+
+@pytest.fixture
+def mock_openai(workdir):
+    server, state, base_url = start_server(0, 0, 0)
+    try:
+        yield report_analysis.get_client("mock", base_url), state
+    finally:
+        server.shutdown()
+
+def test_make_batches_by_count_and_chars():
+    reports = [{"id": str(i), "conversation": conversation("喘")} for i in range(25)]
+    assert [len(b) for b in report_analysis.make_batches(reports, 10)] == [10, 10, 5]
+
+    long_text = "喘" * (report_analysis.MAX_BATCH_CHARS // 2 + 1)
+    reports = [{"id": str(i), "conversation": [{"role": "user", "content": long_text}]} for i in range(3)]
+    assert [len(b) for b in report_analysis.make_batches(reports, 10)] == [1, 1, 1]
+
+def test_run_analysis_writes_back_all_batches(mock_openai):
+    client, state = mock_openai
+    seed_reports(45)
+    writes = data_manager.get_write_stats()["writes"]
+
+    stats = report_analysis.run_analysis(client=client, model="mock", batch_size=10, workers=4, commit_every=20)
+
+    assert stats["batches"] == 5 and state.requests == 5
+    assert stats["analyzed"] == stats["committed"] == 45
+    # 每 20 筆寫回一次加上最後一次，不是每批一次
+    assert data_manager.get_write_stats()["writes"] - writes <= 3
+    assert data_manager.get_unanalyzed_reports(report_analysis.ANALYSIS_VERSION) == []
+    assert not os.path.exists(report_analysis.ANALYSIS_CHECKPOINT_FILE)
+
+    analysis = data_manager.load_data()["reports"][0]["analysis"]
+    assert analysis["version"] == report_analysis.ANALYSIS_VERSION
+    assert analysis["messages"] == 2
+
+def test_resume_from_partial_checkpoint(mock_openai):
+    client, state = mock_openai
+    seed_reports(30)
+
+    # 上次跑完兩批就中斷：結果只在檢查點，還沒寫回
+    reports = data_manager.get_unanalyzed_reports(report_analysis.ANALYSIS_VERSION)
+    checkpoint = report_analysis.AnalysisCheckpoint(report_analysis.ANALYSIS_CHECKPOINT_FILE)
+    for batch in report_analysis.make_batches(reports, 10)[:2]:
+        checkpoint.append(report_analysis.analyze_batch(client, batch, "mock"))
+    state.requests = 0
+
+    stats = report_analysis.run_analysis(client=client, model="mock", batch_size=10)
+
+    assert stats["resumed"] == 20
+    assert stats["reports"] == 10 and state.requests == 1
+    assert data_manager.get_unanalyzed_reports(report_analysis.ANALYSIS_VERSION) == []
+
+def test_merged_turns_are_reanalyzed(mock_openai):
+    client, state = mock_openai
+    seed_reports(3)
+    report_analysis.run_analysis(client=client, model="mock")
+
+    report = data_manager.load_data()["reports"][1]
+    data_manager.save_report(report["patient_id"], {
+        "submission_id": report["submission_id"], "symptoms": [], "scores": {}, "overall_score": 0,
+        "conversation": conversation("晚上又開始喘", turns=2)
+    })
+    unanalyzed = data_manager.get_unanalyzed_reports(report_analysis.ANALYSIS_VERSION)
+    assert [r["id"] for r in unanalyzed] == [report["id"]]
+
+    # 分析期間又合併了新對話的結果不寫回
+    assert data_manager.save_report_analyses({report["id"]: {"version": 1, "messages": 2}}) == 0
+
+    stats = report_analysis.run_analysis(client=client, model="mock")
+    assert stats["analyzed"] == 1
+    assert data_manager.load_data()["reports"][1]["analysis"]["messages"] == 3
@@ -0,0 +1,36 @@
+from symptom_lexicon import extract_symptoms, normalize_symptoms
+
+def test_extracts_symptoms_in_order():
+    result = extract_symptoms("今天有點喘，傷口痛")
+    assert result["symptoms"] == ["呼吸困難", "傷口問題", "疼痛"]
+    assert result["negated"] == []
+
+def test_negation_with_degree_adverb():
+    assert extract_symptoms("不太喘")["negated"] == ["呼吸困難"]
+    assert extract_symptoms("不太喘")["symptoms"] == []
+
+def test_negated_and_mentioned_in_same_text():
+    result = extract_symptoms("沒有咳嗽但是很累")
+    assert result["symptoms"] == ["疲勞"]
+    assert result["negated"] == ["咳嗽"]
+
+def test_mentioned_wins_over_negated():
+    result = extract_symptoms("不痛但是痛")
+    assert result["symptoms"] == ["疼痛"]
+    assert result["negated"] == []
+
+def test_scores_only_zero_to_ten():
+    assert extract_symptoms("我覺得 7 分")["scores"] == [7]
+    assert extract_symptoms("大概 120 分")["scores"] == []
+    assert extract_symptoms("從 3 變成 10")["scores"] == [3, 10]
+
+def test_intents():
+    assert "complete" in extract_symptoms("就這樣")["intents"]
+    assert "positive" in extract_symptoms("今天很好")["intents"]
+
+def test_empty_text():
+    assert extract_symptoms("") == {"symptoms": [], "negated": [], "intents": [], "scores": []}
+
+def test_normalize_mixes_names_and_raw_text():
+    assert normalize_symptoms(["疼痛", "晚上睡不好", "疼痛"]) == ["疼痛", "睡眠問題"]
+    assert normalize_symptoms(None) == []